@@ -0,0 +1,57 @@
+"""
+Compare two result files of benchmarks/suite.py case by case:
+
+    python -m benchmarks.compare before.json after.json --threshold 0.1
+
+Prints the throughput and peak-memory ratio (after / before) of every case
+both files contain and exits with status 1 if any case lost more than
+`threshold` of its throughput or grew its memory by more than that.
+"""
+import argparse
+import json
+import sys
+
+
+def compare(before, after, threshold=0.1):
+    """
+    List of (case, throughput ratio, memory ratio, regressed) for the
+    cases present in both result documents.
+    """
+    old = {r["case"]: r for r in before["results"]}
+    rows = []
+    for result in after["results"]:
+        base = old.get(result["case"])
+        if base is None:
+            continue
+        speed = (result["agent_steps_per_second"] /
+                 base["agent_steps_per_second"])
+        memory = (result["peak_memory_bytes"] /
+                  max(base["peak_memory_bytes"], 1))
+        regressed = speed < 1 - threshold or memory > 1 + threshold
+        rows.append((result["case"], speed, memory, regressed))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args(argv)
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    rows = compare(before, after, args.threshold)
+    print("{:<42} {:>10} {:>10}".format("case", "speed", "memory"))
+    for case, speed, memory, regressed in rows:
+        print("{:<42} {:>9.2f}x {:>9.2f}x{}".format(
+            case, speed, memory, "  REGRESSION" if regressed else ""))
+    for engine in sorted(set(before["scaling"]) & set(after["scaling"])):
+        print("{} scaling exponent: {:.2f} -> {:.2f}".format(
+            engine, before["scaling"][engine], after["scaling"][engine]))
+    return 1 if any(row[3] for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,224 @@
+"""
+Step-throughput benchmarks for EpsteinCivilViolence.
+
+Times model construction, single steps, whole runs and the data collector
+over grid sizes, densities, jail terms, movement and engines, and writes
+the results to a JSON file that benchmarks/compare.py can diff against the
+results of another revision:
+
+    python -m benchmarks.suite --output bench.json
+    python -m benchmarks.suite --profile quick --engines object numpy
+
+Throughput is reported as agent-steps per second; the "scaling" section
+holds the log-log slope of step time against the number of agents, which
+is 1 for a step whose cost is linear in the population and 2 for a
+quadratic one.
+"""
+import argparse
+import gc
+import itertools
+import json
+import math
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+
+import mesa
+import numpy as np
+
+from epstein_civil_violence.model import EpsteinCivilViolence
+
+SIZES = {"quick": (25, 50, 100), "default": (25, 50, 100, 200, 400),
+         "full": (25, 50, 100, 200, 400)}
+CITIZEN_DENSITIES = (0.5, 0.7)
+MAX_JAIL_TERMS = (4, 1000)
+MOVEMENT = (True, False)
+# size the one-factor sweeps over density, jail term and movement run at
+SWEEP_SIZE = 100
+BASE_PARAMETERS = dict(citizen_density=0.7, cop_density=0.074,
+                       max_jail_term=1000, movement=True)
+
+
+def benchmark_cases(profile="default", engines=("object",)):
+    """
+    List of (name, parameters) benchmark cases.
+    Args:
+        profile: "quick" and "default" sweep the grid size at the base
+            parameters and then density, jail term and movement one at a
+            time at SWEEP_SIZE; "full" runs every combination
+        engines: engines to run every case with
+    """
+    points = []
+    if profile == "full":
+        for size, density, jail, movement in itertools.product(
+                SIZES[profile], CITIZEN_DENSITIES, MAX_JAIL_TERMS, MOVEMENT):
+            points.append(dict(BASE_PARAMETERS, height=size, width=size,
+                               citizen_density=density,
+                               max_jail_term=jail, movement=movement))
+    else:
+        for size in SIZES[profile]:
+            points.append(dict(BASE_PARAMETERS, height=size, width=size))
+        sweep = dict(BASE_PARAMETERS, height=SWEEP_SIZE, width=SWEEP_SIZE)
+        for name, values in (("citizen_density", CITIZEN_DENSITIES),
+                             ("max_jail_term", MAX_JAIL_TERMS),
+                             ("movement", MOVEMENT)):
+            for value in values:
+                point = dict(sweep, **{name: value})
+                if point not in points:
+                    points.append(point)
+    cases = []
+    for engine, point in itertools.product(engines, points):
+        name = "{engine}-{height}x{width}-d{citizen_density}-j" \
+               "{max_jail_term}-{move}".format(
+                   engine=engine,
+                   move="move" if point["movement"] else "still", **point)
+        cases.append((name, dict(point, engine=engine)))
+    return cases
+
+
+def _best(timings):
+    return min(timings)
+
+
+def time_case(parameters, steps=10, repeats=3, seed=0):
+    """
+    Time one case.
+    Returns a dict with:
+        agents: number of agents
+        init_seconds: best time of the constructor
+        step_seconds: median time of one step() over `steps` steps
+        run_seconds: best time of run_model() for `steps` steps
+        collect_seconds: median time of one datacollector.collect()
+        agent_steps_per_second: agents * steps / run_seconds
+        peak_memory_bytes: peak traced allocation of construction plus
+            the run, measured in a separate, untimed pass
+    """
+    parameters = dict(parameters, max_iters=steps - 1, seed=seed)
+    init, run = [], []
+    for _ in range(repeats):
+        gc.collect()
+        start = time.perf_counter()
+        model = EpsteinCivilViolence(**parameters)
+        init.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        model.run_model()
+        run.append(time.perf_counter() - start)
+
+    model = EpsteinCivilViolence(**parameters)
+    agents = (len(model.engine.cell) if model.engine is not None
+              else model.schedule.get_agent_count())
+    step, collect = [], []
+    for _ in range(steps):
+        start = time.perf_counter()
+        model.step()
+        step.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        model.datacollector.collect(model)
+        collect.append(time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    model = EpsteinCivilViolence(**parameters)
+    model.run_model()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del model
+
+    run_seconds = _best(run)
+    return {
+        "agents": agents,
+        "init_seconds": _best(init),
+        "step_seconds": statistics.median(step),
+        "run_seconds": run_seconds,
+        "collect_seconds": statistics.median(collect),
+        "agent_steps_per_second": agents * steps / run_seconds,
+        "peak_memory_bytes": peak,
+    }
+
+
+def scaling_exponents(results):
+    """
+    Log-log slope of step time against the number of agents, per engine,
+    over the grid-size sweep at the base parameters.
+    """
+    exponents = {}
+    for engine in sorted({r["parameters"]["engine"] for r in results}):
+        points = [(r["agents"], r["step_seconds"]) for r in results
+                  if r["parameters"]["engine"] == engine and
+                  all(r["parameters"][name] == value
+                      for name, value in BASE_PARAMETERS.items())]
+        if len({agents for agents, _ in points}) < 2:
+            continue
+        x = np.log([agents for agents, _ in points])
+        y = np.log([seconds for _, seconds in points])
+        exponents[engine] = float(np.polyfit(x, y, 1)[0])
+    return exponents
+
+
+def _revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"],
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(profile="default", engines=("object",), steps=10, repeats=3,
+              seed=0, verbose=True):
+    """
+    Run every case of a profile and return the results document.
+    """
+    results = []
+    for name, parameters in benchmark_cases(profile, engines):
+        timings = time_case(parameters, steps, repeats, seed)
+        results.append(dict(case=name, parameters=parameters, **timings))
+        if verbose:
+            print("{:<42} {:>8} agents {:>12,.0f} agent-steps/s {:>8.1f} MB"
+                  .format(name, timings["agents"],
+                          timings["agent_steps_per_second"],
+                          timings["peak_memory_bytes"] / 2 ** 20),
+                  flush=True)
+    return {
+        "meta": {
+            "revision": _revision(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "mesa": mesa.__version__,
+            "machine": platform.machine(),
+            "profile": profile,
+            "steps": steps,
+            "repeats": repeats,
+            "seed": seed,
+        },
+        "results": results,
+        "scaling": scaling_exponents(results),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--profile", choices=sorted(SIZES),
+                        default="default")
+    parser.add_argument("--engines", nargs="+", default=["object"],
+                        choices=["object", "numpy"])
+    parser.add_argument("--steps", type=int, default=10)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench.json",
+                        help="JSON file the results are written to")
+    args = parser.parse_args(argv)
+    document = run_suite(args.profile, args.engines, args.steps,
+                         args.repeats, args.seed)
+    for engine, exponent in document["scaling"].items():
+        if math.isfinite(exponent):
+            print("{} step time ~ agents^{:.2f}".format(engine, exponent))
+    with open(args.output, "w") as f:
+        json.dump(document, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,39 @@
 import math
 
-from mesa import Agent
+from .schedule import JailQueueActivation
+from .states import (ACTIVE, BREEDS, CITIZEN, CONDITION_CODES, CONDITIONS, COP,
+                     CORRUPTED, HONEST, JAILED, MORAL_STATE_CODES,
+                     MORAL_STATES, QUIESCENT, SUSCEPTIBLE, Breed)
+
+
+class Agent:
+    """
+    Base class of Citizen and Cop, with the interface of mesa.Agent
+    (unique_id, model, pos, step, advance and random) but declared in
+    __slots__, so that agents carry no per-instance __dict__. Subclasses
+    list their own attributes in __slots__ too.
+
+    Attributes:
+        kind: Breed of the agent (class attribute)
+        breed: string view of kind, "citizen" or "cop" (class attribute)
+    """
+
+    __slots__ = ("unique_id", "model", "pos")
+
+    def __init__(self, unique_id, model):
+        self.unique_id = unique_id
+        self.model = model
+        self.pos = None
+
+    def step(self):
+        pass
+
+    def advance(self):
+        pass
+
+    @property
+    def random(self):
+        return self.model.random
 
 
 class Citizen(Agent):
@@ -21,7 +54,7 @@ class Citizen(Agent):
         vision: number of cells in each direction (N, S, E and W) that agent
             can inspect
         condition: Can be "Quiescent" or "Active;" deterministic function of
-            greivance, perceived risk, and
+            greivance, perceived risk, and; "Jailed" after an arrest
         grievance: deterministic function of hardship and regime_legitimacy;
             how aggrieved is agent at the regime?
         arrest_probability: agent's assessment of arrest probability, given
@@ -40,6 +73,12 @@ class Citizen(Agent):
             the honest moral_state to a "Susceptible" neighbor
         max_unemployed_saturation: approximate % of cells that are allowed to
            be occupied by unemployed agents
+        condition_code, moral_code: condition and moral_state as
+            states.Condition and states.MoralState codes, which the step
+            compares instead of the strings
+        release_step: under a JailQueueActivation schedule, the step the
+            citizen is (or was last) released from jail at, from which
+            jail_sentence is derived; None under other schedules
         hardship: Agent's 'perceived hardship (i.e., physical or economic
             privation).' Employment can alleviate hardship:
             self.random.random() -
@@ -51,6 +90,16 @@ class Citizen(Agent):
 
     """
 
+    kind = Breed.CITIZEN
+    breed = BREEDS[CITIZEN]
+    __slots__ = ("hardship", "legitimacy", "regime_legitimacy",
+                 "risk_aversion", "active_threshold", "threshold",
+                 "condition_code", "vision", "_jail_sentence", "grievance",
+                 "arrest_probability", "_is_employed", "moral_code",
+                 "corruption_transmission_prob", "honest_transmission_prob",
+                 "max_unemployed_saturation", "release_step", "neighborhood",
+                 "neighbors", "empty_neighbors")
+
     def __init__(
         self,
         unique_id,
@@ -67,7 +116,8 @@ class Citizen(Agent):
         moral_state,
         corruption_transmission_prob=0.06,
         honest_transmission_prob=0.02,
-        max_unemployed_saturation=0.45
+        max_unemployed_saturation=0.45,
+        count=True
     ):
         """
         Create a new Citizen.
@@ -90,7 +140,8 @@ class Citizen(Agent):
             is_employed: Variable indicating wheteher agent is employed (1) or
                 unemployed (0)
             moral_state: Can be "Corrupted", "Susceptible" or "Honest"
-                indicating which moral condition the agent is in
+                (or the corresponding states.MoralState) indicating which
+                moral condition the agent is in
             corruption_transmission_prob: prespecified probability of a
                 "Corrupt" agent transmitting the corrupt moral_state to a
                 "Susceptible" neighbor
@@ -98,9 +149,10 @@ class Citizen(Agent):
                 ransmitting the honest moral_state to a "Susceptible" neighbor
             max_unemployed_saturation: approximate % of cells that are allowed
                 to be occupied by unemployed agents
+            count: whether to add the citizen to model.citizen_counts; False
+                when the caller counts a whole population at once
         """
         super().__init__(unique_id, model)
-        self.breed = "citizen"
         self.pos = pos
         self.hardship = hardship
         self.legitimacy = legitimacy
@@ -108,16 +160,114 @@ class Citizen(Agent):
         self.risk_aversion = risk_aversion
         self.active_threshold = active_threshold
         self.threshold = threshold
-        self.condition = "Quiescent"
+        self.condition_code = QUIESCENT
         self.vision = vision
-        self.jail_sentence = 0
+        self._jail_sentence = 0
+        self.release_step = None
+        if isinstance(model.schedule, JailQueueActivation):
+            self.release_step = model.schedule.steps
         self.grievance = self.hardship * (1 - self.regime_legitimacy)
         self.arrest_probability = None
-        self.is_employed = is_employed
-        self.moral_state = moral_state
+        self._is_employed = is_employed
+        self.moral_code = MORAL_STATE_CODES[moral_state]
         self.corruption_transmission_prob = corruption_transmission_prob
         self.honest_transmission_prob = corruption_transmission_prob
         self.max_unemployed_saturation = max_unemployed_saturation
+        if count:
+            self.model.citizen_counts.add(self)
+
+    # condition, moral_state, is_employed and jail_sentence are the states
+    # the model keeps live counts of, so every assignment is reported to
+    # model.citizen_counts. condition and moral_state are stored as codes
+    # and read as strings; they can be assigned either.
+    @property
+    def condition(self):
+        return CONDITIONS[self.condition_code]
+
+    @condition.setter
+    def condition(self, value):
+        code = CONDITION_CODES[value]
+        if code != self.condition_code:
+            self.model.citizen_counts.change(
+                self, CONDITIONS[self.condition_code], CONDITIONS[code])
+            layers = self.model.live_layers
+            if layers is None:
+                self.condition_code = code
+                return
+            before = layers.categories(self)
+            self.condition_code = code
+            layers.changed(self, before)
+
+    @property
+    def moral_state(self):
+        return MORAL_STATES[self.moral_code]
+
+    @moral_state.setter
+    def moral_state(self, value):
+        code = MORAL_STATE_CODES[value]
+        if code != self.moral_code:
+            self.model.citizen_counts.change(
+                self, MORAL_STATES[self.moral_code], MORAL_STATES[code])
+            if self.model.contagion is not None:
+                self.model.contagion.changed(self, self.moral_code, code)
+            layers = self.model.live_layers
+            if layers is None:
+                self.moral_code = code
+                return
+            before = layers.categories(self)
+            self.moral_code = code
+            layers.changed(self, before)
+
+    @property
+    def is_employed(self):
+        return self._is_employed
+
+    @is_employed.setter
+    def is_employed(self, value):
+        if value != self._is_employed:
+            self.model.citizen_counts.change_employment(
+                self, self._is_employed, value)
+            self._is_employed = value
+
+    @property
+    def jail_sentence(self):
+        if self.release_step is None:
+            return self._jail_sentence
+        remaining = self.release_step - self.model.schedule.steps
+        return remaining if remaining > 0 else 0
+
+    @jail_sentence.setter
+    def jail_sentence(self, value):
+        if bool(value) != bool(self.jail_sentence):
+            self.model.citizen_counts.change_jailed(self, bool(value))
+            layers = self.model.live_layers
+            if layers is not None:
+                before = layers.categories(self)
+                self._set_jail_sentence(value)
+                layers.changed(self, before)
+                return
+        self._set_jail_sentence(value)
+
+    def _set_jail_sentence(self, value):
+        if self.release_step is None:
+            self._jail_sentence = value
+            return
+        # the schedule keeps jailed citizens out of the activation list
+        schedule = self.model.schedule
+        self.release_step = schedule.steps + value
+        if value:
+            schedule.jail(self)
+        else:
+            schedule.free(self)
+
+    def release(self):
+        """
+        Called by JailQueueActivation when the citizen's sentence is over.
+        """
+        self.model.citizen_counts.change_jailed(self, False)
+        layers = self.model.live_layers
+        if layers is not None and "actives" in layers.categories(self):
+            layers.add("actives", self.model.neighborhoods.cell(self.pos), 1)
 
     def step(self):
         """
@@ -159,14 +309,28 @@ class Citizen(Agent):
             target_neighbor: a target for corruption, chosen by a corrupt agent
                 or honest agent from its susceptible neighbors
         """
+        # with model.profiler set, each phase is timed separately
+        profiler = self.model.profiler
+        # random numbers come from model.draws, see rng.py
+        draws = self.model.draws
+        if profiler is not None:
+            profiler.start()
         if self.jail_sentence:
             self.jail_sentence -= 1
+            if profiler is not None:
+                profiler.lap("citizen", "jail")
             return  # no other changes or movements if agent is in jail.
         self.update_neighbors()
+        if profiler is not None:
+            profiler.lap("citizen", "neighbors")
         self.update_estimated_arrest_probability()
+        if profiler is not None:
+            profiler.lap("citizen", "arrest_probability")
         # update regime legitimacy based on corruption observed
         # in nehborhood (see definition below)
         self.update_estimated_regime_legitimacy()
+        if profiler is not None:
+            profiler.lap("citizen", "legitimacy")
         # update employment status each round (see definition below)
         # self.update_employment_status()
         # update the threshold for rebelling
@@ -175,10 +339,10 @@ class Citizen(Agent):
         net_risk = self.risk_aversion * self.arrest_probability
         # random weight to determine unemployment
         # contribution in revolt threshold
-        w_unemployment = self.random.uniform(0.03, 0.43)
+        w_unemployment = draws.w_unemployment()
         # random weight to determine corruption
         # contribution in revolt threshold
-        w_corruption = self.random.uniform(0.01, 0.03)
+        w_corruption = draws.w_corruption()
         # computing total contribution unemployment + corruption
         total_contribution = (
             (w_unemployment *
@@ -186,130 +350,158 @@ class Citizen(Agent):
             (w_corruption *
              self.model.get_corrupted_saturation(self.model, True)))
         if (
-            self.condition == "Quiescent"
+            self.condition_code == QUIESCENT
             and (self.grievance - net_risk) >
             self.threshold - total_contribution
             # - self.random.uniform(0.01,0.3) *
                 # (self.model.get_unemployed_saturation(self.model,False) +
                 # self.model.get_corrupted_saturation(self.model,False))
         ):
-            self.condition = "Active"
+            self.condition = ACTIVE
         elif (
-            self.condition == "Active" and (
+            self.condition_code == ACTIVE and (
                 (self.grievance - net_risk) <= self.threshold -
                 total_contribution)
         ):
-            self.condition = "Quiescent"
+            self.condition = QUIESCENT
+        if profiler is not None:
+            profiler.lap("citizen", "activation")
+
+        if self.model.agents_move and self.empty_neighbors:
+            new_pos = draws.choice(self.empty_neighbors)
+            self.model.move_agent(self, new_pos)
+        if profiler is not None:
+            profiler.lap("citizen", "movement")
+        # with an event-driven contagion phase (see contagion.py), the
+        # model spreads corruption and honesty once per tick instead
+        if self.model.contagion is None:
+            self.spread_moral_state(draws, profiler)
+        # randomly assign/take agents job. Adding randomness element to the
+        # employment/unemployment numbers. Each agent can earn or lose
+        # a job at each step.
+        if (self.kind == CITIZEN and self.is_employed == 1 and
+            self.model.get_unemployed_saturation(self.model, False) <
+                self.model.max_unemployed_saturation):
+            if (draws.random() < draws.job_loss_rate() *
+                    self.model.get_corrupted_saturation(self.model, False)):
+                self.is_employed = 0
+        elif self.kind == CITIZEN and self.is_employed == 0:
+            if (draws.random() < draws.job_gain_rate() *
+                    self.model.get_honest_saturation(self.model, False)):
+                self.is_employed = 1
+        if profiler is not None:
+            profiler.lap("citizen", "employment")
 
-        if self.model.movement and self.empty_neighbors:
-            new_pos = self.random.choice(self.empty_neighbors)
-            self.model.grid.move_agent(self, new_pos)
+    def spread_moral_state(self, draws, profiler):
+        """
+        Try to pass a Corrupted or Honest moral state on to a Susceptible
+        neighbor, see step().
+        """
         # agent has to be quiescent to become susceptible;
         # it wouldn't make sense that a rebel becomes corrupt
         # getting susceptible neighbors
         susceptible_neighbors = [a for a in self.neighbors if (
-            a.breed == "citizen" and a.moral_state == "Susceptible"
-            and a.condition == "Quiescent")]
+            a.kind == CITIZEN and a.moral_code == SUSCEPTIBLE
+            and a.condition_code == QUIESCENT)]
         # getting employed neighbors
         employed_non_corrupted = [a for a in self.neighbors if (
-            a.breed == "citizen" and
-            a.moral_state != "Corrupted" and a.is_employed == 1)]
+            a.kind == CITIZEN and
+            a.moral_code != CORRUPTED and a.is_employed == 1)]
+        if profiler is not None:
+            profiler.lap("citizen", "contagion_neighbors")
 
         # a corrupted agent can corrupt another Susceptible agent
-        if self.breed == "citizen" and self.moral_state == "Corrupted":
+        if self.kind == CITIZEN and self.moral_code == CORRUPTED:
             # checks if the agent has any neighbors
             if len(self.neighbors) > 1:
-                if self.moral_state == "Corrupted":
+                if self.moral_code == CORRUPTED:
                     # only spread corruption if the current corruption
                     # saturation < max_corruption_saturation.
                     if len(susceptible_neighbors) > 0:
                         # randomly scales the corruption
                         # transmission probability
                         corr_prob = (self.corruption_transmission_prob *
-                                     self.random.uniform(0.001, 0.1))
+                                     draws.corruption_scale())
                         # pick a target susceptible neighbor
                         target_neighbor = (
-                            self.random.choice(susceptible_neighbors))
+                            draws.choice(susceptible_neighbors))
                         # an unemployed agent is easier to be corrupted than
                         # an employed agent
                         if (target_neighbor.is_employed == 1 and
-                                self.random.random() < corr_prob or
+                                draws.random() < corr_prob or
                                 target_neighbor.is_employed == 0 and
-                                self.random.random() < corr_prob + 0.07):
+                                draws.random() < corr_prob + 0.07):
                             # ensures the percentage of corrupted is less than
                             # the maximum allowed
                             if (
                                     self.model.get_corrupted_saturation(
                                         self.model, False) <
                                     self.model.max_corruption_saturation):
-                                target_neighbor.moral_state = "Corrupted"
+                                target_neighbor.moral_state = CORRUPTED
                                 # assign a job to the newly corrupted agent &
                                 # take a job from another non corrupted agent
                                 if (len(employed_non_corrupted) > 0 and
-                                        self.random.random() < 0.06 and
+                                        draws.random() < 0.06 and
                                         target_neighbor.is_employed == 0):
                                     victim_neighbor = (
-                                        self.random.choice(
+                                        draws.choice(
                                             employed_non_corrupted))
                                     victim_neighbor.is_employed = 0
                                     target_neighbor.is_employed = 1
+        if profiler is not None:
+            profiler.lap("citizen", "corruption")
         # Honest agent can turn another Susceptible agent to honest
-        if self.breed == "citizen" and self.moral_state == "Honest":
+        if self.kind == CITIZEN and self.moral_code == HONEST:
 
             if len(self.neighbors) > 1:
                 if len(susceptible_neighbors) > 0:
-                    target_neighbor = self.random.choice(susceptible_neighbors)
+                    target_neighbor = draws.choice(susceptible_neighbors)
                     honest_prob = (self.honest_transmission_prob *
-                                   self.random.uniform(0.01, 0.1))
+                                   draws.honesty_scale())
                     if (
-                            self.random.random() < honest_prob and
+                            draws.random() < honest_prob and
                             self.model.get_honest_saturation(
                                 self.model, False) <
                             self.model.max_honest_saturation):
-                        target_neighbor.moral_state = "Honest"
-            # randomly assign/take agents job. Adding randomness element to the
-            # employment/unemployment numbers. Each agent can earn or lose
-            # a job at each step.
-        if (self.breed == "citizen" and self.is_employed == 1 and
-            self.model.get_unemployed_saturation(self.model, False) <
-                self.model.max_unemployed_saturation):
-            if (self.random.random() < self.random.uniform(0.0, 0.09) *
-                    self.model.get_corrupted_saturation(self.model, False)):
-                self.is_employed = 0
-        elif self.breed == "citizen" and self.is_employed == 0:
-            if (self.random.random() < self.random.uniform(0.0, 0.009) *
-                    self.model.get_honest_saturation(self.model, False)):
-                self.is_employed = 1
+                        target_neighbor.moral_state = HONEST
+        if profiler is not None:
+            profiler.lap("citizen", "honesty")
 
     def update_neighbors(self):
         """
         Look around and see who my neighbors are
         """
-        self.neighborhood = self.model.grid.get_neighborhood(
-            self.pos, moore=False, radius=1
-        )
+        self.neighborhood = self.model.neighborhoods.coords(self.pos)
         self.neighbors = self.model.grid.get_cell_list_contents(
             self.neighborhood)
 
-        self.empty_neighbors = [
-            c for c in self.neighborhood if self.model.grid.is_cell_empty(c)
-        ]
+        self.empty_neighbors = self.model.grid.empty_coords(
+            self.neighborhood)
 
     def update_estimated_arrest_probability(self):
         """
-        Based on the ratio of cops to actives in my neighborhood, estimate the
+        Based on the ratio of cops to actives in my neighborhood (or my
+        vision window, if the model uses vision), estimate the
         p(Arrest | I go active).
 
         """
-        cops_in_vision = len([c for c in self.neighbors if c.breed == "cop"])
-        actives_in_vision = 1.0  # citizen counts herself
-        for c in self.neighbors:
-            if (
-                c.breed == "citizen"
-                and c.condition == "Active"
-                and c.jail_sentence == 0
-            ):
-                actives_in_vision += 1
+        layers = self.model.vision_layers
+        if layers is not None:
+            cell = self.model.neighborhoods.cell(self.pos)
+            cops_in_vision = int(layers.count("cops", cell))
+            # citizen counts herself
+            actives_in_vision = 1.0 + int(layers.count("actives", cell))
+        else:
+            cops_in_vision = len([c for c in self.neighbors
+                                  if c.kind == COP])
+            actives_in_vision = 1.0  # citizen counts herself
+            for c in self.neighbors:
+                if (
+                    c.kind == CITIZEN
+                    and c.condition_code == ACTIVE
+                    and c.jail_sentence == 0
+                ):
+                    actives_in_vision += 1
         self.arrest_probability = 1 - math.exp(
             -1 * self.model.arrest_prob_constant *
             (cops_in_vision / actives_in_vision)
@@ -320,14 +512,20 @@ class Citizen(Agent):
         Based on the nr of corrupts in vision, update self.regime.legitimacy.
 
         """
-        corrupts_in_vision = len([c for c in self.neighbors if
-                                  c.breed == "citizen" and
-                                  c.moral_state == "Corrupted"])
-        others_in_vision = len([c for c in self.neighbors if
-                                c.breed == "citizen" and
-                                c.moral_state != "Corrupted"])
-
-        if (self.moral_state != "Corrupted" and self.jail_sentence == 0):
+        layers = self.model.vision_layers
+        if layers is not None:
+            cell = self.model.neighborhoods.cell(self.pos)
+            corrupts_in_vision = int(layers.count("corrupted", cell))
+            others_in_vision = int(layers.count("non_corrupted", cell))
+        else:
+            corrupts_in_vision = len([c for c in self.neighbors if
+                                      c.kind == CITIZEN and
+                                      c.moral_code == CORRUPTED])
+            others_in_vision = len([c for c in self.neighbors if
+                                    c.kind == CITIZEN and
+                                    c.moral_code != CORRUPTED])
+
+        if (self.moral_code != CORRUPTED and self.jail_sentence == 0):
             corruption_saturation = (self.model.get_corrupted_saturation(
                 self.model, exclude_jailed=True))
             self.regime_legitimacy = (self.legitimacy -
@@ -335,7 +533,7 @@ class Citizen(Agent):
                                        (1+others_in_vision)))
             unemployment_sat = (self.model.get_unemployed_saturation(
                 self.model, exclude_jailed=True))
-            weight = (self.random.uniform(0.3, 0.4) *
+            weight = (self.model.draws.legitimacy_weight() *
                       (unemployment_sat + corruption_saturation))
 
             self.regime_legitimacy = self.legitimacy - weight
@@ -370,8 +568,8 @@ class Citizen(Agent):
         """
 
         if(
-            self.is_employed == 0 and self.moral_state == "Honest" or
-            self.moral_state == "Susceptible"
+            self.is_employed == 0 and self.moral_code == HONEST or
+            self.moral_code == SUSCEPTIBLE
         ):
             self.hardship = self.random.random() - (
                 self.is_employed * self.random.uniform(0.05, 0.15))
@@ -385,6 +583,7 @@ class Cop(Agent):
     """
     A cop for life.  No defection.
     Summary of rule: Inspect local vision and arrest a random active agent.
+    Without vision (the default) the cop inspects its four adjacent cells.
 
     Attributes:
         unique_id: unique int
@@ -393,6 +592,11 @@ class Cop(Agent):
             able to inspect
     """
 
+    kind = Breed.COP
+    breed = BREEDS[COP]
+    __slots__ = ("vision", "neighborhood", "neighbors", "empty_neighbors",
+                 "vision_neighbors")
+
     def __init__(self, unique_id, model, pos, vision):
         """
         Create a new Cop.
@@ -404,7 +608,6 @@ class Cop(Agent):
             model: model instance
         """
         super().__init__(unique_id, model)
-        self.breed = "cop"
         self.pos = pos
         self.vision = vision
 
@@ -413,33 +616,46 @@ class Cop(Agent):
         Inspect local vision and arrest a random active agent. Move if
         applicable.
         """
+        profiler = self.model.profiler
+        draws = self.model.draws
+        if profiler is not None:
+            profiler.start()
         self.update_neighbors()
+        if profiler is not None:
+            profiler.lap("cop", "neighbors")
         active_neighbors = []
-        for agent in self.neighbors:
+        for agent in self.vision_neighbors:
             if (
-                agent.breed == "citizen"
-                and agent.condition == "Active"
+                agent.kind == CITIZEN
+                and agent.condition_code == ACTIVE
                 and agent.jail_sentence == 0
             ):
                 active_neighbors.append(agent)
         if active_neighbors:
-            arrestee = self.random.choice(active_neighbors)
-            sentence = self.random.randint(0, self.model.max_jail_term)
+            arrestee = draws.choice(active_neighbors)
+            sentence = draws.randint(0, self.model.max_jail_term)
             arrestee.jail_sentence = sentence
-            arrestee.condition = "Queit"
-        if self.model.movement and self.empty_neighbors:
-            new_pos = self.random.choice(self.empty_neighbors)
-            self.model.grid.move_agent(self, new_pos)
+            arrestee.condition = JAILED
+        if profiler is not None:
+            profiler.lap("cop", "arrest")
+        if self.model.agents_move and self.empty_neighbors:
+            new_pos = draws.choice(self.empty_neighbors)
+            self.model.move_agent(self, new_pos)
+        if profiler is not None:
+            profiler.lap("cop", "movement")
 
     def update_neighbors(self):
         """
-        Look around and see who my neighbors are.
+        Look around and see who my neighbors are, and who is within my
+        vision if the model uses vision.
         """
-        self.neighborhood = self.model.grid.get_neighborhood(
-            self.pos, moore=False, radius=1
-        )
+        self.neighborhood = self.model.neighborhoods.coords(self.pos)
         self.neighbors = (self.model.grid.get_cell_list_contents(
             self.neighborhood))
-        self.empty_neighbors = [
-            c for c in self.neighborhood if self.model.grid.is_cell_empty(c)
-        ]
+        self.empty_neighbors = self.model.grid.empty_coords(
+            self.neighborhood)
+        self.vision_neighbors = self.neighbors
+        if self.model.use_vision:
+            self.vision_neighbors = self.model.grid.get_cell_list_contents(
+                self.model.neighborhoods.coords(self.pos, self.vision,
+                                                moore=True))
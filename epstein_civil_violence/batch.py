@@ -0,0 +1,128 @@
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from .cache import ResultCache
+from .model import EpsteinCivilViolence
+
+
+def expand_parameters(parameters):
+    """
+    Turn a parameter specification into a list of keyword-argument dicts for
+    EpsteinCivilViolence.
+    Args:
+        parameters: either a list of dicts, used as is, or a dict mapping
+            argument names to a single value or to a list/tuple of values;
+            the dict form expands to the cartesian product of all lists
+    """
+    if isinstance(parameters, dict):
+        names = list(parameters)
+        values = [v if isinstance(v, (list, tuple)) else [v]
+                  for v in parameters.values()]
+        return [dict(zip(names, combination))
+                for combination in itertools.product(*values)]
+    return [dict(p) for p in parameters]
+
+
+def replicate_seeds(replicates, base_seed=0):
+    """
+    Deterministic, well separated seeds for `replicates` runs. The same
+    replicate index gets the same seed at every parameter point (common
+    random numbers).
+    """
+    return [int(np.random.SeedSequence([base_seed, i]).generate_state(1)[0])
+            for i in range(replicates)]
+
+
+def run_single(task):
+    """
+    Run one model and return its model-vars DataFrame tagged with the
+    run id, the parameters and the seed, and with the reason the run
+    stopped ("max_iters", or how it converged) in a "stop_reason" column.
+    Args:
+        task: (run_id, parameters, seed) tuple, optionally followed by a
+            dict of further model arguments that are the same for every run
+            (such as convergence) and not recorded as parameters, and by
+            the directory of a ResultCache to take the run from
+    """
+    run_id, parameters, seed = task[:3]
+    options = task[3] if len(task) > 3 else {}
+    cache = task[4] if len(task) > 4 else None
+    if cache is not None:
+        frame, _ = ResultCache(cache).run(dict(parameters, **options), seed)
+        frame = frame.copy()
+    else:
+        model = EpsteinCivilViolence(seed=seed, **parameters, **options)
+        model.run_model()
+        frame = model.datacollector.get_model_vars_dataframe()
+        frame.attrs["stop_reason"] = model.stop_reason
+    frame.index.name = "Step"
+    frame["stop_reason"] = frame.attrs["stop_reason"]
+    frame.insert(0, "seed", seed)
+    for name, value in reversed(list(parameters.items())):
+        frame.insert(0, name, value)
+    frame.insert(0, "run", run_id)
+    return frame
+
+
+def batch_tasks(parameters, seeds, options=None, cache=None):
+    """
+    All (run_id, parameters, seed, options, cache) tasks of a batch, in a
+    fixed order: parameter points in order of expand_parameters,
+    replicates within each.
+    """
+    points = expand_parameters(parameters)
+    return [(run_id, point, seed, dict(options or {}), cache)
+            for run_id, (point, seed) in enumerate(
+                itertools.product(points, seeds))]
+
+
+def run_batch(parameters, replicates=1, base_seed=0, seeds=None,
+              workers=None, chunksize=None, convergence=None, cache=None):
+    """
+    Run EpsteinCivilViolence over a parameter grid and replicate seeds on a
+    process pool, yielding each run's model-vars DataFrame as soon as it
+    (and every run submitted before it) is done.
+
+    Each run is fully determined by its parameters and seed, and results
+    come back in task order, so the output does not depend on the number
+    of workers.
+    Args:
+        parameters: parameter grid or list, see expand_parameters
+        replicates: number of replicates per parameter point
+        base_seed: seed the replicate seeds are derived from
+        seeds: explicit list of replicate seeds (overrides replicates and
+            base_seed)
+        workers: number of worker processes (default: one per CPU); 1 runs
+            in this process
+        chunksize: tasks sent to a worker at a time; defaults to spreading
+            the tasks over about four chunks per worker
+        convergence: convergence settings for every run (see
+            EpsteinCivilViolence), so that runs that settle stop early
+        cache: directory of a ResultCache; runs found there are not
+            simulated again, and new runs are added to it
+    """
+    if seeds is None:
+        seeds = replicate_seeds(replicates, base_seed)
+    options = {} if convergence is None else {"convergence": convergence}
+    tasks = batch_tasks(parameters, seeds, options, cache)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers == 1:
+        yield from map(run_single, tasks)
+        return
+    if chunksize is None:
+        chunksize = max(1, len(tasks) // (4 * workers))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(run_single, tasks, chunksize=chunksize)
+
+
+def batch_dataframe(parameters, **kwargs):
+    """
+    Run a batch (see run_batch) and concatenate all runs into one
+    DataFrame.
+    """
+    return pd.concat(list(run_batch(parameters, **kwargs)))
@@ -0,0 +1,246 @@
+import glob
+import hashlib
+import inspect
+import json
+import os
+import tempfile
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from .model import EpsteinCivilViolence
+
+# constructor arguments that do not change a run's results
+IGNORED_ARGUMENTS = ("output", "keep_in_memory", "agent_history", "profile",
+                     "workers", "seed")
+
+
+@lru_cache(maxsize=None)
+def source_version():
+    """
+    Hash of the package's source files, used as the version of the code
+    that produced a cached result: any edit to the model invalidates the
+    cache. Computed once per process, since the code a process runs does
+    not change while it runs.
+    """
+    digest = hashlib.sha256()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for path in sorted(glob.glob(os.path.join(directory, "*.py"))):
+        digest.update(os.path.basename(path).encode())
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def full_parameters(parameters):
+    """
+    All constructor arguments of a run, with defaults filled in, minus the
+    ones that do not change its results.
+    """
+    signature = inspect.signature(EpsteinCivilViolence.__init__)
+    full = {name: p.default for name, p in signature.parameters.items()
+            if name != "self" and name not in IGNORED_ARGUMENTS}
+    unknown = set(parameters) - set(signature.parameters)
+    if unknown:
+        raise ValueError("unknown parameters: %s" %
+                         ", ".join(sorted(unknown)))
+    full.update((name, value) for name, value in parameters.items()
+                if name not in IGNORED_ARGUMENTS)
+    return full
+
+
+def _frame_arrays(prefix, frame):
+    frame = frame.reset_index()
+    arrays = {}
+    for name in frame.columns:
+        column = frame[name]
+        if column.dtype == object or pd.api.types.is_string_dtype(column):
+            missing = column.isna().to_numpy()
+            arrays[prefix + "missing/" + name] = missing
+            column = column.where(~missing, "").astype(str)
+            arrays[prefix + "str/" + name] = column.to_numpy(dtype=str)
+        else:
+            arrays[prefix + "num/" + name] = column.to_numpy()
+    return arrays
+
+
+def _frame_from_arrays(prefix, data, columns, index):
+    frame = {}
+    for name in columns:
+        if prefix + "str/" + name in data.files:
+            values = data[prefix + "str/" + name].astype(object)
+            values[data[prefix + "missing/" + name]] = None
+        else:
+            values = data[prefix + "num/" + name]
+        frame[name] = values
+    return pd.DataFrame(frame, columns=columns).set_index(index)
+
+
+class ResultCache:
+    """
+    Content-addressed on-disk cache of model runs. A run is identified by
+    a hash of all its constructor arguments (defaults included), its seed
+    and source_version(); the cached value is its model-vars DataFrame and,
+    if requested, its agent-vars DataFrame, stored in one compressed .npz
+    file per run (no pickle). The reason the run stopped is kept in the
+    model-vars frame's attrs["stop_reason"].
+
+    The cache holds at most `max_bytes`; when it grows beyond, the least
+    recently used runs are evicted. Reading a run counts as using it.
+
+    Attributes:
+        directory: directory the runs are stored in, created if missing
+        max_bytes: size limit of the directory
+        version: source_version() of the code the runs are keyed by
+    """
+
+    def __init__(self, directory, max_bytes=2 ** 30):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.version = source_version()
+
+    def key(self, parameters, seed, agents=False):
+        """
+        Cache key of a run.
+        """
+        if seed is None:
+            raise ValueError("only seeded runs can be cached")
+        parameters = dict(parameters)
+        if not agents:
+            parameters["agent_fields"] = None
+        document = json.dumps({"parameters": full_parameters(parameters),
+                               "seed": seed, "version": self.version},
+                              sort_keys=True, default=str)
+        return hashlib.sha256(document.encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def get(self, parameters, seed, agents=False):
+        """
+        (model-vars, agent-vars or None) of a cached run, or None if the
+        run is not in the cache.
+        """
+        path = self.path(self.key(parameters, seed, agents))
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                meta = json.loads(data["header"].tobytes().decode())
+                model_vars = _frame_from_arrays(
+                    "model/", data, meta["model_columns"], "Step")
+                model_vars.index.name = None
+                model_vars.attrs["stop_reason"] = meta["stop_reason"]
+                agent_vars = None
+                if meta["agent_columns"] is not None:
+                    agent_vars = _frame_from_arrays(
+                        "agent/", data, meta["agent_columns"],
+                        ["Step", "AgentID"])
+        except FileNotFoundError:
+            return None
+        os.utime(path)
+        return model_vars, agent_vars
+
+    def put(self, parameters, seed, model_vars, agent_vars=None):
+        """
+        Store the results of a run, then evict old runs if the cache is
+        over its size limit.
+        """
+        agents = agent_vars is not None
+        path = self.path(self.key(parameters, seed, agents))
+        model_vars = model_vars.rename_axis("Step")
+        meta = {"model_columns": list(model_vars.reset_index().columns),
+                "agent_columns": None,
+                "stop_reason": model_vars.attrs.get("stop_reason")}
+        arrays = _frame_arrays("model/", model_vars)
+        if agents:
+            meta["agent_columns"] = list(agent_vars.reset_index().columns)
+            arrays.update(_frame_arrays("agent/", agent_vars))
+        header = np.frombuffer(json.dumps(meta).encode(), dtype=np.uint8)
+        # write to a temporary file first, so that concurrent readers never
+        # see a partial run
+        handle, temporary = tempfile.mkstemp(dir=self.directory,
+                                             suffix=".tmp")
+        with os.fdopen(handle, "wb") as f:
+            np.savez_compressed(f, header=header, **arrays)
+        os.replace(temporary, path)
+        self.evict()
+
+    def run(self, parameters, seed, agents=False):
+        """
+        (model-vars, agent-vars or None) of a run, from the cache if it is
+        there, else simulated and stored.
+        Args:
+            parameters: EpsteinCivilViolence arguments other than seed
+            seed: seed of the run
+            agents: whether agent variables are wanted too; without them
+                the run does not collect agent variables at all
+        """
+        cached = self.get(parameters, seed, agents)
+        if cached is not None:
+            return cached
+        parameters = dict(parameters, keep_in_memory=True, output=None)
+        if not agents:
+            parameters["agent_fields"] = None
+        model = EpsteinCivilViolence(seed=seed, **parameters)
+        model.run_model()
+        model_vars = model.datacollector.get_model_vars_dataframe()
+        model_vars.attrs["stop_reason"] = model.stop_reason
+        agent_vars = None
+        if agents:
+            agent_vars = model.datacollector.get_agent_vars_dataframe()
+        self.put(parameters, seed, model_vars, agent_vars)
+        return model_vars, agent_vars
+
+    def _entries(self):
+        entries = []
+        for path in glob.glob(os.path.join(self.directory, "*.npz")):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return sorted(entries)
+
+    def size(self):
+        """
+        Total size of the cached runs in bytes.
+        """
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        """
+        Delete least recently used runs until the cache fits max_bytes.
+        """
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def invalidate(self, parameters, seed, agents=None):
+        """
+        Drop one run from the cache; with agents=None both the run with
+        and the run without agent variables.
+        """
+        for with_agents in ((False, True) if agents is None else (agents,)):
+            try:
+                os.remove(self.path(self.key(parameters, seed,
+                                             with_agents)))
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        """
+        Drop every run from the cache.
+        """
+        for _, _, path in self._entries():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,262 @@
+import json
+
+import numpy as np
+
+from .agent import Citizen, Cop
+from .history import AgentHistory
+from .schedule import JailQueueActivation
+from .states import CITIZEN, COP
+
+FORMAT_VERSION = 1
+
+CITIZEN_FLOATS = ("hardship", "legitimacy", "regime_legitimacy",
+                  "risk_aversion", "active_threshold", "threshold",
+                  "grievance", "arrest_probability",
+                  "corruption_transmission_prob", "honest_transmission_prob",
+                  "max_unemployed_saturation")
+ENGINE_ARRAYS = ("cell", "breed", "hardship", "risk_aversion", "threshold",
+                 "grievance", "regime_legitimacy", "arrest_probability",
+                 "jail_sentence", "is_employed", "moral_state", "condition",
+                 "cell_agent")
+
+
+def _agent_arrays(model):
+    """
+    Columns describing every scheduled agent, in schedule order.
+    """
+    agents = model.schedule.agents
+    citizens = [a for a in agents if a.kind == CITIZEN]
+    arrays = {
+        "agent/unique_id": np.array([a.unique_id for a in agents],
+                                    dtype=np.int64),
+        "agent/is_cop": np.array([a.kind == COP for a in agents]),
+        "agent/pos": np.array([a.pos for a in agents],
+                              dtype=np.int64).reshape(-1, 2),
+        "agent/vision": np.array([a.vision for a in agents],
+                                 dtype=np.int64),
+        "citizen/jail_sentence": np.array(
+            [a.jail_sentence for a in citizens], dtype=np.int64),
+        "citizen/is_employed": np.array(
+            [a.is_employed for a in citizens], dtype=np.int64),
+        "citizen/condition": np.array(
+            [a.condition_code for a in citizens], dtype=np.int8),
+        "citizen/moral_state": np.array(
+            [a.moral_code for a in citizens], dtype=np.int8),
+    }
+    if isinstance(model.schedule, JailQueueActivation):
+        # the order free agents are shuffled in
+        arrays["schedule/active"] = np.array(list(model.schedule.active),
+                                             dtype=np.int64)
+    if model.contagion is not None:
+        # the order contagion sources are sampled by position in
+        for code, unique_ids in model.contagion.order().items():
+            arrays["contagion/%d" % code] = np.array(unique_ids,
+                                                     dtype=np.int64)
+    for name in CITIZEN_FLOATS:
+        arrays["citizen/" + name] = np.array(
+            [np.nan if getattr(a, name) is None else getattr(a, name)
+             for a in citizens], dtype=np.float64)
+    # the grid is saved cell by cell: a cell may hold an agent whose pos
+    # differs from the cell, and this has to survive the round trip
+    grid = model.grid
+    arrays["grid/occupant"] = np.array(
+        [-1 if cell is None else cell.unique_id
+         for column in grid.grid for cell in column],
+        dtype=np.int64)
+    arrays["grid/empties"] = np.array(sorted(grid.empties),
+                                      dtype=np.int64).reshape(-1, 2)
+    return arrays
+
+
+def save(model, path):
+    """
+    Write the complete state of an EpsteinCivilViolence model to `path`, a
+    compressed .npz archive of typed arrays plus a JSON header; nothing is
+    pickled.
+    """
+    version, internal, gauss_next = model.random.getstate()
+    meta = {
+        "format_version": FORMAT_VERSION,
+        "parameters": model.parameters,
+        "iteration": model.iteration,
+        "running": model.running,
+        "stop_reason": model.stop_reason,
+        "current_id": model.current_id,
+        "schedule_steps": model.schedule.steps,
+        "schedule_time": model.schedule.time,
+        "random_version": version,
+        "random_gauss_next": gauss_next,
+        "model_vars": list(model.datacollector.model_vars),
+        "agent_rows": model.datacollector._rows,
+    }
+    arrays = {"random/state": np.array(internal, dtype=np.uint32)}
+    if hasattr(model.draws, "getstate"):
+        generator_state, remaining = model.draws.getstate()
+        meta["draws_state"] = generator_state
+        for name, values in remaining.items():
+            arrays["draws/" + name] = np.array(values, dtype=np.float64)
+    if model.convergence is not None:
+        meta["convergence"] = [model.convergence.period,
+                               model.convergence.step]
+        arrays["convergence/history"] = np.array(
+            model.convergence.history, dtype=np.float64).reshape(
+                -1, len(model.convergence.series))
+    for name, values in model.datacollector.model_vars.items():
+        arrays["model_vars/" + name] = np.array(values)
+    if model.datacollector._columns is not None:
+        for name, column in model.datacollector._columns.items():
+            arrays["agent_vars/" + name] = column[:model.datacollector._rows]
+    if model.datacollector.history is not None:
+        for name, values in model.datacollector.history.arrays().items():
+            arrays["agent_history/" + name] = values
+    if model.engine is None:
+        arrays.update(_agent_arrays(model))
+    else:
+        engine = model.engine
+        meta["engine_tick"] = engine.tick
+        meta["engine_key"] = str(engine.stream.key)
+        for name in ENGINE_ARRAYS:
+            arrays["engine/" + name] = getattr(engine, name)
+    header = np.frombuffer(json.dumps(meta).encode(), dtype=np.uint8)
+    np.savez_compressed(path, header=header, **arrays)
+
+
+def _restore_agents(model, data, steps, time):
+    # the clock comes first: under JailQueueActivation sentences are
+    # stored as release steps
+    model.schedule = type(model.schedule)(model)
+    model.schedule.steps = steps
+    model.schedule.time = time
+    model.citizen_counts.free.clear()
+    model.citizen_counts.jailed.clear()
+    citizen_values = {name[len("citizen/"):]: data[name]
+                      for name in data.files if name.startswith("citizen/")}
+    agents = {}
+    c = 0
+    for unique_id, is_cop, pos, vision in zip(
+            data["agent/unique_id"].tolist(), data["agent/is_cop"].tolist(),
+            data["agent/pos"].tolist(), data["agent/vision"].tolist()):
+        pos = tuple(pos)
+        if is_cop:
+            agent = Cop(unique_id, model, pos, vision=vision)
+        else:
+            values = {name: column[c].item()
+                      for name, column in citizen_values.items()}
+            agent = Citizen(
+                unique_id, model, pos,
+                hardship=values["hardship"],
+                legitimacy=values["legitimacy"],
+                regime_legitimacy=values["regime_legitimacy"],
+                risk_aversion=values["risk_aversion"],
+                active_threshold=values["active_threshold"],
+                threshold=values["threshold"],
+                vision=vision,
+                is_employed=values["is_employed"],
+                moral_state=values["moral_state"],
+                corruption_transmission_prob=(
+                    values["corruption_transmission_prob"]),
+                max_unemployed_saturation=values["max_unemployed_saturation"],
+            )
+            agent.condition = values["condition"]
+            agent.jail_sentence = values["jail_sentence"]
+            agent.grievance = values["grievance"]
+            agent.honest_transmission_prob = (
+                values["honest_transmission_prob"])
+            probability = values["arrest_probability"]
+            agent.arrest_probability = (None if np.isnan(probability)
+                                        else probability)
+            c += 1
+        agents[unique_id] = agent
+        model.schedule.add(agent)
+
+    grid = model.grid
+    occupants = data["grid/occupant"].tolist()
+    for x in range(grid.width):
+        for y in range(grid.height):
+            occupant = occupants[x * grid.height + y]
+            grid.grid[x][y] = None if occupant < 0 else agents[occupant]
+    grid.empties = set(map(tuple, data["grid/empties"].tolist()))
+    grid.rebuild_occupancy()
+    if model.live_layers is not None:
+        model._update_vision_layers()
+    if model.contagion is not None:
+        model.contagion.rebuild({
+            int(name[len("contagion/"):]): data[name].tolist()
+            for name in data.files if name.startswith("contagion/")})
+    if "schedule/active" in data.files:
+        model.schedule.active.clear()
+        for unique_id in data["schedule/active"].tolist():
+            model.schedule.active[unique_id] = agents[unique_id]
+
+
+def load(cls, path, **overrides):
+    """
+    Rebuild a model saved with save(). Running the restored model gives
+    exactly the same results as continuing the saved one.
+    Args:
+        cls: model class
+        path: checkpoint file
+        overrides: constructor arguments that are not part of the saved
+            state, such as output; an output.RunOutput is attached once
+            the state is restored and continues the tables in its
+            directory (see RunOutput.resume)
+    """
+    output = overrides.pop("output", None)
+    with np.load(path, allow_pickle=False) as data:
+        meta = json.loads(data["header"].tobytes().decode())
+        if meta["format_version"] != FORMAT_VERSION:
+            raise ValueError("unsupported checkpoint format version %s" %
+                             meta["format_version"])
+        # construction sets up grid, index, reporters and collector; the
+        # population it draws is replaced below
+        model = cls(**dict(meta["parameters"], **overrides))
+        model.random.setstate((meta["random_version"],
+                               tuple(data["random/state"].tolist()),
+                               meta["random_gauss_next"]))
+        if "draws_state" in meta:
+            model.draws.setstate((meta["draws_state"], {
+                name[len("draws/"):]: data[name].tolist()
+                for name in data.files if name.startswith("draws/")}))
+        model.iteration = meta["iteration"]
+        model.running = meta["running"]
+        model.stop_reason = meta["stop_reason"]
+        if model.convergence is not None:
+            detector = model.convergence
+            detector.period, detector.step = meta["convergence"]
+            detector.history.clear()
+            detector.history.extend(
+                data["convergence/history"].tolist())
+        model.current_id = meta["current_id"]
+
+        if model.engine is None:
+            _restore_agents(model, data, meta["schedule_steps"],
+                            meta["schedule_time"])
+        else:
+            engine = model.engine
+            engine.tick = meta["engine_tick"]
+            engine.stream.key = int(meta["engine_key"])
+            for name in ENGINE_ARRAYS:
+                setattr(engine, name, data["engine/" + name].copy())
+            engine.sync_counts()
+        model.schedule.steps = meta["schedule_steps"]
+        model.schedule.time = meta["schedule_time"]
+
+        collector = model.datacollector
+        for name in meta["model_vars"]:
+            collector.model_vars[name] = data["model_vars/" + name].tolist()
+        collector._columns = None
+        collector._rows = 0
+        if meta["agent_rows"]:
+            collector._columns = {
+                name[len("agent_vars/"):]: data[name].copy()
+                for name in data.files if name.startswith("agent_vars/")}
+            collector._rows = meta["agent_rows"]
+        if collector.history is not None:
+            collector.history = AgentHistory.from_arrays(
+                collector.agent_fields,
+                {name[len("agent_history/"):]: data[name]
+                 for name in data.files if name.startswith("agent_history/")})
+    if output is not None:
+        output.resume(meta["schedule_steps"])
+        collector.output = output
+    return model
@@ -0,0 +1,194 @@
+import numpy as np
+
+from .rng import VARIATES
+from .states import CITIZEN, CORRUPTED, HONEST, QUIESCENT, SUSCEPTIBLE
+
+# extra probability of corrupting an unemployed target, as in Citizen.step
+UNEMPLOYED_BONUS = 0.07
+# probability that a newly corrupted, unemployed citizen takes the job of
+# an employed, non corrupted neighbor
+JOB_SWAP = 0.06
+
+
+def _mean(name):
+    low, high = VARIATES[name]
+    return (low + high) / 2
+
+
+class MemberList:
+    """
+    Set of agents that can also be indexed like a list, so members can be
+    sampled by position; adding and removing take constant time (removal
+    moves the last member into the freed slot).
+    """
+
+    def __init__(self):
+        self.members = []
+        self._slots = {}
+
+    def __len__(self):
+        return len(self.members)
+
+    def __getitem__(self, i):
+        return self.members[i]
+
+    def add(self, agent):
+        if agent.unique_id not in self._slots:
+            self._slots[agent.unique_id] = len(self.members)
+            self.members.append(agent)
+
+    def discard(self, agent):
+        slot = self._slots.pop(agent.unique_id, None)
+        if slot is None:
+            return
+        last = self.members.pop()
+        if slot < len(self.members):
+            self.members[slot] = last
+            self._slots[last.unique_id] = slot
+
+
+def geometric_skips(n, p, generator):
+    """
+    Sorted positions among n trials that succeed, each with probability p,
+    found by drawing the geometric gaps between successes rather than one
+    uniform per trial, so the cost is proportional to the successes.
+    """
+    if n == 0 or p <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if p >= 1:
+        return np.arange(n)
+    positions = []
+    last = -1
+    while True:
+        # enough gaps to pass n most of the time
+        block = int((n - last) * p * 1.2) + 16
+        steps = np.cumsum(generator.geometric(p, block)) + last
+        positions.append(steps[steps < n])
+        if steps[-1] >= n:
+            break
+        last = int(steps[-1])
+    return np.concatenate(positions)
+
+
+class EventContagion:
+    """
+    Event-driven corruption and honesty spread, run once per tick as a
+    model phase instead of inside every Citizen.step.
+
+    In Citizen.step every free Corrupted (Honest) citizen with a Susceptible,
+    Quiescent neighbor picks one of them and converts it with probability
+    corruption_transmission_prob times a uniform scale (plus
+    UNEMPLOYED_BONUS for an unemployed target when corrupting), so nearly
+    every attempt fails. Here the attempts that may succeed are sampled
+    directly: among the Corrupted (Honest) citizens, kept in MemberLists
+    that follow every change of moral state, candidates are picked with
+    geometric waiting times at the highest success probability of an
+    attempt, and each candidate's attempt is then accepted with its own
+    probability relative to that highest one (thinning). Since the scale
+    only enters through the comparison with one uniform draw, an attempt
+    succeeds with the probability of the original rule, that of the mean
+    scale. The cost of a tick grows with the number of candidates, not with
+    the number of citizens.
+
+    Attempts are processed in random order and the saturation caps
+    (max_corruption_saturation, max_honest_saturation) are checked before
+    every conversion, as in Citizen.step. As there, honesty spreads at
+    corruption_transmission_prob.
+
+    Attributes:
+        model: EpsteinCivilViolence the phase belongs to
+        sources: CORRUPTED and HONEST -> MemberList of the citizens in that
+            moral state
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.rebuild()
+
+    def rebuild(self, order=None):
+        """
+        Refill the member lists from the schedule's agents.
+        Args:
+            order: code -> unique_ids of the members in the order to list
+                them in, such as saved in a checkpoint; schedule order if
+                None
+        """
+        self.sources = {CORRUPTED: MemberList(), HONEST: MemberList()}
+        if order is not None:
+            agents = self.model.schedule._agents
+            for code, unique_ids in order.items():
+                for unique_id in unique_ids:
+                    self.sources[code].add(agents[unique_id])
+            return
+        for agent in self.model.schedule.agents:
+            if agent.kind == CITIZEN and agent.moral_code in self.sources:
+                self.sources[agent.moral_code].add(agent)
+
+    def order(self):
+        """
+        code -> unique_ids of the members of every list, in list order.
+        """
+        return {code: [agent.unique_id for agent in members.members]
+                for code, members in self.sources.items()}
+
+    def changed(self, citizen, old, new):
+        """
+        Record a change of a citizen's moral state from code `old` to code
+        `new`.
+        """
+        if old in self.sources:
+            self.sources[old].discard(citizen)
+        if new in self.sources:
+            self.sources[new].add(citizen)
+
+    def step(self, generator):
+        """
+        Run the contagion attempts of one tick, drawing from a
+        numpy.random.Generator.
+        """
+        m = self.model
+        corrupt = m.corruption_transmission_prob * _mean("corruption_scale")
+        honest = m.corruption_transmission_prob * _mean("honesty_scale")
+        highest = {CORRUPTED: corrupt + UNEMPLOYED_BONUS, HONEST: honest}
+        events = []
+        for code, members in self.sources.items():
+            chosen = geometric_skips(len(members), highest[code], generator)
+            events += [(code, members[i]) for i in chosen.tolist()]
+        for i in generator.permutation(len(events)).tolist():
+            code, source = events[i]
+            if source.moral_code != code or source.jail_sentence:
+                continue
+            neighbors = m.grid.get_cell_list_contents(
+                m.neighborhoods.coords(source.pos))
+            if len(neighbors) <= 1:
+                continue
+            susceptible = [a for a in neighbors if (
+                a.kind == CITIZEN and a.moral_code == SUSCEPTIBLE
+                and a.condition_code == QUIESCENT)]
+            if not susceptible:
+                continue
+            target = susceptible[int(generator.random() * len(susceptible))]
+            if code == HONEST:
+                if (m.get_honest_saturation(m, False) <
+                        m.max_honest_saturation):
+                    target.moral_state = HONEST
+                continue
+            probability = corrupt
+            if target.is_employed == 0:
+                probability += UNEMPLOYED_BONUS
+            elif target.is_employed != 1:
+                continue
+            if (generator.random() * highest[CORRUPTED] >= probability or
+                    m.get_corrupted_saturation(m, False) >=
+                    m.max_corruption_saturation):
+                continue
+            target.moral_state = CORRUPTED
+            employed_non_corrupted = [a for a in neighbors if (
+                a.kind == CITIZEN and a.moral_code != CORRUPTED
+                and a.is_employed == 1)]
+            if (employed_non_corrupted and target.is_employed == 0 and
+                    generator.random() < JOB_SWAP):
+                victim = employed_non_corrupted[
+                    int(generator.random() * len(employed_non_corrupted))]
+                victim.is_employed = 0
+                target.is_employed = 1
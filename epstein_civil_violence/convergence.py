@@ -0,0 +1,69 @@
+from collections import deque
+
+import numpy as np
+
+
+class ConvergenceDetector:
+    """
+    Watches model-level series and tells when a run has settled, either
+    into a fixed point or into a cycle, so the run can stop before
+    max_iters.
+
+    After every step update() records the current value of each series.
+    Once `window` steps are recorded (and at least `min_steps` steps have
+    run), the run has converged if, over the last `window` steps and the
+    `period` steps before them, the values of every series in the same
+    phase of the period span at most `tolerance`, for period 1 (a fixed
+    point: max - min <= tolerance over the window) or any period up to
+    `max_period` (a periodic outburst cycle); the shortest such period is
+    reported. Comparing whole phases rather than each value with the one
+    a period earlier keeps a series that drifts by up to `tolerance` per
+    step from counting as settled.
+
+    Attributes:
+        series: names of the model reporters to watch
+        window: number of consecutive steps that must repeat
+        tolerance: largest spread of the values in one phase that still
+            counts as a repeat
+        max_period: longest cycle looked for; 1 detects fixed points only
+        min_steps: steps to run before convergence is checked
+        period: period found once converged, else None
+        step: model step convergence was detected at, else None
+    """
+
+    SERIES = ("Active", "Jailed", "Corrupted", "Employed")
+
+    def __init__(self, series=SERIES, window=50, tolerance=0, max_period=1,
+                 min_steps=0):
+        if window < 1 or max_period < 1:
+            raise ValueError("window and max_period must be at least 1")
+        self.series = tuple(series)
+        self.window = window
+        self.tolerance = tolerance
+        self.max_period = max_period
+        self.min_steps = min_steps
+        self.history = deque(maxlen=window + max_period)
+        self.period = None
+        self.step = None
+
+    def update(self, model):
+        """
+        Record the current values of the series and return the reason to
+        stop ("fixed point" or "periodic") if the run has converged, else
+        None.
+        """
+        reporters = model.datacollector.model_reporters
+        self.history.append([reporters[name](model) for name in self.series])
+        if (model.schedule.steps < self.min_steps or
+                len(self.history) < self.window + 1):
+            return None
+        values = np.array(self.history, dtype=np.float64)
+        for period in range(1, min(self.max_period, len(values) -
+                                   self.window) + 1):
+            recent = values[-self.window - period:]
+            if all(np.all(np.ptp(recent[phase::period], axis=0) <=
+                          self.tolerance) for phase in range(period)):
+                self.period = period
+                self.step = model.schedule.steps
+                return "fixed point" if period == 1 else "periodic"
+        return None
@@ -0,0 +1,109 @@
+from collections import Counter
+
+import numpy as np
+
+from .states import MORAL_STATES
+
+
+class CitizenCounts:
+    """
+    Live tallies of citizens by state, kept separately for free and jailed
+    citizens. Citizens report every change of condition, moral_state,
+    is_employed and jail_sentence here, so the model can answer population
+    and saturation queries without walking the schedule.
+
+    Attributes:
+        free: Counter of citizens with jail_sentence == 0, keyed by
+            "total", "Employed", "Unemployed", every condition ("Quiescent",
+            "Active", "Jailed") and every moral state ("Corrupted", "Honest",
+            "Susceptible")
+        jailed: same tallies for citizens with jail_sentence > 0
+    """
+
+    def __init__(self):
+        self.free = Counter()
+        self.jailed = Counter()
+
+    def _bucket(self, citizen):
+        return self.jailed if citizen.jail_sentence else self.free
+
+    @staticmethod
+    def _tally(bucket, citizen, sign):
+        bucket["total"] += sign
+        bucket[citizen.condition] += sign
+        bucket[citizen.moral_state] += sign
+        if citizen.is_employed == 1:
+            bucket["Employed"] += sign
+        elif citizen.is_employed == 0:
+            bucket["Unemployed"] += sign
+
+    def add(self, citizen):
+        """
+        Start counting a citizen in its current state.
+        """
+        self._tally(self._bucket(citizen), citizen, 1)
+
+    def add_population(self, is_employed, moral_state):
+        """
+        Start counting a population of free, Quiescent citizens, given as
+        arrays of their is_employed values and MoralState codes.
+        """
+        bucket = self.free
+        bucket["total"] += len(is_employed)
+        bucket["Quiescent"] += len(is_employed)
+        bucket["Employed"] += int(np.count_nonzero(is_employed == 1))
+        bucket["Unemployed"] += int(np.count_nonzero(is_employed == 0))
+        tally = np.bincount(moral_state, minlength=len(MORAL_STATES))
+        for name, count in zip(MORAL_STATES, tally.tolist()):
+            bucket[name] += count
+
+    def remove(self, citizen):
+        """
+        Stop counting a citizen in its current state.
+        """
+        self._tally(self._bucket(citizen), citizen, -1)
+
+    def change(self, citizen, old, new):
+        """
+        Move a citizen from state `old` to state `new` (a condition or a
+        moral state) within its current jailed/free group.
+        """
+        bucket = self._bucket(citizen)
+        bucket[old] -= 1
+        bucket[new] += 1
+
+    def change_employment(self, citizen, old, new):
+        """
+        Record a job gain or loss.
+        """
+        bucket = self._bucket(citizen)
+        for value, sign in ((old, -1), (new, 1)):
+            if value == 1:
+                bucket["Employed"] += sign
+            elif value == 0:
+                bucket["Unemployed"] += sign
+
+    def change_jailed(self, citizen, jailed):
+        """
+        Move a citizen between the free and jailed groups (arrest or
+        release).
+        """
+        source, target = ((self.free, self.jailed) if jailed else
+                          (self.jailed, self.free))
+        self._tally(source, citizen, -1)
+        self._tally(target, citizen, 1)
+
+    def count(self, key, exclude_jailed=False):
+        """
+        Number of citizens in state `key`, optionally ignoring jailed ones.
+        """
+        if exclude_jailed:
+            return self.free[key]
+        return self.free[key] + self.jailed[key]
+
+    def saturation(self, key, exclude_jailed=False):
+        """
+        Fraction of citizens in state `key`, optionally ignoring jailed ones.
+        """
+        return (self.count(key, exclude_jailed) /
+                self.count("total", exclude_jailed))
@@ -0,0 +1,190 @@
+import numpy as np
+import pandas as pd
+from mesa.datacollection import DataCollector
+
+from .history import AgentHistory
+
+
+class AgentField:
+    """
+    How one agent variable is recorded in a typed column.
+
+    Attributes:
+        getter: function returning the value for an agent object, None where
+            the variable does not apply to the agent
+        kind: "int" (never missing), "optional int", "float" or "category"
+        categories: possible values of a "category" field; they are stored
+            as int8 codes, -1 for None
+    """
+
+    DTYPES = {"int": np.int64, "optional int": np.int64,
+              "float": np.float64, "category": np.int8}
+
+    def __init__(self, getter, kind, categories=()):
+        self.getter = getter
+        self.kind = kind
+        self.categories = tuple(categories)
+        self.dtype = self.DTYPES[kind]
+        self._codes = {value: code for code, value in
+                       enumerate(self.categories)}
+        self._codes[None] = -1
+
+    def gather(self, agents):
+        """
+        Typed column of this field over a sequence of agent objects.
+        """
+        values = map(self.getter, agents)
+        if self.kind == "category":
+            values = map(self._codes.__getitem__, values)
+        elif self.kind == "optional int":
+            values = (-1 if v is None else v for v in values)
+        elif self.kind == "float":
+            values = (np.nan if v is None else v for v in values)
+        return np.fromiter(values, dtype=self.dtype, count=len(agents))
+
+    def decode(self, column):
+        """
+        Column values as they appear in the agent-vars DataFrame.
+        """
+        if self.kind == "category":
+            lookup = np.array(self.categories + (None,), dtype=object)
+            return lookup[column]
+        if self.kind == "optional int":
+            return np.where(column < 0, np.nan, column)
+        return column
+
+
+class ColumnarDataCollector(DataCollector):
+    """
+    DataCollector that stores agent variables in preallocated, typed NumPy
+    columns instead of one Python tuple per agent and step, and only
+    records agents every `agent_every` steps. Model reporters work as in
+    DataCollector.
+
+    Agent columns are requested from model.agent_columns(fields), which
+    returns the agent ids and one typed array per field.
+
+    With an output (see output.RunOutput) every collected step is also
+    streamed to files; keep_in_memory=False then drops the data once it
+    has been handed over, so memory does not grow with the run length.
+
+    With agent_history="changes" the agent variables are kept as a change
+    log (see history.AgentHistory) instead of one row per agent and
+    step: the first record in full, then only the values that changed.
+    The DataFrame is rebuilt from it on demand and is the same.
+
+    Attributes:
+        agent_fields: name -> AgentField of the recorded agent variables;
+            empty to collect model-level data only
+        agent_every: record agents at steps that are a multiple of this
+        expected_records: number of agent snapshots the run is expected to
+            take; the columns start with room for at most INITIAL_RECORDS
+            of them and double whenever they are full
+        output: RunOutput the collected data is streamed to, or None
+        keep_in_memory: whether to also keep the collected data in memory
+        history: AgentHistory the agent variables are recorded in, None
+            when they are stored in full
+    """
+
+    # agent snapshots the columns have room for at first
+    INITIAL_RECORDS = 16
+
+    def __init__(self, model_reporters=None, agent_fields=None,
+                 agent_every=1, expected_records=1, output=None,
+                 keep_in_memory=True, agent_history="full"):
+        super().__init__(model_reporters=model_reporters)
+        self.agent_fields = dict(agent_fields or {})
+        self.agent_every = agent_every
+        self.expected_records = expected_records
+        self.output = output
+        self.keep_in_memory = keep_in_memory
+        self._columns = None
+        self._rows = 0
+        self.history = None
+        if agent_history == "changes":
+            self.history = AgentHistory(self.agent_fields)
+        elif agent_history != "full":
+            raise ValueError("agent_history must be 'full' or 'changes', "
+                             "not %r" % (agent_history,))
+
+    def collect(self, model):
+        """
+        Collect the model reporters and, on sampled steps, the agent
+        variables, and hand them to the output if there is one.
+        """
+        super().collect(model)
+        step = model.schedule.steps
+        record_agents = (self.agent_fields and
+                         step % self.agent_every == 0 and
+                         (self.keep_in_memory or
+                          (self.output is not None and self.output.agents)))
+        ids = columns = None
+        if record_agents:
+            ids, columns = model.agent_columns(self.agent_fields)
+        if self.output is not None:
+            row = {name: values[-1]
+                   for name, values in self.model_vars.items()}
+            self.output.write(step, row, self.agent_fields, ids, columns)
+        if not self.keep_in_memory:
+            for values in self.model_vars.values():
+                values.clear()
+        elif record_agents and self.history is not None:
+            self.history.record(step, ids, columns)
+        elif record_agents:
+            self._append(step, ids, columns)
+
+    def close(self):
+        """
+        Flush and finalize the output, if there is one.
+        """
+        if self.output is not None:
+            self.output.close()
+
+    def _append(self, step, ids, columns):
+        n = len(ids)
+        if self._columns is None:
+            capacity = max(n * min(self.expected_records,
+                                   self.INITIAL_RECORDS), 1)
+            self._columns = {"Step": np.empty(capacity, dtype=np.int64),
+                             "AgentID": np.empty(capacity, dtype=np.int64)}
+            for name, field in self.agent_fields.items():
+                self._columns[name] = np.empty(capacity, dtype=field.dtype)
+        capacity = len(self._columns["Step"])
+        if self._rows + n > capacity:
+            capacity = max(2 * capacity, self._rows + n)
+            for name, column in self._columns.items():
+                grown = np.empty(capacity, dtype=column.dtype)
+                grown[:self._rows] = column[:self._rows]
+                self._columns[name] = grown
+        rows = slice(self._rows, self._rows + n)
+        self._columns["Step"][rows] = step
+        self._columns["AgentID"][rows] = ids
+        for name, column in columns.items():
+            self._columns[name][rows] = column
+        self._rows += n
+
+    def agent_column(self, name):
+        """
+        The recorded values of one agent column (a view, in storage dtype).
+        """
+        if self.history is not None:
+            return self.history.columns()[name]
+        if self._columns is None:
+            return np.empty(0, dtype=np.int64)
+        return self._columns[name][:self._rows]
+
+    def get_agent_vars_dataframe(self):
+        """
+        Create a pandas DataFrame from the agent variables, indexed by
+        (Step, AgentID) like DataCollector.get_agent_vars_dataframe.
+        """
+        if self.history is not None:
+            columns = self.history.columns()
+        else:
+            columns = {name: self.agent_column(name)
+                       for name in ["Step", "AgentID"] +
+                       list(self.agent_fields)}
+        data = {name: columns[name] for name in ("Step", "AgentID")}
+        for name, field in self.agent_fields.items():
+            data[name] = field.decode(columns[name])
+        return pd.DataFrame(data).set_index(["Step", "AgentID"])
@@ -0,0 +1,320 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from .batch import batch_dataframe
+
+# summaries of a run the emulator learns, see run_outputs
+OUTPUTS = ("peak_active", "time_to_peak", "final_corrupted",
+           "final_employed")
+# default parameters an emulator is trained over, with their ranges
+BOUNDS = {
+    "initial_unemployment_rate": (0.0, 0.4),
+    "corruption_level": (0.0, 0.4),
+    "corruption_transmission_prob": (0.0, 0.25),
+    "legitimacy": (0.5, 1.0),
+}
+# log grid the length scales (in units of the parameter ranges) and the
+# relative noise of a GaussianProcess are searched over
+LENGTH_SCALES = np.exp(np.linspace(np.log(0.05), np.log(5.0), 15))
+NOISE_RATIOS = np.exp(np.linspace(np.log(1e-4), np.log(1.0), 13))
+
+
+def run_outputs(frame):
+    """
+    Outputs (see OUTPUTS) of one run's model-vars DataFrame: the highest
+    number of Active citizens, the first step it was reached at, and the
+    Corrupted and Employed counts at the last step.
+    """
+    active = frame["Active"].to_numpy()
+    peak = int(np.argmax(active))
+    return {"peak_active": float(active[peak]),
+            "time_to_peak": float(frame.index[peak]),
+            "final_corrupted": float(frame["Corrupted"].iloc[-1]),
+            "final_employed": float(frame["Employed"].iloc[-1])}
+
+
+def summarize_runs(results, names):
+    """
+    One row per run of a batch_dataframe result: the parameters in
+    `names` followed by the run's outputs.
+    """
+    rows = []
+    for _, frame in results.groupby("run", sort=True):
+        row = {name: frame[name].iloc[0] for name in names}
+        row.update(run_outputs(frame))
+        rows.append(row)
+    return pd.DataFrame(rows, columns=list(names) + list(OUTPUTS))
+
+
+def latin_hypercube(bounds, n, seed=None):
+    """
+    `n` parameter points spread over the box `bounds` (name -> (low,
+    high)) by Latin hypercube sampling: every parameter's range is cut
+    into n equal strata and each stratum holds exactly one point.
+    """
+    generator = np.random.default_rng(seed)
+    points = {}
+    for name, (low, high) in bounds.items():
+        strata = (generator.permutation(n) + generator.random(n)) / n
+        points[name] = low + (high - low) * strata
+    return pd.DataFrame(points)
+
+
+class GaussianProcess:
+    """
+    Gaussian-process regression with a squared-exponential kernel, one
+    length scale per input dimension (ARD) and a noise term, in plain
+    NumPy. Inputs are expected in the unit cube; outputs are centered and
+    scaled internally.
+
+    The signal variance is profiled out of the likelihood, and the length
+    scales and the noise ratio are chosen by coordinate search over the
+    log grids LENGTH_SCALES and NOISE_RATIOS, maximizing the marginal
+    likelihood.
+
+    Attributes:
+        length_scales: fitted length scale per input dimension
+        noise_ratio: fitted noise variance relative to the signal variance
+        variance: fitted signal variance, in units of the scaled outputs
+        sweeps: coordinate search passes over all hyperparameters
+    """
+
+    def __init__(self, sweeps=3):
+        self.sweeps = sweeps
+        self.length_scales = None
+        self.noise_ratio = None
+        self.variance = None
+
+    @staticmethod
+    def _correlation(a, b, length_scales):
+        d = (a[:, None, :] - b[None, :, :]) / length_scales
+        return np.exp(-0.5 * np.einsum("ijk,ijk->ij", d, d))
+
+    def _likelihood(self, length_scales, noise_ratio):
+        """
+        Profile log marginal likelihood and the matching fit, or None if
+        the covariance matrix is not positive definite.
+        """
+        n = len(self._y)
+        matrix = self._correlation(self._x, self._x, length_scales)
+        matrix[np.diag_indices(n)] += noise_ratio + 1e-10
+        try:
+            lower = np.linalg.cholesky(matrix)
+        except np.linalg.LinAlgError:
+            return None
+        inverse = np.linalg.solve(lower, np.eye(n))
+        weights = inverse.T @ (inverse @ self._y)
+        variance = max(float(self._y @ weights) / n, 1e-12)
+        likelihood = (-0.5 * n * np.log(variance) -
+                      np.sum(np.log(np.diag(lower))))
+        return likelihood, inverse, weights, variance
+
+    def fit(self, x, y):
+        """
+        Fit to inputs x, shape (n, d), in the unit cube, and outputs y,
+        shape (n,).
+        """
+        self._x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        self._mean = y.mean()
+        self._scale = y.std() or 1.0
+        self._y = (y - self._mean) / self._scale
+        # indices into the grids, starting from a mid-range length scale
+        # and a small noise
+        scales = [len(LENGTH_SCALES) // 2] * self._x.shape[1]
+        noise = len(NOISE_RATIOS) // 3
+
+        def evaluate(scales, noise):
+            return self._likelihood(LENGTH_SCALES[scales], NOISE_RATIOS[noise])
+
+        best = evaluate(scales, noise)
+        for _ in range(self.sweeps):
+            improved = False
+            # every length scale in turn, then the noise ratio
+            for dimension in range(len(scales) + 1):
+                size = (len(NOISE_RATIOS) if dimension == len(scales) else
+                        len(LENGTH_SCALES))
+                for candidate in range(size):
+                    trial_scales, trial_noise = list(scales), noise
+                    if dimension == len(scales):
+                        trial_noise = candidate
+                    else:
+                        trial_scales[dimension] = candidate
+                    result = evaluate(trial_scales, trial_noise)
+                    if result is None or (best is not None and
+                                          result[0] <= best[0]):
+                        continue
+                    best, scales, noise = result, trial_scales, trial_noise
+                    improved = True
+            if not improved:
+                break
+        if best is None:
+            raise ValueError("could not fit a Gaussian process to the data")
+        _, self._inverse, self._weights, self.variance = best
+        self.length_scales = LENGTH_SCALES[scales]
+        self.noise_ratio = NOISE_RATIOS[noise]
+        return self
+
+    def _inverse_factor(self, x):
+        matrix = self._correlation(x, x, self.length_scales)
+        matrix[np.diag_indices(len(x))] += self.noise_ratio + 1e-10
+        return np.linalg.solve(np.linalg.cholesky(matrix), np.eye(len(x)))
+
+    def most_uncertain(self, x, n):
+        """
+        Indices of `n` of the inputs x, chosen one after the other as the
+        one with the largest posterior variance. Each chosen input is then
+        added to the training inputs as if it had been observed (the
+        posterior variance does not depend on the outcome), so the choices
+        spread out instead of piling up in one uncertain corner.
+        """
+        x = np.asarray(x, dtype=np.float64)
+        train, inverse = self._x, self._inverse
+        chosen = []
+        for _ in range(n):
+            projected = (self._correlation(x, train, self.length_scales) @
+                         inverse.T)
+            spread = 1.0 - np.einsum("ij,ij->i", projected, projected)
+            spread[chosen] = -np.inf
+            chosen.append(int(np.argmax(spread)))
+            train = np.vstack([train, x[chosen[-1]]])
+            inverse = self._inverse_factor(train)
+        return chosen
+
+    def predict(self, x):
+        """
+        (mean, standard deviation) of the underlying function at inputs x,
+        shape (m, d); the standard deviation leaves out the noise.
+        """
+        x = np.asarray(x, dtype=np.float64)
+        cross = self._correlation(x, self._x, self.length_scales)
+        mean = cross @ self._weights
+        projected = cross @ self._inverse.T
+        variance = self.variance * np.clip(
+            1.0 - np.einsum("ij,ij->i", projected, projected), 0.0, None)
+        return (self._mean + self._scale * mean,
+                self._scale * np.sqrt(variance))
+
+
+class Emulator:
+    """
+    Cheap statistical surrogate of EpsteinCivilViolence for exploring a
+    parameter space: one GaussianProcess per output (see OUTPUTS), trained
+    on the runs of batch_dataframe results, answers what-if queries in
+    milliseconds, and proposes the parameter points where the next runs
+    teach it the most.
+
+    Replicates are kept as separate observations; the noise term of each
+    process absorbs the run-to-run variation, and predictions are of the
+    mean over seeds.
+
+    Attributes:
+        bounds: parameter name -> (low, high) of the explored box
+        fixed: further model arguments shared by every run (e.g. max_iters)
+        runs: DataFrame with one row per training run: its parameters and
+            outputs
+        models: output name -> fitted GaussianProcess
+    """
+
+    def __init__(self, bounds=None, fixed=None):
+        self.bounds = dict(BOUNDS if bounds is None else bounds)
+        self.fixed = dict(fixed or {})
+        self.runs = pd.DataFrame(columns=list(self.bounds) + list(OUTPUTS))
+        self.models = {}
+
+    def _unit(self, points):
+        """
+        Points (DataFrame, dict or list of dicts) scaled to the unit cube.
+        """
+        if isinstance(points, dict):
+            points = [points]
+        points = pd.DataFrame(points)
+        missing = set(self.bounds) - set(points.columns)
+        if missing:
+            raise ValueError("points lack parameters: %s" %
+                             ", ".join(sorted(missing)))
+        low = np.array([low for low, _ in self.bounds.values()])
+        high = np.array([high for _, high in self.bounds.values()])
+        values = points[list(self.bounds)].to_numpy(dtype=np.float64)
+        return (values - low) / np.where(high > low, high - low, 1.0)
+
+    def add(self, results):
+        """
+        Add the runs of a batch_dataframe result to the training data.
+        """
+        runs = summarize_runs(results, list(self.bounds))
+        self.runs = runs if self.runs.empty else pd.concat(
+            [self.runs, runs], ignore_index=True)
+        return self
+
+    def fit(self):
+        """
+        Fit one Gaussian process per output to the training runs.
+        """
+        if len(self.runs) < 2:
+            raise ValueError("the emulator needs at least two runs")
+        x = self._unit(self.runs)
+        self.models = {name: GaussianProcess().fit(
+                           x, self.runs[name].to_numpy(dtype=np.float64))
+                       for name in OUTPUTS}
+        return self
+
+    def predict(self, points):
+        """
+        DataFrame of the predicted outputs at the given points (DataFrame,
+        dict or list of dicts of parameters), with a "<output>_std" column
+        giving the uncertainty of each prediction.
+        """
+        if not self.models:
+            raise ValueError("fit the emulator first")
+        x = self._unit(points)
+        prediction = {}
+        for name, model in self.models.items():
+            prediction[name], prediction[name + "_std"] = model.predict(x)
+        return pd.DataFrame(prediction)
+
+    def propose(self, n, output="peak_active", candidates=2000, seed=None):
+        """
+        `n` parameter points to simulate next: the `candidates` points of
+        a Latin hypercube where the prediction of `output` is most
+        uncertain (see GaussianProcess.most_uncertain).
+        """
+        if not self.models:
+            raise ValueError("fit the emulator first")
+        pool = latin_hypercube(self.bounds, candidates, seed)
+        chosen = self.models[output].most_uncertain(self._unit(pool), n)
+        return pool.iloc[chosen].reset_index(drop=True)
+
+    def simulate(self, points, replicates=1, **batch_options):
+        """
+        Run the model at the given points (DataFrame or list of dicts) with
+        batch_dataframe and add the runs to the training data.
+        """
+        points = pd.DataFrame(points)
+        parameters = [dict(self.fixed, **{name: float(value) for name, value
+                                          in point.items()})
+                      for point in points[list(self.bounds)].to_dict(
+                          "records")]
+        results = batch_dataframe(parameters, replicates=replicates,
+                                  **batch_options)
+        return self.add(results)
+
+    def explore(self, initial=16, rounds=4, per_round=8, replicates=1,
+                output="peak_active", seed=0, **batch_options):
+        """
+        Active learning loop: simulate a Latin hypercube of `initial`
+        points, then `rounds` times fit the emulator and simulate the
+        `per_round` points propose() picks for `output`. Returns the
+        emulator, fitted to all runs.
+        """
+        seeds = np.random.SeedSequence(seed).generate_state(rounds + 1)
+        self.simulate(latin_hypercube(self.bounds, initial, int(seeds[0])),
+                      replicates, **batch_options)
+        for round_seed in itertools.islice(seeds, 1, None):
+            self.fit()
+            self.simulate(self.propose(per_round, output,
+                                       seed=int(round_seed)),
+                          replicates, **batch_options)
+        return self.fit()
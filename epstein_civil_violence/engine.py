@@ -0,0 +1,498 @@
+import math
+
+import numpy as np
+
+from .states import (ACTIVE, CITIZEN, CONDITIONS, COP, CORRUPTED, HONEST,
+                     JAILED, MORAL_STATES, QUIESCENT, SUSCEPTIBLE)
+
+# code of the states that do not apply to an agent (e.g. a cop's condition)
+NOT_APPLICABLE = -1
+
+# random slots: every cell gets one uniform per slot and tick
+(INIT_COP, INIT_CITIZEN, INIT_EMPLOYMENT, INIT_MORAL, INIT_HARDSHIP,
+ INIT_RELIEF, INIT_RISK, INIT_THRESHOLD) = range(8)
+(W_UNEMPLOYMENT, W_CORRUPTION, LEGITIMACY_WEIGHT, ARREST_CHOICE,
+ ARREST_PRIORITY, SENTENCE, CONTAGION_TARGET, CONTAGION_SCALE,
+ CONTAGION_ROLL, CONTAGION_PRIORITY, JOB_SWAP_ROLL, JOB_SWAP_VICTIM,
+ CHURN_RATE, CHURN_ROLL, CHURN_PRIORITY, MOVE_CHOICE,
+ MOVE_PRIORITY) = range(17)
+N_SLOTS = 20
+
+
+class CellStream:
+    """
+    Counter-based uniform random numbers addressed by (tick, slot, cell).
+    Any block of cells can be drawn independently of the others and of the
+    order in which blocks are requested, so results do not depend on how
+    the grid is traversed.
+
+    Attributes:
+        key: Philox key
+        ncells: number of grid cells
+        nslots: number of independent draws per cell and tick
+    """
+
+    def __init__(self, key, ncells, nslots=N_SLOTS):
+        self.key = key
+        self.ncells = ncells
+        self.nslots = nslots
+
+    def uniform(self, tick, slot, low=0.0, high=1.0, start=0, stop=None):
+        """
+        Uniform draws in [low, high) for cells start..stop-1.
+        """
+        if stop is None:
+            stop = self.ncells
+        offset = (tick * self.nslots + slot) * self.ncells + start
+        # Philox yields four 64 bit words per counter increment
+        block, skip = divmod(offset, 4)
+        generator = np.random.Generator(
+            np.random.Philox(key=self.key, counter=block))
+        draws = generator.random(stop - start + skip)[skip:]
+        if low != 0.0 or high != 1.0:
+            draws = low + (high - low) * draws
+        return draws
+
+
+def room_below(count, total, cap):
+    """
+    How many more members a group of `count` out of `total` citizens may
+    gain, one at a time, while its share stays strictly below `cap` at
+    the moment each member is added.
+    """
+    limit = math.ceil(cap * total)
+    while limit > 0 and (limit - 1) / total >= cap:
+        limit -= 1
+    while limit / total < cap:
+        limit += 1
+    return max(0, limit - count)
+
+
+def pick_among(mask, draws):
+    """
+    For every row of a boolean (n, k) mask pick one True column uniformly
+    at random using one uniform draw per row. Rows without any True entry
+    get -1.
+    """
+    counts = mask.sum(axis=1)
+    rank = np.minimum((draws * counts).astype(np.int64), counts - 1)
+    hits = mask & (np.cumsum(mask, axis=1) - 1 == rank[:, None])
+    return np.where(counts > 0, hits.argmax(axis=1), -1)
+
+
+def resolve_conflicts(targets, priority):
+    """
+    Positions (into targets) of the winning claim for every distinct
+    target: the claim with the highest priority wins.
+    """
+    order = np.lexsort((-priority, targets))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = targets[order][1:] != targets[order][:-1]
+    return order[first]
+
+
+def draw_population(model, draw):
+    """
+    The initial population of a model, drawn for all cells at once with the
+    distributions EpsteinCivilViolence._create_agents draws cell by cell.
+    Args:
+        model: EpsteinCivilViolence whose parameters to use
+        draw: function (slot, low=0.0, high=1.0) returning one uniform draw
+            per grid cell, such as ArrayEngine._draw at tick 0
+    Returns:
+        dict of arrays over the agents, in cell order: cell, breed,
+        is_employed, moral_state, hardship, risk_aversion and threshold;
+        only cell and breed are meaningful for cops
+    """
+    is_cop = draw(INIT_COP) < model.cop_density
+    is_citizen = ~is_cop & (draw(INIT_CITIZEN) <
+                            model.cop_density + model.citizen_density)
+    cell = np.flatnonzero(is_cop | is_citizen)
+    employed = (draw(INIT_EMPLOYMENT)[cell] >=
+                model.initial_unemployment_rate).astype(np.int8)
+    p = draw(INIT_MORAL)[cell]
+    moral = np.full(len(cell), HONEST, dtype=np.int8)
+    moral[p < model.corruption_level + model.susceptible_level] = SUSCEPTIBLE
+    moral[p < model.corruption_level] = CORRUPTED
+    return {
+        "cell": cell,
+        "breed": np.where(is_cop[cell], COP, CITIZEN).astype(np.int8),
+        "is_employed": employed,
+        "moral_state": moral,
+        "hardship": (draw(INIT_HARDSHIP)[cell] -
+                     employed * draw(INIT_RELIEF, 0.04, 0.08)[cell]),
+        "risk_aversion": draw(INIT_RISK)[cell],
+        "threshold": (model.active_threshold +
+                      employed * draw(INIT_THRESHOLD, 0.04, 0.08)[cell]),
+    }
+
+
+class ArrayEngine:
+    """
+    Struct-of-arrays implementation of the EpsteinCivilViolence dynamics.
+    Agent state lives in typed NumPy arrays indexed by agent, and each tick
+    is computed in batched array operations instead of one Agent.step at a
+    time.
+
+    The rules are the ones of Citizen.step and Cop.step, applied
+    synchronously in phases rather than in random sequential order:
+        1. jailed citizens serve one tick of their sentence;
+        2. free citizens estimate arrest probability and regime legitimacy
+           (from their four neighbors, or from model.vision_layers) and
+           decide whether to be Active;
+        3. free Corrupted, then Honest citizens try to convert one
+           Susceptible, Quiescent neighbor; the corruption and honesty caps
+           admit successful conversions in random order until the cap is
+           reached;
+        4. employment churn, with the unemployment cap applied the same way;
+        5. free citizens move to a random neighboring cell that was empty
+           at the start of the phase; contested cells go to the highest
+           priority draw;
+        6. cops arrest one random Active neighbor (or Active citizen in
+           cop_vision, with use_vision); when several cops pick
+           the same citizen the one with the highest priority draw sets
+           the sentence;
+        7. cops move like citizens in phase 5.
+    Saturations are evaluated at the start of each phase. As in Citizen,
+    honesty spreads at corruption_transmission_prob.
+
+    Attributes:
+        breed: CITIZEN or COP per agent
+        cell: grid cell id per agent, as in NeighborhoodIndex
+        hardship, risk_aversion, threshold, grievance, regime_legitimacy,
+        arrest_probability: float arrays, NaN for cops
+        jail_sentence: remaining sentence per agent
+        is_employed: 1 if employed, 0 if not (NOT_APPLICABLE for cops)
+        moral_state: CORRUPTED, HONEST or SUSCEPTIBLE (NOT_APPLICABLE for
+            cops)
+        condition: QUIESCENT, ACTIVE or JAILED (NOT_APPLICABLE for cops)
+        cell_agent: agent index per cell, -1 where the cell is empty
+        neighbors: (cells, 4) table of von Neumann neighbor cells
+        stream: CellStream all random numbers are drawn from
+        tick: number of completed steps
+    """
+
+    def __init__(self, model):
+        if model.width < 3 or model.height < 3:
+            raise ValueError("numpy engine needs a grid of at least 3x3")
+        self.model = model
+        self.index = model.neighborhoods
+        self.ncells = self.index.ncells
+        self.neighbors = self.index.dense(1, False)
+        self.stream = CellStream(model.random.getrandbits(128), self.ncells)
+        self.tick = 0
+        self._populate()
+        self.sync_counts()
+
+    @property
+    def x(self):
+        return self.cell // self.index.height
+
+    @property
+    def y(self):
+        return self.cell % self.index.height
+
+    def _draw(self, slot, low=0.0, high=1.0):
+        return self.stream.uniform(self.tick, slot, low, high)
+
+    def _populate(self):
+        """
+        Draw the initial population with the distributions used by
+        EpsteinCivilViolence.__init__.
+        """
+        m = self.model
+        population = draw_population(m, self._draw)
+        self.cell = population["cell"]
+        n = len(self.cell)
+        self.cell_agent = np.full(self.ncells, -1, dtype=np.int64)
+        self.cell_agent[self.cell] = np.arange(n)
+        self.breed = population["breed"]
+        citizen = self.breed == CITIZEN
+
+        employed = population["is_employed"]
+        self.hardship = population["hardship"]
+        self.risk_aversion = population["risk_aversion"]
+        self.threshold = population["threshold"]
+        self.grievance = self.hardship * (1 - m.legitimacy)
+        self.regime_legitimacy = np.full(n, float(m.legitimacy))
+        self.arrest_probability = np.full(n, np.nan)
+        for values in (self.hardship, self.risk_aversion, self.threshold,
+                       self.grievance, self.regime_legitimacy):
+            values[~citizen] = np.nan
+
+        self.jail_sentence = np.zeros(n, dtype=np.int32)
+        self.is_employed = np.where(citizen, employed,
+                                    NOT_APPLICABLE).astype(np.int8)
+        self.moral_state = np.where(citizen, population["moral_state"],
+                                    NOT_APPLICABLE).astype(np.int8)
+        self.condition = np.where(citizen, QUIESCENT,
+                                  NOT_APPLICABLE).astype(np.int8)
+
+    def _layer(self, mask):
+        """
+        Boolean grid layer marking the cells of the agents in mask.
+        """
+        layer = np.zeros(self.ncells, dtype=bool)
+        layer[self.cell[mask]] = True
+        return layer
+
+    def _saturation(self, values, code, exclude_jailed):
+        citizens = self.breed == CITIZEN
+        if exclude_jailed:
+            citizens &= self.jail_sentence == 0
+        return (np.count_nonzero(citizens & (values == code)) /
+                np.count_nonzero(citizens))
+
+    def step(self):
+        """
+        Advance all agents by one tick.
+        """
+        profiler = self.model.profiler
+        if profiler is not None:
+            profiler.start()
+        self.tick += 1
+        citizen = self.breed == CITIZEN
+        jailed = citizen & (self.jail_sentence > 0)
+        self.jail_sentence[jailed] -= 1
+        free_citizens = np.flatnonzero(citizen & ~jailed)
+        if profiler is not None:
+            profiler.lap("citizen", "jail")
+        self._activate(free_citizens)
+        if profiler is not None:
+            profiler.lap("citizen", "activation")
+        self._spread(free_citizens, CORRUPTED)
+        if profiler is not None:
+            profiler.lap("citizen", "corruption")
+        self._spread(free_citizens, HONEST)
+        if profiler is not None:
+            profiler.lap("citizen", "honesty")
+        self._churn(free_citizens)
+        if profiler is not None:
+            profiler.lap("citizen", "employment")
+        if self.model.movement:
+            self._move(free_citizens)
+        if profiler is not None:
+            profiler.lap("citizen", "movement")
+        self._arrest()
+        if profiler is not None:
+            profiler.lap("cop", "arrest")
+        if self.model.movement:
+            self._move(np.flatnonzero(~citizen))
+        if profiler is not None:
+            profiler.lap("cop", "movement")
+        self.sync_counts()
+        if profiler is not None:
+            profiler.lap("model", "counts")
+
+    def _activate(self, idx):
+        m = self.model
+        cells = self.cell[idx]
+        is_cop = self.breed == COP
+        is_active = (self.condition == ACTIVE) & (self.jail_sentence == 0)
+        layers = m.vision_layers
+        if layers is not None:
+            is_corrupted = self.moral_state == CORRUPTED
+            layers.update(self.cell, {
+                "cops": is_cop, "actives": is_active,
+                "corrupted": is_corrupted,
+                "non_corrupted": ~is_cop & ~is_corrupted})
+            cops = layers.count("cops", cells)
+            actives = 1.0 + layers.count("actives", cells)
+        else:
+            around = self.neighbors[cells]
+            cops = self._layer(is_cop)[around].sum(axis=1)
+            actives = 1.0 + self._layer(is_active)[around].sum(axis=1)
+        self.arrest_probability[idx] = 1 - np.exp(
+            -1 * m.arrest_prob_constant * (cops / actives))
+
+        unemployment_sat = self._saturation(self.is_employed, 0, True)
+        corruption_sat = self._saturation(self.moral_state, CORRUPTED, True)
+        weight = (self._draw(LEGITIMACY_WEIGHT, 0.3, 0.4)[cells] *
+                  (unemployment_sat + corruption_sat))
+        non_corrupted = self.moral_state[idx] != CORRUPTED
+        self.regime_legitimacy[idx[non_corrupted]] = (
+            m.legitimacy - weight[non_corrupted])
+
+        net_risk = self.risk_aversion[idx] * self.arrest_probability[idx]
+        total_contribution = (
+            self._draw(W_UNEMPLOYMENT, 0.03, 0.43)[cells] * unemployment_sat +
+            self._draw(W_CORRUPTION, 0.01, 0.03)[cells] * corruption_sat)
+        rebel = (self.grievance[idx] - net_risk >
+                 self.threshold[idx] - total_contribution)
+        condition = self.condition[idx]
+        condition[(condition == QUIESCENT) & rebel] = ACTIVE
+        condition[(condition == ACTIVE) & ~rebel] = QUIESCENT
+        self.condition[idx] = condition
+
+    def _arrest(self):
+        cops = np.flatnonzero(self.breed == COP)
+        cells = self.cell[cops]
+        if self.model.use_vision:
+            around = self.index.around(cells, self.model.cop_vision, True)
+        else:
+            around = self.neighbors[cells]
+        free_active = self._layer((self.condition == ACTIVE) &
+                                  (self.jail_sentence == 0))
+        choice = pick_among(free_active[around],
+                            self._draw(ARREST_CHOICE)[cells])
+        arresting = choice >= 0
+        target_cells = around[arresting, choice[arresting]]
+        cells = cells[arresting]
+        won = resolve_conflicts(target_cells,
+                                self._draw(ARREST_PRIORITY)[cells])
+        arrestees = self.cell_agent[target_cells[won]]
+        sentence = (self._draw(SENTENCE)[cells[won]] *
+                    (self.model.max_jail_term + 1)).astype(np.int32)
+        self.jail_sentence[arrestees] = sentence
+        self.condition[arrestees] = JAILED
+
+    def _spread(self, free_citizens, moral):
+        """
+        Let every free Corrupted (or Honest) citizen try to convert one
+        Susceptible, Quiescent neighbor.
+        """
+        m = self.model
+        sources = free_citizens[self.moral_state[free_citizens] == moral]
+        cells = self.cell[sources]
+        around = self.neighbors[cells]
+        occupied = self.cell_agent >= 0
+        sources_ok = occupied[around].sum(axis=1) > 1
+        susceptible = self._layer((self.moral_state == SUSCEPTIBLE) &
+                                  (self.condition == QUIESCENT))
+        choice = pick_among(susceptible[around],
+                            self._draw(CONTAGION_TARGET)[cells])
+        trying = sources_ok & (choice >= 0)
+        sources, cells, around = sources[trying], cells[trying], around[trying]
+        targets = self.cell_agent[around[np.arange(len(cells)),
+                                         choice[trying]]]
+
+        roll = self._draw(CONTAGION_ROLL)[cells]
+        if moral == CORRUPTED:
+            prob = (m.corruption_transmission_prob *
+                    self._draw(CONTAGION_SCALE, 0.001, 0.1)[cells])
+            prob = prob + 0.07 * (self.is_employed[targets] == 0)
+            cap = m.max_corruption_saturation
+        else:
+            prob = (m.corruption_transmission_prob *
+                    self._draw(CONTAGION_SCALE, 0.01, 0.1)[cells])
+            cap = m.max_honest_saturation
+        success = roll < prob
+        sources, cells, around, targets = (
+            sources[success], cells[success], around[success],
+            targets[success])
+        won = resolve_conflicts(targets,
+                                self._draw(CONTAGION_PRIORITY)[cells])
+        citizens = np.count_nonzero(self.breed == CITIZEN)
+        room = room_below(np.count_nonzero(self.moral_state == moral),
+                          citizens, cap)
+        if len(won) > room:
+            priority = self._draw(CONTAGION_PRIORITY)[cells[won]]
+            won = won[np.argsort(-priority, kind="stable")[:room]]
+        cells, around, targets = cells[won], around[won], targets[won]
+
+        if moral == CORRUPTED:
+            # a newly corrupted, unemployed citizen may take the job of an
+            # employed, non-corrupted neighbor of the corruptor
+            employed_non_corrupted = self._layer(
+                (self.breed == CITIZEN) & (self.moral_state != CORRUPTED) &
+                (self.is_employed == 1))
+            victim = pick_among(employed_non_corrupted[around],
+                                self._draw(JOB_SWAP_VICTIM)[cells])
+            swap = ((victim >= 0) & (self.is_employed[targets] == 0) &
+                    (self._draw(JOB_SWAP_ROLL)[cells] < 0.06))
+            victims = self.cell_agent[around[swap, victim[swap]]]
+            self.is_employed[victims] = 0
+            self.is_employed[targets[swap]] = 1
+        self.moral_state[targets] = moral
+
+    def _churn(self, free_citizens):
+        """
+        Employed citizens may randomly lose their job, unemployed ones may
+        find one.
+        """
+        m = self.model
+        cells = self.cell[free_citizens]
+        citizens = np.count_nonzero(self.breed == CITIZEN)
+        unemployed = np.count_nonzero(self.is_employed == 0)
+        corruption_sat = self._saturation(self.moral_state, CORRUPTED, False)
+        honest_sat = self._saturation(self.moral_state, HONEST, False)
+        employed = self.is_employed[free_citizens] == 1
+        rate = np.where(employed,
+                        self._draw(CHURN_RATE, 0.0, 0.09)[cells] *
+                        corruption_sat,
+                        self._draw(CHURN_RATE, 0.0, 0.009)[cells] *
+                        honest_sat)
+        change = self._draw(CHURN_ROLL)[cells] < rate
+        losers = np.flatnonzero(change & employed)
+        room = room_below(unemployed, citizens, m.max_unemployed_saturation)
+        if len(losers) > room:
+            priority = self._draw(CHURN_PRIORITY)[cells[losers]]
+            losers = losers[np.argsort(-priority, kind="stable")[:room]]
+        self.is_employed[free_citizens[change & ~employed]] = 1
+        self.is_employed[free_citizens[losers]] = 0
+
+    def _move(self, movers):
+        cells = self.cell[movers]
+        around = self.neighbors[cells]
+        empty = self.cell_agent < 0
+        choice = pick_among(empty[around], self._draw(MOVE_CHOICE)[cells])
+        moving = choice >= 0
+        movers, cells = movers[moving], cells[moving]
+        destinations = around[moving, choice[moving]]
+        won = resolve_conflicts(destinations,
+                                self._draw(MOVE_PRIORITY)[cells])
+        movers, destinations = movers[won], destinations[won]
+        self.cell_agent[self.cell[movers]] = -1
+        self.cell_agent[destinations] = movers
+        self.cell[movers] = destinations
+
+    def close(self):
+        """
+        Release the engine's resources at the end of a run; the array
+        engine holds none.
+        """
+
+    def agent_columns(self, fields):
+        """
+        Agent ids and typed columns in the layout of the model's agent
+        fields (see datacollection.AgentField). The columns are copies, as
+        with the object engine, so they keep their values when the state
+        arrays change.
+        """
+        citizen = self.breed == CITIZEN
+        available = {
+            "x": lambda: self.x,
+            "y": lambda: self.y,
+            "breed": lambda: self.breed.copy(),
+            "jail_sentence": lambda: np.where(citizen, self.jail_sentence,
+                                              -1),
+            "condition": lambda: self.condition.copy(),
+            "arrest_probability": lambda: self.arrest_probability.copy(),
+            "is_employed": lambda: self.is_employed.copy(),
+            "moral_state": lambda: self.moral_state.copy(),
+            "moral_condition": lambda: np.full(len(self.breed), -1),
+        }
+        return np.arange(len(self.breed)), {
+            name: available[name]() for name in fields}
+
+    def sync_counts(self):
+        """
+        Refresh model.citizen_counts from the state arrays, so the model's
+        counting helpers and reporters work unchanged.
+        """
+        counts = self.model.citizen_counts
+        citizen = self.breed == CITIZEN
+        jailed = self.jail_sentence > 0
+        for bucket, mask in ((counts.free, citizen & ~jailed),
+                             (counts.jailed, citizen & jailed)):
+            bucket.clear()
+            bucket["total"] = np.count_nonzero(mask)
+            bucket["Employed"] = np.count_nonzero(
+                mask & (self.is_employed == 1))
+            bucket["Unemployed"] = np.count_nonzero(
+                mask & (self.is_employed == 0))
+            for names, values in ((CONDITIONS, self.condition),
+                                  (MORAL_STATES, self.moral_state)):
+                tally = np.bincount(values[mask], minlength=len(names))
+                for name, count in zip(names, tally):
+                    bucket[name] = int(count)
@@ -0,0 +1,292 @@
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+from .batch import expand_parameters, replicate_seeds, run_batch
+
+# the model-level reporters of EpsteinCivilViolence
+REPORTERS = ("Quiescent", "Active", "Jailed", "Employed", "Corrupted",
+             "Honest", "Susceptible")
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+# markers of a P-square quantile sketch
+MARKERS = 5
+
+
+class EnsembleAggregator:
+    """
+    Per-step statistics of model-level series over an ensemble of
+    replicates, updated as each replicate finishes instead of from all
+    replicates' DataFrames at once. Memory grows with the number of steps
+    and reporters, not with the number of replicates.
+
+    For every step and reporter the aggregator keeps the count, running
+    mean and sum of squared deviations (Welford's algorithm), minimum and
+    maximum, and for every requested quantile a P-square sketch (Jain and
+    Chlamtac, 1985): five markers whose heights track the quantile without
+    storing the observations. Quantiles are exact while a step has seen
+    at most `exact` replicates, whose values are kept; the sketches start
+    from those values.
+
+    Replicates may have different lengths (e.g. runs that stopped on
+    convergence); each step only counts the replicates that reached it.
+
+    Attributes:
+        reporters: names of the series aggregated
+        quantiles: probabilities of the tracked quantiles
+        exact: number of replicates per step kept for exact quantiles
+        replicates: number of replicates added
+        count: number of replicates that reached each step
+    """
+
+    def __init__(self, reporters=REPORTERS, quantiles=QUANTILES,
+                 exact=64):
+        self.reporters = tuple(reporters)
+        self.quantiles = np.array(quantiles, dtype=np.float64)
+        if np.any((self.quantiles <= 0) | (self.quantiles >= 1)):
+            raise ValueError("quantiles must lie strictly between 0 and 1")
+        if exact < MARKERS:
+            raise ValueError("exact must be at least %d" % MARKERS)
+        self.exact = exact
+        # how far the desired marker positions move per observation
+        p = self.quantiles
+        self._increments = np.stack([np.zeros_like(p), p / 2, p,
+                                     (1 + p) / 2, np.ones_like(p)], axis=-1)
+        self.replicates = 0
+        nreporters, nquantiles = len(self.reporters), len(self.quantiles)
+        self.count = np.zeros(0, dtype=np.int64)
+        self._mean = np.zeros((0, nreporters))
+        self._m2 = np.zeros((0, nreporters))
+        self._min = np.zeros((0, nreporters))
+        self._max = np.zeros((0, nreporters))
+        self._first = np.zeros((0, nreporters, exact))
+        # P-square marker heights, positions and desired positions
+        self._heights = np.zeros((0, nreporters, nquantiles, MARKERS))
+        self._positions = self._heights.copy()
+        self._desired = self._heights.copy()
+
+    def _allocate(self, steps):
+        """
+        Grow the per-step state to `steps` steps.
+        """
+        if steps <= len(self.count):
+            return
+
+        def grow(array, fill=0.0):
+            grown = np.full((steps,) + array.shape[1:], fill,
+                            dtype=array.dtype)
+            grown[:len(array)] = array
+            return grown
+
+        self.count = grow(self.count)
+        self._mean = grow(self._mean)
+        self._m2 = grow(self._m2)
+        self._min = grow(self._min, np.inf)
+        self._max = grow(self._max, -np.inf)
+        self._first = grow(self._first)
+        self._heights = grow(self._heights)
+        self._positions = grow(self._positions)
+        self._desired = grow(self._desired)
+
+    def add(self, frame):
+        """
+        Add one replicate, given as its model-vars DataFrame (one row per
+        step, in order from step 0), e.g. as yielded by run_batch.
+        """
+        values = frame[list(self.reporters)].to_numpy(dtype=np.float64)
+        steps = len(values)
+        self._allocate(steps)
+        self.replicates += 1
+        count = self.count[:steps] + 1
+        self.count[:steps] = count
+
+        delta = values - self._mean[:steps]
+        self._mean[:steps] += delta / count[:, None]
+        self._m2[:steps] += delta * (values - self._mean[:steps])
+        np.minimum(self._min[:steps], values, out=self._min[:steps])
+        np.maximum(self._max[:steps], values, out=self._max[:steps])
+
+        # the first `exact` observations of a step are kept as they are,
+        # and start the step's sketches once complete
+        filling = np.flatnonzero(count <= self.exact)
+        self._first[filling, :, count[filling] - 1] = values[filling]
+        starting = filling[count[filling] == self.exact]
+        if len(starting):
+            self._start_sketches(starting)
+        updating = np.flatnonzero(count > self.exact)
+        if len(updating):
+            self._update_sketches(updating, values[updating])
+        return self
+
+    def consume(self, frames):
+        """
+        Add every replicate of an iterable of model-vars DataFrames.
+        """
+        for frame in frames:
+            self.add(frame)
+        return self
+
+    def _start_sketches(self, steps):
+        """
+        Place the markers of the sketches at `steps` on the kept
+        observations, at the ranks closest to their desired positions.
+        """
+        first = np.sort(self._first[steps], axis=-1)
+        desired = 1 + (self.exact - 1) * self._increments
+        ranks = np.round(desired)
+        # the markers' ranks must be distinct
+        for i in range(1, MARKERS - 1):
+            ranks[:, i] = np.clip(ranks[:, i], ranks[:, i - 1] + 1,
+                                  self.exact - (MARKERS - 1 - i))
+        ranks = ranks.astype(np.int64) - 1
+        self._heights[steps] = first[:, :, ranks]
+        self._positions[steps] = ranks + 1
+        self._desired[steps] = desired
+
+    def _update_sketches(self, steps, values):
+        """
+        One P-square step for the sketches of every reporter and quantile
+        at `steps`, with `values` the new observation per step and
+        reporter.
+        """
+        q = self._heights[steps]
+        n = self._positions[steps]
+        desired = self._desired[steps]
+        x = np.broadcast_to(values[:, :, None], q.shape[:-1])
+        # cell k of the observation: q[k] <= x < q[k + 1], extremes
+        # replaced
+        below, above = x < q[..., 0], x >= q[..., -1]
+        q[..., 0] = np.where(below, x, q[..., 0])
+        q[..., -1] = np.where(above, x, q[..., -1])
+        k = np.clip((x[..., None] >= q[..., 1:-1]).sum(axis=-1), 0, 3)
+        n += np.arange(MARKERS) > k[..., None]
+        desired += self._increments
+        for i in range(1, MARKERS - 1):
+            d = desired[..., i] - n[..., i]
+            move = (((d >= 1) & (n[..., i + 1] - n[..., i] > 1)) |
+                    ((d <= -1) & (n[..., i - 1] - n[..., i] < -1)))
+            d = np.sign(d) * move
+            with np.errstate(divide="ignore", invalid="ignore"):
+                parabolic = q[..., i] + d / (n[..., i + 1] - n[..., i - 1]) * (
+                    (n[..., i] - n[..., i - 1] + d) *
+                    (q[..., i + 1] - q[..., i]) /
+                    (n[..., i + 1] - n[..., i]) +
+                    (n[..., i + 1] - n[..., i] - d) *
+                    (q[..., i] - q[..., i - 1]) /
+                    (n[..., i] - n[..., i - 1]))
+                neighbor = np.where(d > 0, i + 1, i - 1)
+                qn = np.take_along_axis(q, neighbor[..., None], -1)[..., 0]
+                nn = np.take_along_axis(n, neighbor[..., None], -1)[..., 0]
+                linear = q[..., i] + d * (qn - q[..., i]) / (nn - n[..., i])
+            inside = (q[..., i - 1] < parabolic) & (parabolic < q[..., i + 1])
+            q[..., i] = np.where(move, np.where(inside, parabolic, linear),
+                                 q[..., i])
+            n[..., i] += d
+        self._heights[steps] = q
+        self._positions[steps] = n
+        self._desired[steps] = desired
+
+    def _frame(self, values):
+        return pd.DataFrame(values, columns=list(self.reporters),
+                            index=pd.RangeIndex(len(values), name="Step"))
+
+    def mean(self):
+        """
+        DataFrame of the mean of every reporter at every step.
+        """
+        return self._frame(self._mean.copy())
+
+    def variance(self):
+        """
+        DataFrame of the sample variance of every reporter at every step,
+        NaN where fewer than two replicates reached the step.
+        """
+        count = self.count[:, None]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            variance = np.where(count > 1, self._m2 / (count - 1), np.nan)
+        return self._frame(variance)
+
+    def std(self):
+        """
+        DataFrame of the sample standard deviation, see variance().
+        """
+        return np.sqrt(self.variance())
+
+    def minimum(self):
+        return self._frame(self._min.copy())
+
+    def maximum(self):
+        return self._frame(self._max.copy())
+
+    def quantile(self, q):
+        """
+        DataFrame of the estimated q-quantile of every reporter at every
+        step; q must be one of the tracked quantiles.
+        """
+        matches = np.flatnonzero(np.isclose(self.quantiles, q))
+        if not len(matches):
+            raise ValueError("quantile %s is not tracked" % q)
+        values = self._heights[:, :, matches[0], 2].copy()
+        # steps with at most `exact` replicates: exact quantiles
+        for step in np.flatnonzero((self.count <= self.exact) &
+                                   (self.count > 0)):
+            values[step] = np.quantile(
+                self._first[step, :, :self.count[step]], q, axis=-1)
+        return self._frame(values)
+
+    def confidence_band(self, reporter, level=0.95):
+        """
+        DataFrame, indexed by step, of a reporter's mean with the normal
+        confidence interval of the mean at `level` ("mean_lower",
+        "mean_upper"), and, if the matching quantiles are tracked, the band
+        holding the central `level` share of the replicates ("lower",
+        "upper").
+        """
+        column = self.reporters.index(reporter)
+        z = NormalDist().inv_cdf(0.5 + level / 2)
+        mean = self._mean[:, column]
+        spread = self.std()[reporter].to_numpy()
+        error = z * spread / np.sqrt(self.count)
+        band = pd.DataFrame({"count": self.count, "mean": mean,
+                             "mean_lower": mean - error,
+                             "mean_upper": mean + error},
+                            index=pd.RangeIndex(len(mean), name="Step"))
+        tail = (1 - level) / 2
+        if (np.isclose(self.quantiles, tail).any() and
+                np.isclose(self.quantiles, 1 - tail).any()):
+            band["lower"] = self.quantile(tail)[reporter].to_numpy()
+            band["upper"] = self.quantile(1 - tail)[reporter].to_numpy()
+        return band
+
+    def summary(self, reporter):
+        """
+        DataFrame, indexed by step, of every statistic of one reporter.
+        """
+        summary = pd.DataFrame({
+            "count": self.count,
+            "mean": self.mean()[reporter],
+            "std": self.std()[reporter],
+            "min": self.minimum()[reporter],
+            "max": self.maximum()[reporter],
+        })
+        for q in self.quantiles:
+            summary["q%g" % q] = self.quantile(q)[reporter]
+        return summary
+
+
+def run_ensembles(parameters, replicates=1, base_seed=0, seeds=None,
+                  reporters=REPORTERS, quantiles=QUANTILES, **options):
+    """
+    Run a batch (see batch.run_batch) and aggregate the replicates of each
+    parameter point as they finish, without keeping their DataFrames.
+    Returns:
+        list of (parameter point, EnsembleAggregator), in the order of
+        batch.expand_parameters
+    """
+    if seeds is None:
+        seeds = replicate_seeds(replicates, base_seed)
+    points = expand_parameters(parameters)
+    ensembles = [EnsembleAggregator(reporters, quantiles) for _ in points]
+    for frame in run_batch(points, seeds=seeds, **options):
+        ensembles[int(frame["run"].iloc[0]) // len(seeds)].add(frame)
+    return list(zip(points, ensembles))
@@ -0,0 +1,259 @@
+import numpy as np
+import pandas as pd
+
+
+def _differs(new, old):
+    """
+    Elementwise new != old, with NaN equal to NaN.
+    """
+    differs = new != old
+    if new.dtype.kind == "f":
+        differs &= ~(np.isnan(new) & np.isnan(old))
+    return differs
+
+
+def _missing(field):
+    """
+    Stored value of a field for an agent that was not recorded.
+    """
+    return np.nan if field.kind == "float" else -1
+
+
+class ChangeLog:
+    """
+    Changes of one agent variable: for every change, the step, the agent's
+    slot and the new value, in the order they were recorded (so sorted by
+    step). Appended in chunks, one per recorded step, that are joined on
+    first read.
+    """
+
+    def __init__(self, dtype):
+        self.dtype = np.dtype(dtype)
+        self._chunks = []
+        self._joined = (np.empty(0, dtype=np.int64),
+                        np.empty(0, dtype=np.int64),
+                        np.empty(0, dtype=self.dtype))
+
+    def append(self, step, slots, values):
+        if len(slots):
+            self._chunks.append((np.full(len(slots), step, dtype=np.int64),
+                                 slots.astype(np.int64), values))
+
+    def arrays(self):
+        """
+        (steps, slots, values) of every change.
+        """
+        if self._chunks:
+            self._joined = tuple(
+                np.concatenate([joined] + [chunk[i]
+                                           for chunk in self._chunks])
+                for i, joined in enumerate(self._joined))
+            self._chunks = []
+        return self._joined
+
+    def nbytes(self):
+        return (sum(a.nbytes for a in self._joined) +
+                sum(a.nbytes for chunk in self._chunks for a in chunk))
+
+
+class AgentHistory:
+    """
+    Complete history of agent variables stored as a change log: the values
+    at the first recorded step, then for every later recorded step only
+    the (agent, value) pairs of the variables that changed. Variables such
+    as breed, employment or moral state change rarely, so a long run
+    takes a fraction of the memory of one row per agent and step.
+
+    Agents are identified by a slot, in the order they were first
+    recorded; an agent missing from a recorded step is kept in a
+    "present" log, so populations may change between steps.
+
+    The state at any recorded step is rebuilt by replaying the changes up
+    to that step (state()), and the whole history is expanded into the
+    usual (Step, AgentID) columns on demand (columns()).
+
+    Attributes:
+        fields: name -> AgentField of the recorded variables
+        ids: unique_id of every slot
+        steps: recorded steps, in order
+    """
+
+    def __init__(self, fields):
+        self.fields = dict(fields)
+        self.ids = np.empty(0, dtype=np.int64)
+        self.steps = []
+        self._initial = None
+        self._current = None
+        self._logs = {name: ChangeLog(field.dtype)
+                      for name, field in self.fields.items()}
+        self._logs["present"] = ChangeLog(bool)
+
+    def _slots(self, ids):
+        """
+        Slot of every id, adding slots for ids not seen before.
+        """
+        if len(ids) == len(self.ids) and np.array_equal(ids, self.ids):
+            return None
+        order = np.argsort(self.ids, kind="stable")
+        position = np.searchsorted(self.ids[order], ids)
+        position = np.minimum(position, max(len(order) - 1, 0))
+        known = np.zeros(len(ids), dtype=bool)
+        if len(order):
+            known = self.ids[order[position]] == ids
+        slots = np.empty(len(ids), dtype=np.int64)
+        slots[known] = order[position[known]]
+        new = np.flatnonzero(~known)
+        slots[new] = len(self.ids) + np.arange(len(new))
+        if len(new):
+            self.ids = np.concatenate([self.ids, ids[new]])
+            for name, values in list(self._current.items()):
+                fill = (False if name == "present" else
+                        _missing(self.fields[name]))
+                padding = np.full(len(new), fill, dtype=values.dtype)
+                self._current[name] = np.concatenate([values, padding])
+                self._initial[name] = np.concatenate(
+                    [self._initial[name], padding])
+        return slots
+
+    def record(self, step, ids, columns):
+        """
+        Record the agents' variables at a step, as returned by
+        model.agent_columns(fields).
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        columns = dict(columns, present=np.ones(len(ids), dtype=bool))
+        if self._current is None:
+            self.ids = ids.copy()
+            self._current = {name: np.array(values, dtype=(
+                self._logs[name].dtype)) for name, values in columns.items()}
+            self._initial = {name: values.copy()
+                             for name, values in self._current.items()}
+            self.steps.append(step)
+            return
+        slots = self._slots(ids)
+        for name, values in columns.items():
+            current = self._current[name]
+            if slots is None:
+                new = np.asarray(values, dtype=current.dtype)
+            else:
+                new = current.copy()
+                if name == "present":
+                    new[:] = False
+                new[slots] = values
+            changed = np.flatnonzero(_differs(new, current))
+            self._logs[name].append(step, changed, new[changed])
+            self._current[name] = new.copy() if new is values else new
+        self.steps.append(step)
+
+    def _replay(self, name, step):
+        """
+        Values of every slot of one variable at `step`.
+        """
+        values = self._initial[name].copy()
+        steps, slots, changes = self._logs[name].arrays()
+        end = np.searchsorted(steps, step, side="right")
+        # the last change of each slot up to the step
+        last, first_reversed = np.unique(slots[:end][::-1],
+                                         return_index=True)
+        values[last] = changes[:end][::-1][first_reversed]
+        return values
+
+    def state(self, step):
+        """
+        (ids, name -> column) of the agents at a recorded step, exactly as
+        they were recorded (apart from the order of the agents, which is
+        the slot order).
+        """
+        if step not in self.steps:
+            raise ValueError("step %s was not recorded" % step)
+        present = self._replay("present", step)
+        return self.ids[present], {name: self._replay(name, step)[present]
+                                   for name in self.fields}
+
+    def frame(self, step):
+        """
+        DataFrame of the agents at a recorded step, indexed by AgentID,
+        with the values as they appear in the agent-vars DataFrame.
+        """
+        ids, columns = self.state(step)
+        return pd.DataFrame(
+            {name: self.fields[name].decode(column)
+             for name, column in columns.items()},
+            index=pd.Index(ids, name="AgentID"))
+
+    def columns(self):
+        """
+        Step, AgentID and one column per variable with a row for every
+        agent at every recorded step, as the collector's full columns.
+        """
+        if self._current is None:
+            empty = {"Step": np.empty(0, dtype=np.int64),
+                     "AgentID": np.empty(0, dtype=np.int64)}
+            empty.update((name, np.empty(0, dtype=field.dtype))
+                         for name, field in self.fields.items())
+            return empty
+        names = ["present"] + list(self.fields)
+        values = {name: self._initial[name].copy() for name in names}
+        logs = {name: self._logs[name].arrays() for name in names}
+        cursor = dict.fromkeys(names, 0)
+        pieces = {name: [] for name in ["Step", "AgentID"] + names[1:]}
+        for step in self.steps:
+            for name in names:
+                steps, slots, changes = logs[name]
+                end = np.searchsorted(steps, step, side="right")
+                start = cursor[name]
+                values[name][slots[start:end]] = changes[start:end]
+                cursor[name] = end
+            present = values["present"]
+            pieces["Step"].append(np.full(np.count_nonzero(present), step,
+                                          dtype=np.int64))
+            pieces["AgentID"].append(self.ids[present])
+            for name in self.fields:
+                pieces[name].append(values[name][present])
+        return {name: np.concatenate(chunks)
+                for name, chunks in pieces.items()}
+
+    def nbytes(self):
+        """
+        Memory taken by the history, in bytes.
+        """
+        if self._current is None:
+            return 0
+        return (self.ids.nbytes +
+                sum(v.nbytes for v in self._initial.values()) +
+                sum(v.nbytes for v in self._current.values()) +
+                sum(log.nbytes() for log in self._logs.values()))
+
+    def arrays(self):
+        """
+        name -> array of the complete history, for checkpoints.
+        """
+        arrays = {"ids": self.ids,
+                  "steps": np.array(self.steps, dtype=np.int64)}
+        if self._current is None:
+            return arrays
+        for name, log in self._logs.items():
+            for part, values in zip(("steps", "slots", "values"),
+                                    log.arrays()):
+                arrays["log/%s/%s" % (name, part)] = values
+            arrays["initial/" + name] = self._initial[name]
+            arrays["current/" + name] = self._current[name]
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, fields, arrays):
+        """
+        Rebuild a history saved with arrays().
+        """
+        history = cls(fields)
+        history.ids = arrays["ids"].copy()
+        history.steps = arrays["steps"].tolist()
+        if "initial/present" not in arrays:
+            return history
+        history._initial, history._current = {}, {}
+        for name, log in history._logs.items():
+            log._joined = tuple(arrays["log/%s/%s" % (name, part)].copy()
+                                for part in ("steps", "slots", "values"))
+            history._initial[name] = arrays["initial/" + name].copy()
+            history._current[name] = arrays["current/" + name].copy()
+        return history
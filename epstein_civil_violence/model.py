@@ -1,9 +1,24 @@
+import numpy as np
 from mesa import Model
 from mesa.time import RandomActivation
-from mesa.space import Grid
-from mesa.datacollection import DataCollector
 
+from . import checkpoint
 from .agent import Cop, Citizen
+from .contagion import EventContagion
+from .convergence import ConvergenceDetector
+from .counts import CitizenCounts
+from .datacollection import AgentField, ColumnarDataCollector
+from .engine import (ArrayEngine, CellStream, draw_population, pick_among,
+                     resolve_conflicts)
+from .profiling import PhaseProfiler
+from .rng import BatchedDraws, LegacyDraws
+from .schedule import JailQueueActivation
+from .snapshot import SnapshotWriter
+from .space import (LiveVisionLayers, NeighborhoodIndex, OccupancyGrid,
+                    VisionLayers)
+from .states import (ACTIVE, BREEDS, CITIZEN, CONDITIONS, COP, CORRUPTED,
+                     MORAL_STATES)
+from .tiled import TiledEngine
 
 
 class EpsteinCivilViolence(Model):
@@ -28,8 +43,17 @@ class EpsteinCivilViolence(Model):
         arrest_prob_constant: set to ensure agents make plausible arrest
             probability estimates
         movement: binary, whether agents try to move at step end
+        batch_movement: if True (object engine), agents do not move during
+           their own step; instead all cops and free citizens move at the
+           end of the tick in one vectorized pass (see move_agents)
         max_iters: model may not have a natural stopping point, so we set a
             max.
+        convergence: None to always run max_iters steps, or the settings
+            of a convergence.ConvergenceDetector (a dict of its arguments,
+            or True for the defaults) that stops the run early once the
+            model-level series reach a fixed point or a cycle
+        stop_reason: why the run stopped: "max_iters", "fixed point" or
+            "periodic"; None while it runs
     Attributes added to implement Epstein's model with corruption and
     employment as additional factors:
         initial_unemployment_rate: approximate % of cells occupied
@@ -49,6 +73,68 @@ class EpsteinCivilViolence(Model):
            occupied by agents in an "Honest" moral_state
         max_unemployed_saturation: approximate % of cells that are allowed to
            be occupied by unemployed agents
+        engine: "object" to simulate every agent as a Citizen/Cop object, or
+           "numpy" to simulate the population with the vectorized
+           ArrayEngine (see engine.py), or "tiled" to split the numpy
+           engine's work over processes owning bands of the grid, with the
+           same results (see tiled.py)
+        workers: number of processes of the tiled engine; defaults to the
+           number of CPUs
+        scheduler: "random" to activate every agent each tick with mesa's
+           RandomActivation, or "jail_queue" to keep jailed citizens out of
+           the activation list until their release (see
+           schedule.JailQueueActivation); object engine only
+        use_vision: if True, citizens count cops, actives and corrupted
+           citizens within citizen_vision and cops arrest within cop_vision
+           (see space.VisionLayers); otherwise both look at their four
+           adjacent cells only
+        vision_updates: with use_vision, "tick" to rebuild the vision
+           counts at the start of every tick, or "incremental" (object
+           engine) to keep them up to date on every move, arrest, release
+           and change of condition or moral state, so citizens see the
+           current state of their window (see space.LiveVisionLayers)
+        agent_fields: names of the agent variables to collect ("x", "y",
+           "breed", "jail_sentence", "condition", "arrest_probability",
+           "is_employed", "moral_condition"), "all", or None to collect
+           model-level data only
+        agent_every: collect agent variables every this many steps
+        agent_history: "full" to keep one row of agent variables per agent
+           and collected step, or "changes" to keep the first collected
+           step and then only the values that changed; the agent-vars
+           DataFrame is the same (see history.AgentHistory)
+        output: optional output.RunOutput that the collected data is
+           streamed to during the run; it is closed when the run stops
+        keep_in_memory: if False, collected data is only written to the
+           output and not kept in the datacollector
+        profile: if True, time every phase of the agents' steps, data
+           collection and vision updates; read the results with
+           model.profiler.table()
+        rng: "legacy" for agents to draw their random numbers from the
+           model's random.Random one call at a time, exactly as before, or
+           "batched" to draw them from NumPy blocks generated every tick
+           (see rng.py); the population and the activation order come
+           from random.Random either way
+        contagion: "legacy" for every Corrupted and Honest citizen to try
+           to convert a neighbor within its own step, or "events" to sample
+           only the attempts that may succeed, in one phase after the
+           agents' steps (see contagion.py); object engine only
+        initialization: "legacy" to draw the initial population cell by
+           cell from random.Random, exactly as before, or "vectorized" to
+           draw it for all cells at once with array operations, with the
+           same distributions (see engine.draw_population); with the same
+           seed the population is then the one engine="numpy" starts from
+        seed: seed for the model's random number generators
+        draws: rng.LegacyDraws or rng.BatchedDraws the agents' steps draw
+           their random numbers from
+        parameters: the constructor arguments (except output), from which
+           from_checkpoint rebuilds the model
+        neighborhoods: NeighborhoodIndex with the precomputed neighborhoods
+           of every grid cell
+        citizen_counts: live counts of citizens by condition, moral state and
+           employment, split into jailed and free citizens; the counting and
+           saturation helpers read from it in O(1)
+        snapshots: snapshot.SnapshotWriter the model publishes its state to
+           (see publish_snapshots), or None
 
     """
 
@@ -65,6 +151,7 @@ class EpsteinCivilViolence(Model):
         active_threshold=0.1,
         arrest_prob_constant=2.3,
         movement=True,
+        batch_movement=False,
         initial_unemployment_rate=0.1,
         corruption_level=0.1,
         honest_level=0.6,
@@ -74,9 +161,38 @@ class EpsteinCivilViolence(Model):
         max_honest_saturation=0.35,
         max_unemployed_saturation=0.45,
         max_iters=1000,
+        convergence=None,
+        engine="object",
+        workers=None,
+        scheduler="random",
+        use_vision=False,
+        vision_updates="tick",
+        agent_fields="all",
+        agent_every=1,
+        agent_history="full",
+        output=None,
+        keep_in_memory=True,
+        profile=False,
+        rng="legacy",
+        contagion="legacy",
+        initialization="legacy",
+        seed=None,
     ):
-
+        # constructor arguments, saved with checkpoints; the output is
+        # attached to a run rather than part of its state
+        self.parameters = {name: value for name, value in locals().items()
+                           if name not in ("self", "output", "__class__")}
         super().__init__()
+        self.profiler = PhaseProfiler() if profile else None
+        # mesa keeps the generator on the class, where the next model
+        # created would replace it
+        self.random = self.random
+        if rng not in ("legacy", "batched"):
+            raise ValueError('rng must be "legacy" or "batched"')
+        if rng == "batched":
+            self.draws = BatchedDraws(seed)
+        else:
+            self.draws = LegacyDraws(self.random)
         self.height = height
         self.width = width
         self.citizen_density = citizen_density
@@ -88,20 +204,43 @@ class EpsteinCivilViolence(Model):
         self.active_threshold = active_threshold
         self.arrest_prob_constant = arrest_prob_constant
         self.movement = movement
+        self.batch_movement = batch_movement
+        # whether agents move within their own step
+        self.agents_move = movement and not batch_movement
         self.initial_unemployment_rate = initial_unemployment_rate
         self.corruption_level = corruption_level
         self.honest_level = honest_level,
         self.susceptible_level = 1 - (corruption_level + honest_level)
         self.max_iters = max_iters
         self.iteration = 0
-        self.schedule = RandomActivation(self)
+        if scheduler not in ("random", "jail_queue"):
+            raise ValueError('scheduler must be "random" or "jail_queue"')
+        if scheduler == "jail_queue":
+            self.schedule = JailQueueActivation(self)
+        else:
+            self.schedule = RandomActivation(self)
         self.corruption_transmission_prob = corruption_transmission_prob
         self.honest_transmission_prob = honest_transmission_prob
         self.max_corruption_saturation = max_corruption_saturation
         self.max_honest_saturation = max_honest_saturation
         self.max_unemployed_saturation = max_unemployed_saturation
 
-        self.grid = Grid(height, width, torus=True)
+        self.grid = OccupancyGrid(height, width, torus=True)
+        # neighborhoods of every cell, looked up instead of recomputed
+        self.neighborhoods = NeighborhoodIndex(self.grid.width,
+                                               self.grid.height)
+        self.use_vision = use_vision
+        if vision_updates not in ("tick", "incremental"):
+            raise ValueError('vision_updates must be "tick" or "incremental"')
+        self.vision_layers = None
+        # the vision layers the agents update as they change, once built
+        self.live_layers = None
+        if use_vision:
+            layers = (LiveVisionLayers if vision_updates == "incremental"
+                      else VisionLayers)
+            self.vision_layers = layers(self.neighborhoods, citizen_vision)
+        # live tallies of citizen states, updated by the citizens themselves
+        self.citizen_counts = CitizenCounts()
         model_reporters = {
             "Quiescent": lambda m: self.count_type_citizens(m, "Quiescent"),
             "Active": lambda m: self.count_type_citizens(m, "Active"),
@@ -114,20 +253,38 @@ class EpsteinCivilViolence(Model):
                 self.count_moral_type_citizens(m, "Susceptible")
         }
         agent_reporters = {
-            "x": lambda a: a.pos[0],
-            "y": lambda a: a.pos[1],
-            "breed": lambda a: a.breed,
-            "jail_sentence": lambda a: getattr(a, "jail_sentence", None),
-            "condition": lambda a: getattr(a, "condition", None),
-            "arrest_probability": lambda a:
-                getattr(a, "arrest_probability", None),
-            "is_employed": lambda a: getattr(a, "is_employed", None),
-            "moral_condition": lambda a: getattr(a, "moral_condition", None),
+            "x": AgentField(lambda a: a.pos[0], "int"),
+            "y": AgentField(lambda a: a.pos[1], "int"),
+            "breed": AgentField(lambda a: a.breed, "category", BREEDS),
+            "jail_sentence": AgentField(
+                lambda a: getattr(a, "jail_sentence", None), "optional int"),
+            "condition": AgentField(
+                lambda a: getattr(a, "condition", None), "category",
+                CONDITIONS),
+            "arrest_probability": AgentField(
+                lambda a: getattr(a, "arrest_probability", None), "float"),
+            "is_employed": AgentField(
+                lambda a: getattr(a, "is_employed", None), "optional int"),
+            "moral_condition": AgentField(
+                lambda a: getattr(a, "moral_condition", None), "category",
+                MORAL_STATES),
         }
-        self.datacollector = DataCollector(
-            model_reporters=model_reporters, agent_reporters=agent_reporters
+        if agent_fields == "all":
+            agent_fields = list(agent_reporters)
+        unknown = set(agent_fields or ()) - set(agent_reporters)
+        if unknown:
+            raise ValueError("unknown agent fields: %s" %
+                             ", ".join(sorted(unknown)))
+        self.datacollector = ColumnarDataCollector(
+            model_reporters=model_reporters,
+            agent_fields={name: agent_reporters[name]
+                          for name in agent_fields or ()},
+            agent_every=agent_every,
+            expected_records=max_iters // agent_every + 2,
+            output=output,
+            keep_in_memory=keep_in_memory,
+            agent_history=agent_history,
         )
-        unique_id = 0
         if self.cop_density + self.citizen_density > 1:
             raise ValueError("Cop + citizen density must be less than 1")
 
@@ -137,6 +294,54 @@ class EpsteinCivilViolence(Model):
         if self.corruption_level + self.susceptible_level > 1:
             raise ValueError("corrupt + susceptible must be less than 1 ")
 
+        if contagion not in ("legacy", "events"):
+            raise ValueError('contagion must be "legacy" or "events"')
+
+        if initialization not in ("legacy", "vectorized"):
+            raise ValueError(
+                'initialization must be "legacy" or "vectorized"')
+
+        if engine not in ("object", "numpy", "tiled"):
+            raise ValueError('engine must be "object", "numpy" or "tiled"')
+
+        self.engine = None
+        # the event-driven contagion phase, once the agents exist
+        self.contagion = None
+        if engine == "numpy":
+            self.engine = ArrayEngine(self)
+        elif engine == "tiled":
+            self.engine = TiledEngine(self, workers)
+        elif initialization == "vectorized":
+            self._create_agents_vectorized()
+        else:
+            self._create_agents()
+        if self.engine is None:
+            self.grid.rebuild_occupancy()
+            if isinstance(self.vision_layers, LiveVisionLayers):
+                self._update_vision_layers()
+                self.live_layers = self.vision_layers
+            if contagion == "events":
+                self.contagion = EventContagion(self)
+
+        self.snapshots = None
+        self.snapshot_every = 1
+
+        self.convergence = None
+        if convergence is not None and convergence is not False:
+            self.convergence = ConvergenceDetector(
+                **({} if convergence is True else convergence))
+        self.stop_reason = None
+
+        self.running = True
+        self.datacollector.collect(self)
+        if self.convergence is not None:
+            self.convergence.update(self)
+
+    def _create_agents(self):
+        """
+        Place a Cop or a Citizen on each cell, or leave it empty.
+        """
+        unique_id = 0
         for (contents, x, y) in self.grid.coord_iter():
             if self.random.random() < self.cop_density:
                 cop = Cop(unique_id, self, (x, y), vision=self.cop_vision)
@@ -181,85 +386,252 @@ class EpsteinCivilViolence(Model):
                 self.grid[y][x] = citizen
                 self.schedule.add(citizen)
 
-        self.running = True
-        self.datacollector.collect(self)
+    def _create_agents_vectorized(self):
+        """
+        Draw the whole initial population with engine.draw_population, then
+        create its agents in cell order, as _create_agents does, and count
+        the citizens in one go.
+        """
+        index = self.neighborhoods
+        stream = CellStream(self.random.getrandbits(128), index.ncells)
+        population = draw_population(
+            self, lambda slot, low=0.0, high=1.0:
+                stream.uniform(0, slot, low, high))
+        columns = zip(*(population[name].tolist() for name in (
+            "cell", "breed", "is_employed", "moral_state", "hardship",
+            "risk_aversion", "threshold")))
+        grid, add = self.grid, self.schedule.add
+        for unique_id, (cell, breed, is_employed, moral_state, hardship,
+                        risk_aversion, threshold) in enumerate(columns):
+            x, y = divmod(cell, index.height)
+            if breed == COP:
+                agent = Cop(unique_id, self, (x, y), vision=self.cop_vision)
+            else:
+                agent = Citizen(
+                    unique_id,
+                    self,
+                    (x, y),
+                    hardship=hardship,
+                    legitimacy=self.legitimacy,
+                    regime_legitimacy=self.legitimacy,
+                    risk_aversion=risk_aversion,
+                    active_threshold=self.active_threshold,
+                    threshold=threshold,
+                    vision=self.citizen_vision,
+                    is_employed=is_employed,
+                    moral_state=moral_state,
+                    corruption_transmission_prob=(
+                        self.corruption_transmission_prob),
+                    count=False,
+                )
+            grid[y][x] = agent
+            add(agent)
+        citizen = population["breed"] == CITIZEN
+        self.citizen_counts.add_population(
+            population["is_employed"][citizen],
+            population["moral_state"][citizen])
 
     def step(self):
         """
         Advance the model by one step and collect data.
         """
-        self.schedule.step()
+        profiler = self.profiler
+        if self.engine is None:
+            self.draws.refill(self.schedule.get_agent_count())
+            if (self.vision_layers is not None and
+                    self.live_layers is None):
+                if profiler is not None:
+                    profiler.start()
+                self._update_vision_layers()
+                if profiler is not None:
+                    profiler.lap("model", "vision_layers")
+            self.schedule.step()
+            if self.movement and self.batch_movement:
+                if profiler is not None:
+                    profiler.start()
+                self.move_agents()
+                if profiler is not None:
+                    profiler.lap("model", "movement")
+            if self.contagion is not None:
+                if profiler is not None:
+                    profiler.start()
+                self.contagion.step(
+                    np.random.default_rng(self.random.getrandbits(64)))
+                if profiler is not None:
+                    profiler.lap("model", "contagion")
+        else:
+            self.engine.step()
+            # keep the schedule's clock, which the data collector reads
+            self.schedule.steps += 1
+            self.schedule.time += 1
         # collect data
+        if profiler is not None:
+            profiler.start()
         self.datacollector.collect(self)
+        if profiler is not None:
+            profiler.lap("model", "collect")
+        if (self.snapshots is not None and
+                self.schedule.steps % self.snapshot_every == 0):
+            self.snapshots.publish(self)
+            if profiler is not None:
+                profiler.lap("model", "snapshot")
         self.iteration += 1
         if self.iteration > self.max_iters:
             self.running = False
+            self.stop_reason = "max_iters"
+        elif self.convergence is not None:
+            reason = self.convergence.update(self)
+            if reason is not None:
+                self.running = False
+                self.stop_reason = reason
+        if not self.running:
+            self.datacollector.close()
+            if self.engine is not None:
+                self.engine.close()
+
+    def publish_snapshots(self, name=None, path=None, every=1):
+        """
+        Publish the grid occupancy and agent columns to shared memory now
+        and then every `every` steps, for other processes to read with
+        snapshot.SnapshotReader while the run goes on.
+        Args:
+            name: name of the shared memory block; chosen by the system if
+                None
+            path: publish to a memory-mapped file at this path instead
+            every: publish at steps that are a multiple of this
+        Returns:
+            the snapshot.SnapshotWriter; its name (or path) is what readers
+            attach to, and closing it ends the publishing
+        """
+        self.snapshots = SnapshotWriter(self, name, path)
+        self.snapshot_every = every
+        return self.snapshots
+
+    def move_agents(self):
+        """
+        Batched movement phase: every cop and every free citizen picks a
+        random empty von Neumann neighbor cell, read from the grid's
+        occupancy bitmap as it is at the start of the phase, and moves
+        there. When several agents pick the same cell, the one with the
+        highest random priority gets it and the others stay put. The draws
+        come from a NumPy generator seeded from the model's random.Random
+        once per tick.
+        """
+        agents = [a for a in self.schedule.agents
+                  if a.kind == COP or a.jail_sentence == 0]
+        if not agents:
+            return
+        index = self.neighborhoods
+        cells = np.fromiter((index.cell(a.pos) for a in agents),
+                            dtype=np.int64, count=len(agents))
+        around = index.around(cells)
+        generator = np.random.default_rng(self.random.getrandbits(64))
+        choice = pick_among(~self.grid.occupancy()[around],
+                            generator.random(len(agents)))
+        priority = generator.random(len(agents))
+        moving = np.flatnonzero(choice >= 0)
+        destinations = around[moving, choice[moving]]
+        won = resolve_conflicts(destinations, priority[moving])
+        movers = [agents[i] for i in moving[won].tolist()]
+        # vacate every old cell before filling the new ones
+        for agent in movers:
+            self.grid._remove_agent(agent.pos, agent)
+        for agent, cell in zip(movers, destinations[won].tolist()):
+            pos = index.position(cell)
+            if self.live_layers is not None:
+                self.live_layers.move(agent, agent.pos, pos)
+            agent.pos = pos
+            self.grid._place_agent(pos, agent)
+
+    def move_agent(self, agent, pos):
+        """
+        Move an agent on the grid, keeping the live vision layers (if any)
+        up to date.
+        """
+        if self.live_layers is not None:
+            self.live_layers.move(agent, agent.pos, pos)
+        self.grid.move_agent(agent, pos)
+
+    def save_checkpoint(self, path):
+        """
+        Save the complete state of the model (agents or engine arrays, grid,
+        random generator state and collected data) to a compressed .npz
+        file, see checkpoint.py.
+        """
+        checkpoint.save(self, path)
+
+    @classmethod
+    def from_checkpoint(cls, path, output=None):
+        """
+        Rebuild a model from a file written by save_checkpoint. Continuing
+        the restored model gives the same results, bit for bit, as if the
+        saved run had never stopped.
+        Args:
+            path: checkpoint file
+            output: optional output.RunOutput for the rest of the run; the
+                tables a run already wrote to its directory are continued
+                from the checkpoint's step
+        """
+        return checkpoint.load(cls, path, output=output)
+
+    def agent_columns(self, fields):
+        """
+        Agent ids and one typed column per requested AgentField, for the
+        data collector.
+        """
+        if self.engine is not None:
+            return self.engine.agent_columns(fields)
+        agents = self.schedule.agents
+        ids = np.fromiter((a.unique_id for a in agents), dtype=np.int64,
+                          count=len(agents))
+        return ids, {name: field.gather(agents)
+                     for name, field in fields.items()}
+
+    def _update_vision_layers(self):
+        """
+        Rasterize the agents into the vision layers at the start of a tick.
+        """
+        agents = self.schedule.agents
+        cells = np.array([self.neighborhoods.cell(a.pos) for a in agents],
+                         dtype=np.int64)
+        cop = np.array([a.kind == COP for a in agents], dtype=bool)
+        active = np.array([a.kind == CITIZEN and a.condition_code == ACTIVE
+                           and a.jail_sentence == 0 for a in agents],
+                          dtype=bool)
+        corrupted = np.array([a.kind == CITIZEN and
+                              a.moral_code == CORRUPTED for a in agents],
+                             dtype=bool)
+        self.vision_layers.update(cells, {
+            "cops": cop, "actives": active, "corrupted": corrupted,
+            "non_corrupted": ~cop & ~corrupted})
 
     @staticmethod
     def count_type_citizens(model, condition, exclude_jailed=False):
         """
         Helper method to count agents by Quiescent/Active.
         """
-        count = 0
-        for agent in model.schedule.agents:
-            if agent.breed == "cop":
-                continue
-            if exclude_jailed and agent.jail_sentence:
-                continue
-            if agent.condition == condition:
-                count += 1
-        return count
+        return model.citizen_counts.count(condition, exclude_jailed)
 
     @staticmethod
     def get_unemployed_saturation(model, exclude_jailed=False):
         """
         Helper method to count unemployed agents.
         """
-        unempl_count = 0
-        total_count = 0
-        for agent in model.schedule.agents:
-            if agent.breed == "cop":
-                continue
-            if exclude_jailed and agent.jail_sentence:
-                continue
-            if agent.is_employed == 0:
-                unempl_count += 1
-            total_count += 1
-        return unempl_count/total_count
+        return model.citizen_counts.saturation("Unemployed", exclude_jailed)
 
     @staticmethod
     def get_corrupted_saturation(model, exclude_jailed=False):
         """
         Helper method to count corrupted agents.
         """
-        corr_count = 0
-        total_count = 0
-        for agent in model.schedule.agents:
-            if agent.breed == "cop":
-                continue
-            if exclude_jailed and agent.jail_sentence:
-                continue
-            if agent.moral_state == "Corrupted":
-                corr_count += 1
-            total_count += 1
-        return corr_count/total_count
+        return model.citizen_counts.saturation("Corrupted", exclude_jailed)
 
     @staticmethod
     def get_honest_saturation(model, exclude_jailed=False):
         """
         Helper method to count honest agents.
         """
-        honest_count = 0
-        total_count = 0
-        for agent in model.schedule.agents:
-            if agent.breed == "cop":
-                continue
-            if exclude_jailed and agent.jail_sentence:
-                continue
-            if agent.moral_state == "Honest":
-                honest_count += 1
-            total_count += 1
-        return honest_count/total_count
+        return model.citizen_counts.saturation("Honest", exclude_jailed)
 
     @staticmethod
     def count_moral_type_citizens(model, moral_condition,
@@ -267,49 +639,25 @@ class EpsteinCivilViolence(Model):
         """
         Helper method to count agents by all moral conditions.
         """
-        count = 0
-        for agent in model.schedule.agents:
-            if agent.breed == "cop":
-                continue
-            if exclude_jailed and agent.jail_sentence:
-                continue
-            if agent.moral_state == moral_condition:
-                count += 1
-        return count
+        return model.citizen_counts.count(moral_condition, exclude_jailed)
 
     @staticmethod
     def count_jailed(model):
         """
         Helper method to count jailed agents.
         """
-        count = 0
-        for agent in model.schedule.agents:
-            if agent.breed == "citizen" and agent.jail_sentence:
-                count += 1
-        return count
+        return model.citizen_counts.jailed["total"]
 
     @staticmethod
     def count_employed(model):
         """
         Helper method to count employed agents.
         """
-        count = 0
-        for agent in model.schedule.agents:
-            if agent.breed == "cop":
-                continue
-            if agent.is_employed == 1:
-                count += 1
-        return count
+        return model.citizen_counts.count("Employed")
 
     @staticmethod
     def count_corrupted(model):
         """
         Helper method to count corrupted agents.
         """
-        count = 0
-        for agent in model.schedule.agents:
-            if agent.breed == "cop":
-                continue
-            if agent.is_corrupted == 1:
-                count += 1
-        return count
+        return model.citizen_counts.count("Corrupted")
@@ -0,0 +1,279 @@
+import os
+
+import numpy as np
+
+FORMATS = {"parquet": ".parquet", "arrow": ".arrow"}
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("writing run output to files requires pyarrow "
+                          "(pip install pyarrow)")
+    return pyarrow
+
+
+def _remove_table(path):
+    """
+    Delete a table written by an earlier run at `path`.
+    """
+    if os.path.isdir(path):
+        for name in os.listdir(path):
+            if name.lstrip(".").startswith("part-"):
+                os.remove(os.path.join(path, name))
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def _until(batch, step):
+    """
+    The rows of a record batch up to and including `step`.
+    """
+    pa = _pyarrow()
+    return batch.filter(pa.array(batch.column("Step").to_numpy() <= step))
+
+
+class _TableWriter:
+    """
+    Appends record batches to a table, replacing the table of an earlier
+    run on the first batch unless resume() continues it. Each batch is
+    readable as soon as it is written, without a footer written on close:
+
+    - an Arrow table is one file in the IPC stream format, read up to its
+      last complete batch;
+    - a Parquet table is a directory with one file per batch, each written
+      under a hidden name and renamed once complete.
+    """
+
+    def __init__(self, path, format):
+        self.path = path
+        self.format = format
+        self._sink = None
+        self._writer = None
+        self._parts = None
+
+    def resume(self, step):
+        """
+        Continue the table of an earlier run: drop its rows after `step`
+        and append the next batches to the rest.
+        """
+        pa = _pyarrow()
+        if self.format == "parquet":
+            os.makedirs(self.path, exist_ok=True)
+            self._parts = 0
+            for name in sorted(os.listdir(self.path)):
+                path = os.path.join(self.path, name)
+                if name.startswith(".part-"):
+                    os.remove(path)
+                if not name.startswith("part-"):
+                    continue
+                table = pa.parquet.read_table(path)
+                steps = table.column("Step").to_numpy()
+                if len(steps) and steps.min() > step:
+                    os.remove(path)
+                    continue
+                if len(steps) and steps.max() > step:
+                    partial = os.path.join(self.path, "." + name)
+                    pa.parquet.write_table(
+                        table.filter(pa.array(steps <= step)), partial)
+                    os.replace(partial, path)
+                self._parts = max(self._parts, int(name[5:11]) + 1)
+            return
+        if not os.path.exists(self.path):
+            return
+        # the stream is copied up to `step` into a new file, which replaces
+        # the old one once complete and is then appended to
+        table = open_table(self.path)
+        partial = os.path.join(os.path.dirname(self.path),
+                               "." + os.path.basename(self.path))
+        self._sink = pa.OSFile(partial, "wb")
+        self._writer = pa.ipc.new_stream(self._sink, table.schema)
+        for batch in table.to_batches():
+            batch = _until(batch, step)
+            if batch.num_rows:
+                self._writer.write_batch(batch)
+        del table
+        os.replace(partial, self.path)
+
+    def write(self, batch):
+        pa = _pyarrow()
+        if self.format == "parquet":
+            if self._parts is None:
+                _remove_table(self.path)
+                os.makedirs(self.path, exist_ok=True)
+                self._parts = 0
+            name = "part-%06d.parquet" % self._parts
+            partial = os.path.join(self.path, "." + name)
+            pa.parquet.write_table(pa.Table.from_batches([batch]), partial)
+            os.replace(partial, os.path.join(self.path, name))
+            self._parts += 1
+            return
+        if self._writer is None:
+            _remove_table(self.path)
+            self._sink = pa.OSFile(self.path, "wb")
+            self._writer = pa.ipc.new_stream(self._sink, batch.schema)
+        self._writer.write_batch(batch)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._sink.close()
+            self._writer = self._sink = None
+
+
+class RunOutput:
+    """
+    Streams the data collected during a run to columnar files in a
+    directory: model variables to "model" and, optionally, agent variables
+    to "agents" (".parquet" or ".arrow"). Rows are buffered and written as
+    one record batch every `flush_every` collected steps, so the memory
+    held by a run stays bounded. Every written batch can be read while
+    the run goes on, and after a crash, which loses at most the steps
+    buffered since the last flush: Arrow tables are IPC stream files and
+    Parquet tables are directories of one file per batch (see
+    _TableWriter). Arrow tables can be memory-mapped for analysis, see
+    open_table.
+
+    Attributes:
+        directory: output directory, created if missing
+        format: "parquet" or "arrow"
+        flush_every: number of collected steps per record batch
+        agents: whether to write agent variables too
+    """
+
+    def __init__(self, directory, format="parquet", flush_every=100,
+                 agents=False):
+        if format not in FORMATS:
+            raise ValueError('format must be "parquet" or "arrow"')
+        _pyarrow()
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.format = format
+        self.flush_every = flush_every
+        self.agents = agents
+        self._model_writer = _TableWriter(self.path("model"), format)
+        self._agent_writer = _TableWriter(self.path("agents"), format)
+        self._model_rows = []
+        self._agent_chunks = []
+        self._pending = 0
+        self.closed = False
+
+    def path(self, table):
+        """
+        File (Arrow) or directory (Parquet) the "model" or "agents" table
+        is written to.
+        """
+        return os.path.join(self.directory, table + FORMATS[self.format])
+
+    def resume(self, step):
+        """
+        Continue the tables a run that was checkpointed at `step` wrote to
+        this directory, instead of replacing them: rows after `step`,
+        written before the run stopped, are dropped and the resumed run's
+        steps are appended. See checkpoint.load.
+        """
+        self._model_writer.resume(step)
+        if self.agents:
+            self._agent_writer.resume(step)
+
+    def write(self, step, model_row, agent_fields=None, ids=None,
+              columns=None):
+        """
+        Buffer one collected step.
+        Args:
+            step: model step
+            model_row: reporter name -> value
+            agent_fields: name -> AgentField of the agent columns, if any
+            ids, columns: agent ids and typed agent columns of this step
+        """
+        self._model_rows.append(dict(model_row, Step=step))
+        if self.agents and ids is not None:
+            # copies: the columns may be views of state that changes
+            # before the next flush
+            self._agent_chunks.append((step, agent_fields, ids.copy(), {
+                name: column.copy() for name, column in columns.items()}))
+        self._pending += 1
+        if self._pending >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered steps as one record batch.
+        """
+        pa = _pyarrow()
+        if self._model_rows:
+            self._model_writer.write(
+                pa.RecordBatch.from_pylist(self._model_rows))
+        if self._agent_chunks:
+            self._agent_writer.write(self._agent_batch())
+        self._model_rows = []
+        self._agent_chunks = []
+        self._pending = 0
+
+    def _agent_batch(self):
+        pa = _pyarrow()
+        fields = self._agent_chunks[0][1]
+        data = {
+            "Step": np.concatenate([np.full(len(ids), step, dtype=np.int64)
+                                    for step, _, ids, _ in
+                                    self._agent_chunks]),
+            "AgentID": np.concatenate([ids for _, _, ids, _ in
+                                       self._agent_chunks]),
+        }
+        for name, field in fields.items():
+            column = np.concatenate([columns[name] for _, _, _, columns in
+                                     self._agent_chunks])
+            if field.kind == "category":
+                data[name] = pa.DictionaryArray.from_arrays(
+                    pa.array(column, mask=column < 0),
+                    pa.array(field.categories, type=pa.string()))
+            elif field.kind == "optional int":
+                data[name] = pa.array(column, mask=column < 0)
+            else:
+                data[name] = pa.array(column)
+        return pa.RecordBatch.from_pydict(data)
+
+    def close(self):
+        """
+        Flush what is buffered and finalize the files.
+        """
+        if self.closed:
+            return
+        self.flush()
+        self._model_writer.close()
+        self._agent_writer.close()
+        self.closed = True
+
+
+def open_table(path, memory_map=True):
+    """
+    Read a table written by RunOutput as a pyarrow Table; Arrow tables
+    are memory-mapped rather than read into memory. A table whose run is
+    still going or crashed holds the batches written so far.
+    """
+    pa = _pyarrow()
+    if path.endswith(FORMATS["arrow"]):
+        source = pa.memory_map(path) if memory_map else pa.OSFile(path)
+        reader = pa.ipc.open_stream(source)
+        batches = []
+        while True:
+            try:
+                batches.append(reader.read_next_batch())
+            except StopIteration:
+                break
+            except (pa.ArrowInvalid, OSError):
+                # a batch cut short by a crash
+                break
+        return pa.Table.from_batches(batches, reader.schema)
+    return pa.parquet.read_table(path, memory_map=memory_map)
+
+
+def read_model_vars(directory, format="parquet"):
+    """
+    The model-vars DataFrame of a run written by RunOutput.
+    """
+    path = os.path.join(directory, "model" + FORMATS[format])
+    return open_table(path).to_pandas().set_index("Step")
@@ -0,0 +1,111 @@
+from functools import partial
+
+import numpy as np
+
+# the uniform variates of an agent step, as (low, high); each is drawn at
+# most once per agent and tick
+VARIATES = {
+    "w_unemployment": (0.03, 0.43),
+    "w_corruption": (0.01, 0.03),
+    "legitimacy_weight": (0.3, 0.4),
+    "corruption_scale": (0.001, 0.1),
+    "honesty_scale": (0.01, 0.1),
+    "job_loss_rate": (0.0, 0.09),
+    "job_gain_rate": (0.0, 0.009),
+}
+# plain uniforms in [0, 1) (rolls and choices) per agent and tick, at most
+ROLLS_PER_AGENT = 8
+
+
+class LegacyDraws:
+    """
+    The random numbers of the agent steps, drawn one call at a time from
+    the model's random.Random in the order the original code drew them, so
+    runs are identical to those of earlier versions.
+
+    Every name in VARIATES is a callable returning a uniform variate in its
+    range; random, choice and randint are those of random.Random.
+    """
+
+    def __init__(self, generator):
+        self.random = generator.random
+        self.choice = generator.choice
+        self.randint = generator.randint
+        for name, (low, high) in VARIATES.items():
+            setattr(self, name, partial(generator.uniform, low, high))
+
+    def refill(self, agents):
+        pass
+
+
+class BatchedDraws:
+    """
+    The random numbers of the agent steps, generated by a NumPy Generator
+    in vectorized blocks: one stream of pre-scaled variates per name in
+    VARIATES plus one of plain uniforms for rolls and choices. Every
+    variate is handed out by the C-level __next__ of a list iterator, so a
+    draw costs less than a call to random.Random.uniform.
+
+    refill(agents) runs at the start of every tick and tops up each
+    stream that might not last the tick, appending a block of at least
+    `block_size` fresh variates to what is left. The streams are therefore
+    fully determined by the seed and the number of agents at each tick.
+
+    Attributes:
+        generator: numpy.random.Generator the blocks are drawn from
+        block_size: minimum number of variates added per refill
+    """
+
+    def __init__(self, seed=None, block_size=4096):
+        self.generator = np.random.Generator(
+            np.random.PCG64(np.random.SeedSequence(seed)))
+        self.block_size = block_size
+        self._streams = {name: iter(()) for name in
+                         ["random"] + list(VARIATES)}
+        for name, stream in self._streams.items():
+            setattr(self, name, stream.__next__)
+
+    def choice(self, seq):
+        return seq[int(self.random() * len(seq))]
+
+    def randint(self, a, b):
+        return a + int(self.random() * (b - a + 1))
+
+    def _set(self, name, values):
+        self._streams[name] = iter(values)
+        setattr(self, name, self._streams[name].__next__)
+
+    def refill(self, agents):
+        """
+        Make sure every stream holds enough variates for a tick of
+        `agents` agents.
+        """
+        for name, stream in self._streams.items():
+            needed = agents * (ROLLS_PER_AGENT if name == "random" else 1)
+            remaining = stream.__length_hint__()
+            if remaining >= needed:
+                continue
+            block = self.generator.random(max(needed, self.block_size))
+            if name != "random":
+                low, high = VARIATES[name]
+                block = low + (high - low) * block
+            self._set(name, list(stream) + block.tolist())
+
+    def getstate(self):
+        """
+        (generator state, name -> undrawn variates of every stream).
+        """
+        remaining = {}
+        for name, stream in self._streams.items():
+            remaining[name] = list(stream)
+            self._set(name, remaining[name])
+        return self.generator.bit_generator.state, remaining
+
+    def setstate(self, state):
+        """
+        Restore a state returned by getstate().
+        """
+        generator_state, remaining = state
+        self.generator.bit_generator.state = generator_state
+        for name, values in remaining.items():
+            self._set(name, list(values))
@@ -0,0 +1,104 @@
+import heapq
+import itertools
+from collections import OrderedDict
+
+from mesa.time import RandomActivation
+
+
+class JailQueueActivation(RandomActivation):
+    """
+    RandomActivation that only activates free agents. A jailed citizen
+    leaves the activation list when it is sentenced and waits in a priority
+    queue keyed by its release step; it rejoins the list when the schedule
+    reaches that step. The cost of a tick is therefore proportional to the
+    number of free agents, however many are in jail.
+
+    Sentences are not decremented tick by tick: a citizen stores the step
+    it is released at and its jail_sentence is the number of steps left
+    until then. A citizen given a sentence of s during tick t (or between
+    ticks, when schedule.steps == t) is skipped in ticks t..t+s-1 and acts
+    again in tick t + s. This is what RandomActivation does when the
+    arrested citizen's turn comes after the arresting cop's; when it came
+    before, RandomActivation keeps the citizen in jail for one more tick.
+
+    Random draws: every tick shuffles the ids of the free agents only, so
+    as soon as anyone is jailed the draw sequence, and with it the run,
+    differs from RandomActivation with the same seed. Released citizens
+    rejoin the list in order of release step, then unique_id. Runs are
+    reproducible for a given seed.
+
+    Attributes:
+        active: unique_id -> agent of the agents that are activated
+        jailed: heap of (release step, unique_id, sequence number, agent) of
+            jailed citizens; it may hold stale entries, which are skipped
+    """
+
+    def __init__(self, model):
+        super().__init__(model)
+        self.active = OrderedDict()
+        self.jailed = []
+        self._sequence = itertools.count()
+
+    def add(self, agent):
+        """
+        Add an agent, free or jailed, to the schedule.
+        """
+        super().add(agent)
+        release = getattr(agent, "release_step", None)
+        if release is not None and release > self.steps:
+            self._push(agent)
+        else:
+            self.active[agent.unique_id] = agent
+
+    def remove(self, agent):
+        super().remove(agent)
+        self.active.pop(agent.unique_id, None)
+        self.jailed = [entry for entry in self.jailed if entry[3] is not agent]
+        heapq.heapify(self.jailed)
+
+    def jail(self, agent):
+        """
+        Take an agent whose release_step lies in the future out of the
+        activation list until then.
+        """
+        if agent.unique_id not in self._agents:
+            return
+        self.active.pop(agent.unique_id, None)
+        self._push(agent)
+
+    def _push(self, agent):
+        heapq.heappush(self.jailed, (agent.release_step, agent.unique_id,
+                                     next(self._sequence), agent))
+
+    def free(self, agent):
+        """
+        Put an agent back into the activation list right away.
+        """
+        if agent.unique_id in self._agents:
+            self.active[agent.unique_id] = agent
+
+    def agent_buffer(self, shuffled=False):
+        """
+        The free agents, optionally shuffled; agents jailed while the
+        buffer is consumed are skipped.
+        """
+        agent_keys = list(self.active.keys())
+        if shuffled:
+            self.model.random.shuffle(agent_keys)
+        for key in agent_keys:
+            if key in self.active:
+                yield self.active[key]
+
+    def step(self):
+        """
+        Activate the free agents in random order, then release the
+        citizens whose sentence is over.
+        """
+        super().step()
+        while self.jailed and self.jailed[0][0] <= self.steps:
+            release, unique_id, _, agent = heapq.heappop(self.jailed)
+            # entries of citizens freed or re-sentenced since are stale
+            if unique_id in self.active or agent.release_step != release:
+                continue
+            self.active[unique_id] = agent
+            agent.release()
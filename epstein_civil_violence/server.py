@@ -1,9 +1,19 @@
-from mesa.visualization.ModularVisualization import ModularServer
+import base64
+import json
+import os
+
+import numpy as np
+import tornado.escape
+from mesa.visualization.ModularVisualization import (ModularServer,
+                                                     SocketHandler,
+                                                     VisualizationElement)
 from mesa.visualization.UserParam import UserSettableParameter
 from mesa.visualization.modules import CanvasGrid
 
 from .model import EpsteinCivilViolence
 from .agent import Citizen, Cop
+from .snapshot import FIELDS
+from .states import COP, CORRUPTED, QUIESCENT
 
 
 COP_COLOR = "#000000"
@@ -14,6 +24,20 @@ AGENT_QUIET_UNEMPLOYED_CORRUPT_COLOR = "#F2FF00"
 AGENT_REBEL_COLOR = "#CC0000"
 JAIL_COLOR = "#757575"
 
+# color code of a cell in DeltaCanvasGrid frames -> (color, radius); code 0
+# is an empty cell
+CELL_STYLES = (
+    (None, 0),
+    (AGENT_QUIET_EMPLOYED_NOT_CORRUPT_COLOR, 0.8),
+    (AGENT_QUIET_EMPLOYED_CORRUPT_COLOR, 0.8),
+    (AGENT_QUIET_UNEMPLOYED_NOT_CORRUPT_COLOR, 0.8),
+    (AGENT_QUIET_UNEMPLOYED_CORRUPT_COLOR, 0.8),
+    (AGENT_REBEL_COLOR, 0.8),
+    (JAIL_COLOR, 0.8),
+    (COP_COLOR, 0.5),
+)
+REBEL_CODE, JAIL_CODE, COP_CODE = 5, 6, 7
+
 
 def citizen_cop_portrayal(agent):
     if agent is None:
@@ -51,6 +75,230 @@ def citizen_cop_portrayal(agent):
     return portrayal
 
 
+def snapshot_portrayals(snapshot):
+    """
+    CanvasGrid render data (layer -> list of portrayals) of a
+    snapshot.Snapshot, colored like citizen_cop_portrayal.
+    """
+    columns = snapshot.columns
+    grid_state = {0: [], 1: []}
+    for i in range(len(snapshot.ids)):
+        portrayal = {"Shape": "circle", "Filled": "true",
+                     "x": int(columns["x"][i]), "y": int(columns["y"][i])}
+        if columns["breed"][i] == COP:
+            portrayal.update(Color=COP_COLOR, r=0.5, Layer=1)
+        else:
+            corrupt = columns["moral_state"][i] == CORRUPTED
+            if columns["jail_sentence"][i] > 0:
+                color = JAIL_COLOR
+            elif columns["condition"][i] != QUIESCENT:
+                color = AGENT_REBEL_COLOR
+            elif columns["is_employed"][i] == 1:
+                color = (AGENT_QUIET_EMPLOYED_CORRUPT_COLOR if corrupt else
+                         AGENT_QUIET_EMPLOYED_NOT_CORRUPT_COLOR)
+            else:
+                color = (AGENT_QUIET_UNEMPLOYED_CORRUPT_COLOR if corrupt else
+                         AGENT_QUIET_UNEMPLOYED_NOT_CORRUPT_COLOR)
+            portrayal.update(Color=color, r=0.8, Layer=0)
+        grid_state[portrayal["Layer"]].append(portrayal)
+    return grid_state
+
+
+class SnapshotCanvasGrid(CanvasGrid):
+    """
+    CanvasGrid that draws the latest snapshot published by a model running
+    in another process (see EpsteinCivilViolence.publish_snapshots)
+    instead of the server's own model.
+    Args:
+        reader: snapshot.SnapshotReader attached to the running model
+    """
+
+    def __init__(self, reader, canvas_width=500, canvas_height=500):
+        super().__init__(None, reader.width, reader.height, canvas_width,
+                         canvas_height)
+        self.reader = reader
+
+    def render(self, model):
+        return snapshot_portrayals(self.reader.latest(copy=True))
+
+
+def cell_codes(columns, width, height):
+    """
+    Color code (an index into CELL_STYLES) of every cell, as a flat uint8
+    array indexed by x * height + y, from agent columns with the fields of
+    snapshot.FIELDS. Cops are drawn over citizens sharing their cell, as
+    in citizen_cop_portrayal's layers.
+    """
+    codes = np.zeros(width * height, dtype=np.uint8)
+    cells = columns["x"] * height + columns["y"]
+    cop = columns["breed"] == COP
+    corrupt = columns["moral_state"] == CORRUPTED
+    citizen_codes = np.where(columns["is_employed"] == 1, 1, 3) + corrupt
+    citizen_codes[columns["condition"] != QUIESCENT] = REBEL_CODE
+    citizen_codes[columns["jail_sentence"] > 0] = JAIL_CODE
+    codes[cells[~cop]] = citizen_codes[~cop]
+    codes[cells[cop]] = COP_CODE
+    return codes
+
+
+class DeltaBase:
+    """
+    What one browser connection was last sent by a DeltaCanvasGrid.
+
+    Attributes:
+        model: model the frames were rendered from
+        previous: cell codes of the last frame, None before the first
+        frames: frames sent since the last keyframe, that one included
+    """
+
+    def __init__(self):
+        self.model = None
+        self.previous = None
+        self.frames = 0
+
+
+class DeltaCanvasGrid(VisualizationElement):
+    """
+    Grid view for large grids. Instead of a portrayal dict per agent, a
+    frame is the color code of every cell (see CELL_STYLES), computed from
+    the model's agent columns in a few array operations. Only the first
+    frame after a reset, a change of grid size or every `keyframe_every`
+    frames holds all cells, as base64 bytes; the others hold the cells
+    whose code changed since the previous frame, as base64 little-endian
+    uint32 values cell * 8 + code. The browser redraws those cells only.
+
+    The grid size is read from the model, so the element fits whatever
+    width and height the model is created with.
+
+    Deltas are computed against the frames sent to one browser
+    connection, kept in a DeltaBase per connection by FrameSocketHandler;
+    every connection starts with a keyframe, so any number of tabs can
+    watch the same model. Rendered without a DeltaBase (by a plain
+    ModularServer), every frame is a keyframe.
+    Args:
+        reader: snapshot.SnapshotReader to draw a model running in another
+            process instead of the server's own model
+        canvas_width, canvas_height: size of the canvas in pixels
+        keyframe_every: number of frames between two full frames
+    """
+
+    def __init__(self, reader=None, canvas_width=600, canvas_height=600,
+                 keyframe_every=100):
+        super().__init__()
+        self.reader = reader
+        self.canvas_width = canvas_width
+        self.canvas_height = canvas_height
+        self.keyframe_every = keyframe_every
+        module = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              "templates", "DeltaCanvasModule.js")
+        with open(module) as f:
+            source = f.read()
+        colors = json.dumps([color for color, _ in CELL_STYLES])
+        radii = json.dumps([radius for _, radius in CELL_STYLES])
+        self.js_code = (source + "elements.push(new DeltaCanvasModule("
+                        "%d, %d, %s, %s));" % (canvas_width, canvas_height,
+                                               colors, radii))
+
+    def codes(self, model):
+        """
+        (width, height, step, cell codes) of the state to draw, with the
+        dimensions of the grid the agents' positions range over.
+        """
+        if self.reader is not None:
+            snapshot = self.reader.latest(copy=True)
+            return (self.reader.width, self.reader.height, snapshot.step,
+                    cell_codes(snapshot.columns, self.reader.width,
+                               self.reader.height))
+        # x and y range over the grid's dimensions, which are the model's
+        # width and height swapped
+        width, height = model.grid.width, model.grid.height
+        _, columns = model.agent_columns(FIELDS)
+        return (width, height, model.schedule.steps,
+                cell_codes(columns, width, height))
+
+    def render(self, model, base=None):
+        """
+        The next frame of `model` for the connection whose frames so far
+        are recorded in `base` (a DeltaBase, updated here); a keyframe if
+        there is no base.
+        """
+        width, height, step, codes = self.codes(model)
+        if base is None:
+            base = DeltaBase()
+        previous = base.previous
+        keyframe = (model is not base.model or previous is None or
+                    previous.shape != codes.shape or
+                    base.frames % self.keyframe_every == 0)
+        base.model = model
+        base.previous = codes
+        base.frames = 1 if keyframe else base.frames + 1
+        if keyframe:
+            payload = codes.tobytes()
+        else:
+            cells = np.flatnonzero(codes != previous).astype("<u4")
+            payload = (cells * 8 + codes[cells]).astype("<u4").tobytes()
+        return {"keyframe": keyframe, "width": width, "height": height,
+                "step": step, "cells": base64.b64encode(payload).decode()}
+
+
+class FrameSocketHandler(SocketHandler):
+    """
+    SocketHandler that advances the model by the server's
+    `ticks_per_frame` steps, instead of one, for every frame the browser
+    asks for, and renders DeltaCanvasGrid elements against the frames
+    sent over this connection.
+    """
+
+    def open(self):
+        # element index -> DeltaBase of this connection
+        self.delta_bases = {}
+        super().open()
+
+    @property
+    def viz_state_message(self):
+        model = self.application.model
+        state = []
+        for i, element in enumerate(self.application.visualization_elements):
+            if isinstance(element, DeltaCanvasGrid):
+                base = self.delta_bases.setdefault(i, DeltaBase())
+                state.append(element.render(model, base))
+            else:
+                state.append(element.render(model))
+        return {"type": "viz_state", "data": state}
+
+    def on_message(self, message):
+        msg = tornado.escape.json_decode(message)
+        if msg["type"] != "get_step" or not self.application.model.running:
+            return super().on_message(message)
+        model = self.application.model
+        for _ in range(self.application.ticks_per_frame):
+            if not model.running:
+                break
+            model.step()
+        self.write_message(self.viz_state_message)
+
+
+class FrameServer(ModularServer):
+    """
+    ModularServer that runs several model steps per rendered frame, so the
+    Python loop spends its time simulating rather than rendering, and the
+    browser draws no more frames than it can.
+    Args:
+        ticks_per_frame: model steps between two frames
+        (the other arguments are those of ModularServer)
+    """
+
+    handlers = [ModularServer.page_handler, (r"/ws", FrameSocketHandler),
+                ModularServer.static_handler, ModularServer.local_handler]
+    verbose = False
+
+    def __init__(self, model_cls, visualization_elements, name="Mesa Model",
+                 model_params={}, ticks_per_frame=1):
+        self.ticks_per_frame = ticks_per_frame
+        super().__init__(model_cls, visualization_elements, name,
+                         model_params)
+
+
 model_params = dict(
     height=40,
     width=40,
@@ -98,8 +346,20 @@ model_params = dict(
     ),
 )
 
+
+def make_server(width=40, height=40, ticks_per_frame=1, canvas_size=480,
+                **parameters):
+    """
+    Visualization server of a width x height model drawn with a
+    DeltaCanvasGrid, `ticks_per_frame` steps per frame; further keyword
+    arguments override model_params.
+    """
+    params = dict(model_params, width=width, height=height, **parameters)
+    return FrameServer(
+        EpsteinCivilViolence, [DeltaCanvasGrid(None, canvas_size,
+                                               canvas_size)],
+        "Epstein Civil Violence", params, ticks_per_frame)
+
+
 canvas_element = CanvasGrid(citizen_cop_portrayal, 40, 40, 480, 480)
-server = ModularServer(
-    EpsteinCivilViolence, [canvas_element],
-    "Epstein Civil Violence", model_params
-)
+server = make_server()
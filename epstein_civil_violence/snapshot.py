@@ -0,0 +1,302 @@
+import json
+import mmap
+import os
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+import pandas as pd
+
+from .datacollection import AgentField
+from .states import BREEDS, CONDITIONS, MORAL_STATES
+
+MAGIC = 0x45435653  # "ECVS"
+FORMAT_VERSION = 1
+# header: MAGIC, FORMAT_VERSION, descriptor length, current slot, then per
+# slot its sequence number, step and number of agents
+HEADER_WORDS = 16
+CURRENT = 3
+SEQUENCE, STEP, COUNT = 4, 6, 8
+DESCRIPTOR_BYTES = 4096
+ALIGNMENT = 64
+
+# names of the shared memory blocks created by writers in this process
+_created = set()
+
+# the agent variables a snapshot holds by default
+FIELDS = {
+    "x": AgentField(lambda a: a.pos[0], "int"),
+    "y": AgentField(lambda a: a.pos[1], "int"),
+    "breed": AgentField(lambda a: a.breed, "category", BREEDS),
+    "condition": AgentField(lambda a: getattr(a, "condition", None),
+                            "category", CONDITIONS),
+    "moral_state": AgentField(lambda a: getattr(a, "moral_state", None),
+                              "category", MORAL_STATES),
+    "is_employed": AgentField(lambda a: getattr(a, "is_employed", None),
+                              "optional int"),
+    "jail_sentence": AgentField(lambda a: getattr(a, "jail_sentence", None),
+                                "optional int"),
+    "arrest_probability": AgentField(
+        lambda a: getattr(a, "arrest_probability", None), "float"),
+}
+
+
+def _layout(descriptor):
+    """
+    name -> (offset, dtype, length) of every array of both slots, and the
+    total size of the buffer.
+    """
+    capacity = descriptor["capacity"]
+    ncells = descriptor["width"] * descriptor["height"]
+    arrays = [("occupancy", np.int64, ncells), ("ids", np.int64, capacity)]
+    arrays += [(f["name"], np.dtype(f["dtype"]), capacity)
+               for f in descriptor["fields"]]
+    layout = {}
+    offset = HEADER_WORDS * 8 + DESCRIPTOR_BYTES
+    for slot in (0, 1):
+        for name, dtype, length in arrays:
+            offset = -(-offset // ALIGNMENT) * ALIGNMENT
+            layout[slot, name] = (offset, np.dtype(dtype), length)
+            offset += length * np.dtype(dtype).itemsize
+    return layout, offset
+
+
+def _open(name, path, size=None):
+    """
+    (buffer, handle) of a shared memory block or memory-mapped file,
+    created with `size` bytes if a size is given.
+    """
+    if path is not None:
+        if size is not None:
+            with open(path, "wb") as f:
+                f.truncate(size)
+        with open(path, "r+b") as f:
+            buffer = mmap.mmap(f.fileno(), 0)
+        return buffer, buffer
+    if size is not None:
+        block = shared_memory.SharedMemory(name, create=True, size=size)
+        _created.add(block.name)
+    else:
+        block = shared_memory.SharedMemory(name)
+        if block.name not in _created:
+            # the block belongs to the writer's process: keep this
+            # process's resource tracker from unlinking it at exit
+            resource_tracker.unregister(block._name, "shared_memory")
+    return block.buf, block
+
+
+class Snapshot:
+    """
+    The state of a model at one step, as published by a SnapshotWriter.
+    The arrays are views into the shared buffer unless the snapshot was
+    copied; a view stays valid until SnapshotReader.changed() says it was
+    overwritten.
+
+    Attributes:
+        step: model step the snapshot was taken at
+        ids: unique_id of every agent
+        columns: field name -> typed column over the same agents, coded as
+            in the data collector (see datacollection.AgentField)
+        occupancy: (width, height) array of the unique_id of the agent at
+            every agent's (x, y) position, -1 where there is none
+        fields: field name -> AgentField describing the columns
+        slot, sequence: where and when the snapshot was published
+    """
+
+    def __init__(self, step, ids, columns, occupancy, fields, slot,
+                 sequence):
+        self.step = step
+        self.ids = ids
+        self.columns = columns
+        self.occupancy = occupancy
+        self.fields = fields
+        self.slot = slot
+        self.sequence = sequence
+
+    def frame(self):
+        """
+        DataFrame of the agents, indexed by AgentID, with the values as they
+        appear in the agent-vars DataFrame.
+        """
+        return pd.DataFrame(
+            {name: self.fields[name].decode(column)
+             for name, column in self.columns.items()},
+            index=pd.Index(self.ids, name="AgentID"))
+
+
+class _SnapshotBuffer:
+    def _map(self, buffer, descriptor):
+        self.descriptor = descriptor
+        self.width = descriptor["width"]
+        self.height = descriptor["height"]
+        self.capacity = descriptor["capacity"]
+        self.fields = {f["name"]: AgentField(None, f["kind"],
+                                             f["categories"])
+                       for f in descriptor["fields"]}
+        layout, _ = _layout(descriptor)
+        self._header = np.ndarray(HEADER_WORDS, dtype=np.int64,
+                                  buffer=buffer)
+        self._arrays = {key: np.ndarray(length, dtype=dtype, buffer=buffer,
+                                        offset=offset)
+                        for key, (offset, dtype, length) in layout.items()}
+
+    def _release(self):
+        # views into the buffer must go before it can be closed
+        self._header = None
+        self._arrays = {}
+        self._handle.close()
+
+
+class SnapshotWriter(_SnapshotBuffer):
+    """
+    Publishes the grid occupancy and agent columns of a running model into
+    a shared memory block (or a memory-mapped file), from which other
+    processes read them with SnapshotReader without copying and without
+    the simulation waiting for them.
+
+    The buffer holds two slots. publish() writes the new state into the
+    slot readers are not directed to, then points readers at it, so a
+    reader always finds one complete snapshot. Each slot has a sequence
+    number that is odd while the slot is written, which lets a reader tell
+    whether a snapshot it holds was overwritten (a seqlock).
+
+    Attributes:
+        name: name of the shared memory block, None for a file
+        path: path of the memory-mapped file, None for shared memory
+        fields: field name -> AgentField of the published columns
+        width, height, capacity: grid dimensions (those of model.grid,
+            which x and y range over) and maximum number of agents
+    """
+
+    def __init__(self, model, name=None, path=None, fields=None):
+        fields = dict(FIELDS if fields is None else fields)
+        # agent positions range over the grid's dimensions, which are the
+        # model's width and height swapped
+        width, height = model.grid.width, model.grid.height
+        descriptor = {
+            "width": width,
+            "height": height,
+            "capacity": width * height,
+            "fields": [{"name": name_, "kind": f.kind,
+                        "categories": list(f.categories),
+                        "dtype": np.dtype(f.dtype).str}
+                       for name_, f in fields.items()],
+        }
+        document = json.dumps(descriptor).encode()
+        if len(document) > DESCRIPTOR_BYTES:
+            raise ValueError("too many fields for a snapshot")
+        _, size = _layout(descriptor)
+        buffer, self._handle = _open(name, path, size)
+        self.path = path
+        self.name = None if path is not None else self._handle.name
+        self._map(buffer, descriptor)
+        self.fields = fields
+        self._header[:] = 0
+        self._header[:3] = MAGIC, FORMAT_VERSION, len(document)
+        start = HEADER_WORDS * 8
+        np.ndarray(len(document), dtype=np.uint8, buffer=buffer,
+                   offset=start)[:] = np.frombuffer(document, np.uint8)
+        self._header[STEP:STEP + 2] = -1
+        try:
+            self.publish(model)
+        except BaseException:
+            self.close()
+            raise
+
+    def publish(self, model):
+        """
+        Write the current state of the model to the idle slot and make it
+        the one readers see.
+        """
+        header = self._header
+        slot = 1 - int(header[CURRENT])
+        ids, columns = model.agent_columns(self.fields)
+        n = len(ids)
+        if n > self.capacity:
+            raise ValueError("more agents than the snapshot can hold")
+        header[SEQUENCE + slot] += 1
+        self._arrays[slot, "ids"][:n] = ids
+        for name, column in columns.items():
+            self._arrays[slot, name][:n] = column
+        occupancy = self._arrays[slot, "occupancy"]
+        occupancy[:] = -1
+        if "x" in columns and "y" in columns:
+            occupancy[columns["x"] * self.height + columns["y"]] = ids
+        header[STEP + slot] = model.schedule.steps
+        header[COUNT + slot] = n
+        header[SEQUENCE + slot] += 1
+        header[CURRENT] = slot
+
+    def close(self):
+        """
+        Release the buffer and delete the shared memory block or file;
+        readers still attached keep their mapping until they close.
+        """
+        self._release()
+        if self.path is not None:
+            os.remove(self.path)
+        else:
+            self._handle.unlink()
+            _created.discard(self.name)
+
+
+class SnapshotReader(_SnapshotBuffer):
+    """
+    Read access, from any process, to the snapshots a SnapshotWriter
+    publishes.
+    Args:
+        name: name of the writer's shared memory block
+        path: path of the writer's memory-mapped file, instead of a name
+    """
+
+    def __init__(self, name=None, path=None):
+        if (name is None) == (path is None):
+            raise ValueError("give either the name or the path of a "
+                             "snapshot buffer")
+        buffer, self._handle = _open(name, path)
+        header = np.ndarray(HEADER_WORDS, dtype=np.int64, buffer=buffer)
+        if header[0] != MAGIC or header[1] != FORMAT_VERSION:
+            raise ValueError("not a snapshot buffer of a known version")
+        document = bytes(buffer[HEADER_WORDS * 8:
+                                HEADER_WORDS * 8 + int(header[2])])
+        del header
+        self._map(buffer, json.loads(document.decode()))
+
+    def latest(self, copy=False):
+        """
+        The most recently published Snapshot. Without copy its arrays are
+        views into the shared buffer, to be checked with changed() after
+        use; with copy they are a consistent private copy.
+        """
+        header = self._header
+        while True:
+            slot = int(header[CURRENT])
+            sequence = int(header[SEQUENCE + slot])
+            if sequence % 2:
+                continue
+            n = int(header[COUNT + slot])
+            step = int(header[STEP + slot])
+            ids = self._arrays[slot, "ids"][:n]
+            columns = {name: self._arrays[slot, name][:n]
+                       for name in self.fields}
+            occupancy = self._arrays[slot, "occupancy"].reshape(
+                self.width, self.height)
+            if copy:
+                ids, occupancy = ids.copy(), occupancy.copy()
+                columns = {name: c.copy() for name, c in columns.items()}
+            if int(header[SEQUENCE + slot]) == sequence:
+                return Snapshot(step, ids, columns, occupancy, self.fields,
+                                slot, sequence)
+
+    def changed(self, snapshot):
+        """
+        Whether the slot a view snapshot points into was written since the
+        snapshot was taken, i.e. whether its arrays may be inconsistent.
+        """
+        return (int(self._header[SEQUENCE + snapshot.slot]) !=
+                snapshot.sequence)
+
+    def close(self):
+        """
+        Detach from the buffer. Drop every view snapshot first.
+        """
+        self._release()
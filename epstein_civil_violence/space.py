@@ -0,0 +1,410 @@
+import numpy as np
+from mesa.space import Grid
+
+from .states import ACTIVE, COP, CORRUPTED
+
+
+def neighborhood_offsets(radius, moore):
+    """
+    (dx, dy) offsets of a neighborhood, without the center.
+    """
+    return [(dx, dy)
+            for dy in range(-radius, radius + 1)
+            for dx in range(-radius, radius + 1)
+            if (dx, dy) != (0, 0) and (moore or abs(dx) + abs(dy) <= radius)]
+
+
+def window_sum(layer, radius):
+    """
+    Sum of a (width, height) layer over the (2 * radius + 1)-wide square
+    window around every cell of a torus, computed with running sums along
+    each axis, so the cost does not depend on the radius. Windows wider
+    than the grid cover each cell once.
+    """
+    for axis in (0, 1):
+        size = layer.shape[axis]
+        length = min(2 * radius + 1, size)
+        padded = np.take(layer, np.arange(-radius, size + radius) % size,
+                         axis=axis)
+        sums = np.cumsum(padded, axis=axis)
+        sums = np.insert(sums, 0, 0, axis=axis)
+        upper = np.take(sums, np.arange(size) + length, axis=axis)
+        lower = np.take(sums, np.arange(size), axis=axis)
+        layer = upper - lower
+    return layer
+
+
+class NeighborhoodIndex:
+    """
+    Precomputed neighborhoods of every cell of a toroidal grid, stored as
+    flat integer cell ids. Cell (x, y) has id x * height + y, the order of
+    Grid.coord_iter, and each cell's neighbors are sorted the way
+    Grid.get_neighborhood returns them.
+
+    For every (radius, moore) mode the index holds a CSR table: the
+    neighbors of cell c are indices[indptr[c]:indptr[c + 1]]. When the grid
+    is wider and higher than the neighborhood, every cell has the same
+    number of neighbors and dense(radius, moore) also gives the table as a
+    (cells, neighbors) array. Modes that are not built into a table (large
+    vision radii would take too much memory) are computed on the fly from
+    their offsets, see around().
+
+    Attributes:
+        width, height: grid dimensions
+        ncells: width * height
+    """
+
+    def __init__(self, width, height, modes=((1, False),)):
+        """
+        Create a new index.
+        Args:
+            width, height: grid dimensions
+            modes: (radius, moore) neighborhoods to build right away; other
+                modes are built on first use
+        """
+        self.width = width
+        self.height = height
+        self.ncells = width * height
+        self._tables = {}
+        self._coords = {}
+        self._offsets = {}
+        self._positions = [(x, y) for x in range(width)
+                           for y in range(height)]
+        for radius, moore in modes:
+            self.table(radius, moore)
+
+    def cell(self, pos):
+        """
+        Cell id of an (x, y) position.
+        """
+        return pos[0] * self.height + pos[1]
+
+    def position(self, cell):
+        """
+        (x, y) position of a cell id.
+        """
+        return self._positions[cell]
+
+    def table(self, radius=1, moore=False):
+        """
+        (indptr, indices) CSR arrays of the (radius, moore) neighborhood.
+        """
+        key = (radius, moore)
+        if key not in self._tables:
+            self._tables[key] = self._build(radius, moore)
+        return self._tables[key]
+
+    def _build(self, radius, moore):
+        x, y = np.divmod(np.arange(self.ncells), self.height)
+        offsets = neighborhood_offsets(radius, moore)
+        cells = np.stack([((x + dx) % self.width) * self.height +
+                          (y + dy) % self.height for dx, dy in offsets],
+                         axis=1)
+        cells.sort(axis=1)
+        if self.width > 2 * radius and self.height > 2 * radius:
+            indptr = np.arange(0, cells.size + 1, cells.shape[1])
+            return indptr, cells.ravel()
+        # on small tori some offsets wrap onto the same cell
+        rows = [np.unique(row) for row in cells]
+        indptr = np.zeros(self.ncells + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(row) for row in rows])
+        return indptr, np.concatenate(rows)
+
+    def offsets(self, radius=1, moore=False):
+        """
+        (dx, dy) offsets of the (radius, moore) neighborhood, reduced modulo
+        the grid dimensions so that offsets wrapping onto the same cell
+        appear once and offsets wrapping back onto the center are dropped.
+        """
+        key = (radius, moore)
+        if key not in self._offsets:
+            wrapped = {(dx % self.width, dy % self.height)
+                       for dx, dy in neighborhood_offsets(radius, moore)}
+            wrapped.discard((0, 0))
+            self._offsets[key] = np.array(sorted(wrapped)).reshape(-1, 2)
+        return self._offsets[key]
+
+    def around(self, cells, radius=1, moore=False):
+        """
+        (len(cells), neighbors) array of the neighboring cell ids of an
+        array of cells, computed without building a table.
+        """
+        x, y = np.divmod(np.asarray(cells), self.height)
+        dx, dy = self.offsets(radius, moore).T
+        return (((x[:, None] + dx) % self.width) * self.height +
+                (y[:, None] + dy) % self.height)
+
+    def dense(self, radius=1, moore=False):
+        """
+        The (radius, moore) neighborhood table as a (cells, neighbors)
+        array. Only available when all cells have the same number of
+        neighbors.
+        """
+        indptr, indices = self.table(radius, moore)
+        size = indptr[1] - indptr[0]
+        if len(indices) != size * self.ncells:
+            raise ValueError("neighborhoods wrap onto themselves on this "
+                             "grid; use table() instead")
+        return indices.reshape(self.ncells, size)
+
+    def cells(self, pos, radius=1, moore=False):
+        """
+        Array of the neighboring cell ids of an (x, y) position, in table
+        order if the mode has a table.
+        """
+        cell = self.cell(pos)
+        if (radius, moore) not in self._tables:
+            return self.around([cell], radius, moore)[0]
+        indptr, indices = self._tables[radius, moore]
+        return indices[indptr[cell]:indptr[cell + 1]]
+
+    def coords(self, pos, radius=1, moore=False):
+        """
+        List of the neighboring (x, y) positions of an (x, y) position, the
+        same list Grid.get_neighborhood(pos, moore, radius=radius) returns
+        (except that modes without a table never include the position
+        itself).
+        For modes with a table the lists are built once per cell and shared,
+        so callers must not modify them.
+        """
+        key = (radius, moore)
+        if key not in self._tables:
+            positions = self._positions
+            return [positions[c] for c in self.cells(pos, radius, moore)]
+        coords = self._coords.get(key)
+        if coords is None:
+            coords = self._coords[key] = [None] * self.ncells
+        cell = self.cell(pos)
+        neighborhood = coords[cell]
+        if neighborhood is None:
+            positions = self._positions
+            neighborhood = coords[cell] = [
+                positions[c] for c in self.cells(pos, radius, moore)]
+        return neighborhood
+
+
+class VisionLayers:
+    """
+    Counts of agents by breed, condition and moral state within each
+    citizen's vision window, for models that honor citizen_vision.
+
+    Once per tick, update() rasterizes the agents into one occupancy layer
+    per category and turns each layer into windowed counts with window_sum,
+    so that looking up "cops in vision" etc. costs O(1) per agent whatever
+    the radius. Citizens therefore perceive their window as it was at the
+    start of the tick. The window is the square of cells within
+    `radius` steps along both axes (a Moore neighborhood of that radius).
+
+    Attributes:
+        index: NeighborhoodIndex of the grid
+        radius: vision radius
+        layers: category -> flat occupancy counts per cell
+        windows: category -> flat windowed counts per cell
+    """
+
+    CATEGORIES = ("cops", "actives", "corrupted", "non_corrupted")
+
+    def __init__(self, index, radius):
+        self.index = index
+        self.radius = radius
+        self.layers = {}
+        self.windows = {}
+
+    def update(self, cells, categories):
+        """
+        Rebuild the layers.
+        Args:
+            cells: array of the cell of every agent
+            categories: category -> boolean array over the same agents
+        """
+        shape = (self.index.width, self.index.height)
+        for name in self.CATEGORIES:
+            layer = np.bincount(cells[categories[name]],
+                                minlength=self.index.ncells)
+            self.layers[name] = layer
+            self.windows[name] = window_sum(layer.reshape(shape),
+                                            self.radius).ravel()
+
+    def count(self, name, cells):
+        """
+        Number of agents of a category in the vision window of the given
+        cell(s), not counting the cell itself.
+        """
+        return self.windows[name][cells] - self.layers[name][cells]
+
+
+class LiveVisionLayers(VisionLayers):
+    """
+    VisionLayers kept up to date as the agents change instead of rebuilt
+    every tick, so a lookup always gives the counts of the moment, as a
+    rescan of the window would. update() builds the layers once; after
+    that every move, arrest, release, change of condition and moral
+    transition is applied to the windowed counts of the cells whose
+    window it affects.
+
+    A change of category at one cell adds to the (2 * radius + 1)^2 cells
+    of its window; a move to a neighboring cell only touches the lines
+    that enter and leave the window, 2 * (2 * radius + 1) cells, mostly
+    as slices of the flat layers.
+    """
+
+    def __init__(self, index, radius):
+        super().__init__(index, radius)
+        shape = np.array([index.width, index.height])
+        # windows narrower than the grid leave and enter it by one line
+        self._lines = 2 * radius + 1 < min(index.width, index.height)
+        window = {(0, 0)} | set(map(tuple, index.offsets(radius, True)))
+        self._window = np.array(sorted(window)).T
+        # for a step d, the window offsets (relative to the old cell) that
+        # enter and leave the window
+        self._strips = {}
+        for step in ((1, 0), (-1, 0), (0, 1), (0, -1)):
+            step = tuple(np.mod(step, shape))
+            moved = {tuple(np.mod(np.add(w, step), shape)) for w in window}
+            self._strips[step] = tuple(
+                np.array(sorted(offsets), dtype=np.int64).reshape(-1, 2).T
+                for offsets in (moved - window, window - moved))
+
+    @staticmethod
+    def categories(agent):
+        """
+        Names of the categories an agent is counted in.
+        """
+        if agent.kind == COP:
+            return ("cops",)
+        if agent.moral_code == CORRUPTED:
+            names = ("corrupted",)
+        else:
+            names = ("non_corrupted",)
+        if agent.condition_code == ACTIVE and agent.jail_sentence == 0:
+            names += ("actives",)
+        return names
+
+    def _cells(self, cell, offsets):
+        height = self.index.height
+        x, y = divmod(cell, height)
+        return ((x + offsets[0]) % self.index.width * height +
+                (y + offsets[1]) % height)
+
+    def _line(self, x, y, along_y):
+        """
+        Cells of the line of 2 * radius + 1 cells centered on (x, y), along
+        the y or the x axis; a slice of the flat layers where it does not
+        wrap around the torus.
+        """
+        r, width, height = self.radius, self.index.width, self.index.height
+        x, y = x % width, y % height
+        if along_y:
+            if r <= y < height - r:
+                return slice(x * height + y - r, x * height + y + r + 1)
+            return x * height + np.arange(y - r, y + r + 1) % height
+        if r <= x < width - r:
+            return slice((x - r) * height + y, (x + r) * height + y + 1,
+                         height)
+        return np.arange(x - r, x + r + 1) % width * height + y
+
+    def add(self, name, cell, delta):
+        """
+        Count `delta` more agents of a category at a cell.
+        """
+        self.layers[name][cell] += delta
+        self.windows[name][self._cells(cell, self._window)] += delta
+
+    def changed(self, agent, before):
+        """
+        Apply a change of an agent's state, given its categories() before.
+        """
+        after = self.categories(agent)
+        if after == before:
+            return
+        cell = self.index.cell(agent.pos)
+        for name in before:
+            if name not in after:
+                self.add(name, cell, -1)
+        for name in after:
+            if name not in before:
+                self.add(name, cell, 1)
+
+    def move(self, agent, old, new):
+        """
+        Apply the move of an agent from position `old` to `new`.
+        """
+        old, new = self.index.cell(old), self.index.cell(new)
+        if old == new:
+            return
+        x0, y0 = divmod(old, self.index.height)
+        x1, y1 = divmod(new, self.index.height)
+        strips = self._strips.get(((x1 - x0) % self.index.width,
+                                   (y1 - y0) % self.index.height))
+        if strips is None:
+            for name in self.categories(agent):
+                self.add(name, old, -1)
+                self.add(name, new, 1)
+            return
+        if self._lines:
+            r = self.radius
+            dx = (x1 - x0 + 1) % self.index.width - 1
+            dy = (y1 - y0 + 1) % self.index.height - 1
+            if dx:
+                entering = self._line(x0 + dx * (r + 1), y0, True)
+                leaving = self._line(x0 - dx * r, y0, True)
+            else:
+                entering = self._line(x0, y0 + dy * (r + 1), False)
+                leaving = self._line(x0, y0 - dy * r, False)
+        else:
+            entering = self._cells(old, strips[0])
+            leaving = self._cells(old, strips[1])
+        for name in self.categories(agent):
+            windows = self.windows[name]
+            windows[entering] += 1
+            windows[leaving] -= 1
+            self.layers[name][old] -= 1
+            self.layers[name][new] += 1
+
+
+class OccupancyGrid(Grid):
+    """
+    mesa Grid that also keeps an occupancy bitmap, one byte per cell in
+    NeighborhoodIndex order (cell id x * height + y), updated by every
+    placement, removal and move. Emptiness tests become byte lookups, and
+    whole arrays of cells can be tested at once through occupancy().
+
+    The bitmap mirrors the grid's contents, so code writing grid.grid
+    directly must call rebuild_occupancy() afterwards.
+
+    Attributes:
+        occupied: bytearray, 1 where the cell holds an agent
+    """
+
+    def __init__(self, width, height, torus):
+        super().__init__(width, height, torus)
+        self.occupied = bytearray(width * height)
+
+    def rebuild_occupancy(self):
+        """
+        Recompute the bitmap from the grid's contents.
+        """
+        self.occupied[:] = bytes(cell is not None for column in self.grid
+                                 for cell in column)
+
+    def occupancy(self):
+        """
+        Boolean NumPy view of the bitmap, indexed by cell id.
+        """
+        return np.frombuffer(self.occupied, dtype=np.bool_)
+
+    def _place_agent(self, pos, agent):
+        super()._place_agent(pos, agent)
+        self.occupied[pos[0] * self.height + pos[1]] = 1
+
+    def _remove_agent(self, pos, agent):
+        super()._remove_agent(pos, agent)
+        self.occupied[pos[0] * self.height + pos[1]] = 0
+
+    def empty_coords(self, neighborhood):
+        """
+        The empty positions of a list of (x, y) positions, in order; the
+        same as filtering it with is_cell_empty.
+        """
+        occupied, height = self.occupied, self.height
+        return [c for c in neighborhood if not occupied[c[0] * height + c[1]]]
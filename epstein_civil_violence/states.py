@@ -0,0 +1,53 @@
+from enum import IntEnum
+
+
+class Breed(IntEnum):
+    """
+    Kind of agent.
+    """
+    CITIZEN = 0
+    COP = 1
+
+
+class Condition(IntEnum):
+    """
+    Condition of a citizen. JAILED is the condition an arrest puts a
+    citizen in; it was spelled "Queit" before.
+    """
+    QUIESCENT = 0
+    ACTIVE = 1
+    JAILED = 2
+
+
+class MoralState(IntEnum):
+    """
+    Moral state of a citizen.
+    """
+    CORRUPTED = 0
+    HONEST = 1
+    SUSCEPTIBLE = 2
+
+
+# the public string view of every state, indexed by its code
+BREEDS = ("citizen", "cop")
+CONDITIONS = ("Quiescent", "Active", "Jailed")
+MORAL_STATES = ("Corrupted", "Honest", "Susceptible")
+
+# plain ints for the hot loops, where comparing ints beats comparing
+# IntEnum members
+CITIZEN, COP = int(Breed.CITIZEN), int(Breed.COP)
+QUIESCENT, ACTIVE, JAILED = (int(Condition.QUIESCENT), int(Condition.ACTIVE),
+                             int(Condition.JAILED))
+CORRUPTED, HONEST, SUSCEPTIBLE = (int(MoralState.CORRUPTED),
+                                  int(MoralState.HONEST),
+                                  int(MoralState.SUSCEPTIBLE))
+
+
+def _codes(labels):
+    codes = {label: code for code, label in enumerate(labels)}
+    codes.update({code: code for code in range(len(labels))})
+    return codes
+
+
+CONDITION_CODES = _codes(CONDITIONS)
+MORAL_STATE_CODES = _codes(MORAL_STATES)
@@ -0,0 +1,67 @@
+// Client side of server.DeltaCanvasGrid: keeps the color code of every
+// cell and redraws only the cells a frame changes.
+var DeltaCanvasModule = function(canvas_width, canvas_height, colors, radii) {
+	var canvas = $(`<canvas width="${canvas_width}" height="${canvas_height}" class="world-grid"/>`)[0];
+	var parent = $(`<div style="height:${canvas_height}px;" class="world-grid-parent"></div>`)[0];
+	$("#elements").append(parent);
+	parent.append(canvas);
+	var context = canvas.getContext("2d");
+
+	var width = 0, height = 0, cellWidth = 0, cellHeight = 0;
+	var codes = null;
+
+	var decode = function(text) {
+		var raw = atob(text);
+		var bytes = new Uint8Array(raw.length);
+		for (var i = 0; i < raw.length; i++)
+			bytes[i] = raw.charCodeAt(i);
+		return bytes;
+	};
+
+	var drawCell = function(cell, code) {
+		var x = Math.floor(cell / height);
+		var y = height - cell % height - 1;
+		context.clearRect(x * cellWidth, y * cellHeight, cellWidth, cellHeight);
+		if (code === 0)
+			return;
+		context.fillStyle = colors[code];
+		var r = radii[code] * Math.min(cellWidth, cellHeight) / 2;
+		if (r < 2) {
+			context.fillRect(x * cellWidth, y * cellHeight, cellWidth, cellHeight);
+			return;
+		}
+		context.beginPath();
+		context.arc((x + 0.5) * cellWidth, (y + 0.5) * cellHeight, r, 0, Math.PI * 2);
+		context.fill();
+	};
+
+	this.render = function(data) {
+		if (data.keyframe) {
+			width = data.width;
+			height = data.height;
+			cellWidth = canvas_width / width;
+			cellHeight = canvas_height / height;
+			codes = decode(data.cells);
+			context.clearRect(0, 0, canvas_width, canvas_height);
+			for (var cell = 0; cell < codes.length; cell++)
+				if (codes[cell] !== 0)
+					drawCell(cell, codes[cell]);
+			return;
+		}
+		if (codes === null)
+			return;
+		// packed little-endian uint32: cell index * 8 + color code
+		var bytes = decode(data.cells);
+		var packed = new DataView(bytes.buffer);
+		for (var i = 0; i < bytes.length; i += 4) {
+			var value = packed.getUint32(i, true);
+			codes[value >>> 3] = value & 7;
+			drawCell(value >>> 3, value & 7);
+		}
+	};
+
+	this.reset = function() {
+		codes = null;
+		context.clearRect(0, 0, canvas_width, canvas_height);
+	};
+};
@@ -0,0 +1,703 @@
+import mmap
+import multiprocessing
+import os
+import traceback
+import weakref
+from types import SimpleNamespace
+
+import numpy as np
+
+from .engine import (ARREST_CHOICE, ARREST_PRIORITY, CHURN_PRIORITY,
+                     CHURN_RATE, CHURN_ROLL, CONTAGION_PRIORITY,
+                     CONTAGION_ROLL, CONTAGION_SCALE, CONTAGION_TARGET,
+                     JOB_SWAP_ROLL, JOB_SWAP_VICTIM, LEGITIMACY_WEIGHT,
+                     MOVE_CHOICE, MOVE_PRIORITY, NOT_APPLICABLE, SENTENCE,
+                     W_CORRUPTION, W_UNEMPLOYMENT, ArrayEngine, CellStream,
+                     pick_among, resolve_conflicts, room_below)
+from .states import (ACTIVE, CITIZEN, CONDITIONS, COP, CORRUPTED, HONEST,
+                     JAILED, MORAL_STATES, QUIESCENT, SUSCEPTIBLE)
+
+# state of the agent standing on each cell: name -> (dtype, value of an
+# empty cell)
+CELL_FIELDS = {
+    "agent": (np.int64, -1),
+    "breed": (np.int8, NOT_APPLICABLE),
+    "hardship": (np.float64, np.nan),
+    "risk_aversion": (np.float64, np.nan),
+    "threshold": (np.float64, np.nan),
+    "grievance": (np.float64, np.nan),
+    "regime_legitimacy": (np.float64, np.nan),
+    "arrest_probability": (np.float64, np.nan),
+    "jail_sentence": (np.int32, 0),
+    "is_employed": (np.int8, NOT_APPLICABLE),
+    "moral_state": (np.int8, NOT_APPLICABLE),
+    "condition": (np.int8, NOT_APPLICABLE),
+    "free": (np.bool_, False),
+}
+# claims the tiles post on behalf of the agent standing on each cell
+CLAIM_FIELDS = {
+    "claim_target": (np.int64, -1),
+    "claim_priority": (np.float64, 0.0),
+    "claim_value": (np.int64, -1),
+    "moved": (np.bool_, False),
+}
+# ArrayEngine attributes a TiledEngine exposes as per-agent views
+AGENT_ARRAYS = ("breed", "hardship", "risk_aversion", "threshold",
+                "grievance", "regime_legitimacy", "arrest_probability",
+                "jail_sentence", "is_employed", "moral_state", "condition")
+
+
+def shared_arrays(fields, size):
+    """
+    Namespace of one array of `size` elements per field, each filled with
+    its empty value and backed by an anonymous shared memory mapping, so
+    that processes forked afterwards read and write the same memory.
+    """
+    arrays = SimpleNamespace()
+    for name, (dtype, fill) in fields.items():
+        dtype = np.dtype(dtype)
+        buffer = mmap.mmap(-1, max(1, size * dtype.itemsize))
+        array = np.frombuffer(buffer, dtype=dtype, count=size)
+        array[:] = fill
+        setattr(arrays, name, array)
+    return arrays
+
+
+def _threshold(priorities, room):
+    """
+    Lowest priority admitted when only the `room` highest of `priorities`
+    may pass.
+    """
+    if len(priorities) <= room:
+        return -np.inf
+    if room == 0:
+        return np.inf
+    return np.partition(priorities, len(priorities) - room)[-room]
+
+
+class Tile:
+    """
+    A band of consecutive grid columns x0..x1-1 (the contiguous cells
+    x0 * height .. x1 * height - 1) and the computations of a tick for the
+    agents standing on it. Every method is one sub-phase of
+    TiledEngine.step: it reads whatever cells it needs, its own and the
+    halo columns of its neighbors, from the shared arrays, but writes only
+    to its own cells, with two exceptions noted where they happen.
+
+    Attributes:
+        x0, x1: first and one past the last column of the tile
+        start, stop: first and one past the last cell of the tile
+        state: shared per-cell arrays (CELL_FIELDS and CLAIM_FIELDS)
+        stream: CellStream of the engine
+        tick: tick being computed
+    """
+
+    def __init__(self, engine, x0, x1):
+        m = engine.model
+        self.x0, self.x1 = x0, x1
+        self.index = engine.index
+        self.width, self.height = self.index.width, self.index.height
+        self.start, self.stop = x0 * self.height, x1 * self.height
+        self.own = slice(self.start, self.stop)
+        self.state = engine.state
+        self.neighbors = engine.neighbors[self.own]
+        self.stream = CellStream(engine.stream.key, engine.ncells)
+        self.tick = engine.tick
+        self.legitimacy = m.legitimacy
+        self.arrest_prob_constant = m.arrest_prob_constant
+        self.transmission_prob = m.corruption_transmission_prob
+        self.max_jail_term = m.max_jail_term
+        self.citizen_vision = m.citizen_vision if m.use_vision else None
+        self.cop_vision = m.cop_vision if m.use_vision else None
+        self._halos = {}
+        self._pending = None
+
+    def _draw(self, slot, low=0.0, high=1.0):
+        return self.stream.uniform(self.tick, slot, low, high, self.start,
+                                   self.stop)
+
+    def _halo(self, radius):
+        """
+        Cells of the tile and of the `radius` columns on either side.
+        """
+        if radius not in self._halos:
+            columns = np.unique(np.arange(self.x0 - radius,
+                                          self.x1 + radius) % self.width)
+            self._halos[radius] = (columns[:, None] * self.height +
+                                   np.arange(self.height)).ravel()
+        return self._halos[radius]
+
+    def _window(self, layer, radius):
+        """
+        space.window_sum of a boolean layer, given as a function of cell
+        ids, over the cells of the tile.
+        """
+        ncols = self.x1 - self.x0
+        length = min(2 * radius + 1, self.width)
+        columns = ((self.x0 - radius + np.arange(ncols + length - 1)) %
+                   self.width)
+        values = layer(columns[:, None] * self.height +
+                       np.arange(self.height)).astype(np.int64)
+        size = self.height
+        band = min(2 * radius + 1, size)
+        padded = np.take(values, np.arange(-radius, size + radius) % size,
+                         axis=1)
+        sums = np.insert(np.cumsum(padded, axis=1), 0, 0, axis=1)
+        values = sums[:, band:band + size] - sums[:, :size]
+        sums = np.insert(np.cumsum(values, axis=0), 0, 0, axis=0)
+        return (sums[length:length + ncols] - sums[:ncols]).ravel()
+
+    def _resolve(self, radius):
+        """
+        (targets, sources, priorities) of the winning claims on the cells
+        of the tile, looked up among the claims posted by the tile and its
+        halo.
+        """
+        s = self.state
+        sources = self._halo(radius)
+        targets = s.claim_target[sources]
+        mine = (targets >= self.start) & (targets < self.stop)
+        sources, targets = sources[mine], targets[mine]
+        priority = s.claim_priority[sources]
+        won = resolve_conflicts(targets, priority)
+        return targets[won], sources[won], priority[won]
+
+    def tally(self):
+        """
+        Counts of (citizens, unemployed, corrupted, honest) on the tile.
+        """
+        s, own = self.state, self.own
+        return np.array([np.count_nonzero(s.breed[own] == CITIZEN),
+                         np.count_nonzero(s.is_employed[own] == 0),
+                         np.count_nonzero(s.moral_state[own] == CORRUPTED),
+                         np.count_nonzero(s.moral_state[own] == HONEST)])
+
+    def begin(self, tick, key):
+        """
+        Phase 1: jailed citizens serve one tick. Returns the counts of
+        (free citizens, free unemployed, free corrupted).
+        """
+        self.tick = tick
+        self.stream.key = key
+        s, own = self.state, self.own
+        citizen = s.breed[own] == CITIZEN
+        jail = s.jail_sentence[own]
+        jailed = citizen & (jail > 0)
+        jail[jailed] -= 1
+        s.free[own] = citizen & ~jailed
+        free = citizen & (jail == 0)
+        return np.array([np.count_nonzero(free),
+                         np.count_nonzero(free & (s.is_employed[own] == 0)),
+                         np.count_nonzero(free & (s.moral_state[own] ==
+                                                  CORRUPTED))])
+
+    def activate(self, unemployment_sat, corruption_sat):
+        """
+        Phase 2: free citizens decide whether to be Active. The new
+        conditions are held back until commit_activation, since the other
+        tiles may still be reading the current ones.
+        """
+        s = self.state
+        local = np.flatnonzero(s.free[self.own])
+        cells = self.start + local
+
+        def is_active(c):
+            return (s.condition[c] == ACTIVE) & (s.jail_sentence[c] == 0)
+
+        if self.citizen_vision is not None:
+            cops = (self._window(lambda c: s.breed[c] == COP,
+                                 self.citizen_vision)[local] -
+                    (s.breed[cells] == COP))
+            actives = 1.0 + (self._window(is_active,
+                                          self.citizen_vision)[local] -
+                             is_active(cells))
+        else:
+            around = self.neighbors[local]
+            cops = (s.breed[around] == COP).sum(axis=1)
+            actives = 1.0 + is_active(around).sum(axis=1)
+        s.arrest_probability[cells] = 1 - np.exp(
+            -1 * self.arrest_prob_constant * (cops / actives))
+
+        weight = (self._draw(LEGITIMACY_WEIGHT, 0.3, 0.4)[local] *
+                  (unemployment_sat + corruption_sat))
+        non_corrupted = s.moral_state[cells] != CORRUPTED
+        s.regime_legitimacy[cells[non_corrupted]] = (
+            self.legitimacy - weight[non_corrupted])
+
+        net_risk = s.risk_aversion[cells] * s.arrest_probability[cells]
+        total_contribution = (
+            self._draw(W_UNEMPLOYMENT, 0.03, 0.43)[local] *
+            unemployment_sat +
+            self._draw(W_CORRUPTION, 0.01, 0.03)[local] * corruption_sat)
+        rebel = (s.grievance[cells] - net_risk >
+                 s.threshold[cells] - total_contribution)
+        condition = s.condition[cells]
+        condition[(condition == QUIESCENT) & rebel] = ACTIVE
+        condition[(condition == ACTIVE) & ~rebel] = QUIESCENT
+        self._pending = cells, condition
+
+    def commit_activation(self):
+        cells, condition = self._pending
+        self.state.condition[cells] = condition
+        self._pending = None
+
+    def spread_claims(self, moral):
+        """
+        Phase 3, first half: every free Corrupted (or Honest) citizen of
+        the tile posts its successful conversion attempt, if any, and (for
+        corruption) the neighbor whose job the convert would take. Returns
+        tally().
+        """
+        s = self.state
+        s.claim_target[self.own] = -1
+        local = np.flatnonzero(s.free[self.own] &
+                               (s.moral_state[self.own] == moral))
+        around = self.neighbors[local]
+        sources_ok = (s.agent[around] >= 0).sum(axis=1) > 1
+        susceptible = ((s.moral_state[around] == SUSCEPTIBLE) &
+                       (s.condition[around] == QUIESCENT))
+        choice = pick_among(susceptible, self._draw(CONTAGION_TARGET)[local])
+        trying = sources_ok & (choice >= 0)
+        local, around = local[trying], around[trying]
+        targets = around[np.arange(len(local)), choice[trying]]
+
+        roll = self._draw(CONTAGION_ROLL)[local]
+        if moral == CORRUPTED:
+            prob = (self.transmission_prob *
+                    self._draw(CONTAGION_SCALE, 0.001, 0.1)[local])
+            prob = prob + 0.07 * (s.is_employed[targets] == 0)
+        else:
+            prob = (self.transmission_prob *
+                    self._draw(CONTAGION_SCALE, 0.01, 0.1)[local])
+        success = roll < prob
+        local, around, targets = (local[success], around[success],
+                                  targets[success])
+        cells = self.start + local
+        s.claim_target[cells] = targets
+        s.claim_priority[cells] = self._draw(CONTAGION_PRIORITY)[local]
+        if moral == CORRUPTED:
+            employed_non_corrupted = (
+                (s.breed[around] == CITIZEN) &
+                (s.moral_state[around] != CORRUPTED) &
+                (s.is_employed[around] == 1))
+            victim = pick_among(employed_non_corrupted,
+                                self._draw(JOB_SWAP_VICTIM)[local])
+            swap = ((victim >= 0) & (s.is_employed[targets] == 0) &
+                    (self._draw(JOB_SWAP_ROLL)[local] < 0.06))
+            s.claim_value[cells] = np.where(
+                swap, around[np.arange(len(local)), victim], -1)
+        return self.tally()
+
+    def spread_resolve(self):
+        """
+        Phase 3, second half: pick the winning claim on each of the tile's
+        citizens. Returns the priorities of the winners, from which the
+        engine derives the threshold the saturation cap admits.
+        """
+        self._pending = self._resolve(1)
+        return self._pending[2]
+
+    def spread_commit(self, moral, threshold):
+        """
+        Phase 3, last: convert the admitted targets. A job swap writes to
+        the victim's cell, which may lie on a neighboring tile; all such
+        writes set is_employed to 0, so their order does not matter.
+        Returns tally().
+        """
+        s = self.state
+        targets, sources, priority = self._pending
+        admitted = priority >= threshold
+        targets, sources = targets[admitted], sources[admitted]
+        if moral == CORRUPTED:
+            victims = s.claim_value[sources]
+            swap = victims >= 0
+            s.is_employed[victims[swap]] = 0
+            s.is_employed[targets[swap]] = 1
+        s.moral_state[targets] = moral
+        self._pending = None
+        return self.tally()
+
+    def churn_draw(self, corruption_sat, honest_sat):
+        """
+        Phase 4, first half: unemployed citizens find jobs; returns the
+        priorities of the employed citizens losing theirs, whom the
+        unemployment cap may hold back.
+        """
+        s = self.state
+        local = np.flatnonzero(s.free[self.own])
+        cells = self.start + local
+        employed = s.is_employed[cells] == 1
+        rate = np.where(employed,
+                        self._draw(CHURN_RATE, 0.0, 0.09)[local] *
+                        corruption_sat,
+                        self._draw(CHURN_RATE, 0.0, 0.009)[local] *
+                        honest_sat)
+        change = self._draw(CHURN_ROLL)[local] < rate
+        losing = change & employed
+        s.is_employed[cells[change & ~employed]] = 1
+        priority = self._draw(CHURN_PRIORITY)[local[losing]]
+        self._pending = cells[losing], priority
+        return priority
+
+    def churn_commit(self, threshold):
+        losers, priority = self._pending
+        self.state.is_employed[losers[priority >= threshold]] = 0
+        self._pending = None
+
+    def move_claims(self, breed):
+        """
+        Phases 5 and 7, first: free citizens (or cops) of the tile post the
+        empty neighboring cell they try to move to.
+        """
+        s = self.state
+        s.claim_target[self.own] = -1
+        if breed == CITIZEN:
+            local = np.flatnonzero(s.free[self.own])
+        else:
+            local = np.flatnonzero(s.breed[self.own] == COP)
+        around = self.neighbors[local]
+        choice = pick_among(s.agent[around] < 0,
+                            self._draw(MOVE_CHOICE)[local])
+        moving = choice >= 0
+        local = local[moving]
+        cells = self.start + local
+        s.claim_target[cells] = around[moving, choice[moving]]
+        s.claim_priority[cells] = self._draw(MOVE_PRIORITY)[local]
+
+    def move_resolve(self):
+        """
+        Copy the winning mover into each contested empty cell of the tile
+        and flag its old cell, which may lie on a neighboring tile; every
+        mover claims one cell, so each flag has a single writer.
+        """
+        s = self.state
+        destinations, sources, _ = self._resolve(1)
+        for name in CELL_FIELDS:
+            values = getattr(s, name)
+            values[destinations] = values[sources]
+        s.moved[sources] = True
+
+    def move_clear(self):
+        """
+        Empty the cells of the tile whose agent moved away.
+        """
+        s = self.state
+        cells = self.start + np.flatnonzero(s.moved[self.own])
+        for name, (_, fill) in CELL_FIELDS.items():
+            getattr(s, name)[cells] = fill
+        s.moved[cells] = False
+
+    def arrest_claims(self):
+        """
+        Phase 6, first half: every cop of the tile picks a free Active
+        citizen within reach and posts it with the sentence it would give.
+        """
+        s = self.state
+        s.claim_target[self.own] = -1
+        local = np.flatnonzero(s.breed[self.own] == COP)
+        cells = self.start + local
+        if self.cop_vision is not None:
+            around = self.index.around(cells, self.cop_vision, True)
+        else:
+            around = self.neighbors[local]
+        free_active = ((s.condition[around] == ACTIVE) &
+                       (s.jail_sentence[around] == 0))
+        choice = pick_among(free_active, self._draw(ARREST_CHOICE)[local])
+        arresting = choice >= 0
+        local, cells = local[arresting], cells[arresting]
+        s.claim_target[cells] = around[arresting, choice[arresting]]
+        s.claim_priority[cells] = self._draw(ARREST_PRIORITY)[local]
+        s.claim_value[cells] = (self._draw(SENTENCE)[local] *
+                                (self.max_jail_term + 1)).astype(np.int32)
+
+    def arrest_commit(self):
+        """
+        Phase 6, second half: the cop with the highest priority claim on a
+        citizen of the tile jails it.
+        """
+        s = self.state
+        targets, sources, _ = self._resolve(self.cop_vision or 1)
+        s.jail_sentence[targets] = s.claim_value[sources]
+        s.condition[targets] = JAILED
+
+    def count(self):
+        """
+        (2, 9) array of the citizen counts of model.citizen_counts for the
+        tile: rows free and jailed, columns total, Employed, Unemployed,
+        then every condition and every moral state.
+        """
+        s, own = self.state, self.own
+        citizen = s.breed[own] == CITIZEN
+        jailed = s.jail_sentence[own] > 0
+        employed = s.is_employed[own]
+        rows = []
+        for mask in (citizen & ~jailed, citizen & jailed):
+            rows.append(np.concatenate([
+                [np.count_nonzero(mask),
+                 np.count_nonzero(mask & (employed == 1)),
+                 np.count_nonzero(mask & (employed == 0))],
+                np.bincount(s.condition[own][mask],
+                            minlength=len(CONDITIONS)),
+                np.bincount(s.moral_state[own][mask],
+                            minlength=len(MORAL_STATES))]))
+        return np.array(rows)
+
+
+def _serve(tile, connection):
+    """
+    Worker process loop: run the tile's methods as the engine requests.
+    """
+    while True:
+        command, args = connection.recv()
+        if command is None:
+            break
+        try:
+            connection.send((True, getattr(tile, command)(*args)))
+        except Exception:
+            connection.send((False, traceback.format_exc()))
+    connection.close()
+
+
+def _stop(workers):
+    for process, connection in workers:
+        try:
+            connection.send((None, ()))
+        except OSError:
+            pass
+        process.join()
+
+
+def _agent_view(name):
+    def get(self):
+        return getattr(self.state, name)[self.cell]
+
+    def set(self, values):
+        getattr(self.state, name)[self.cell] = values
+
+    return property(get, set, doc="Per-agent view of state.%s" % name)
+
+
+class TiledEngine:
+    """
+    ArrayEngine split over worker processes for very large grids. The
+    grid's columns are cut into `workers` bands of about equal width
+    (Tile), each computed by its own process. All state lives in per-cell
+    arrays in shared memory, so the halo columns a tile needs from its
+    neighbors (one column on either side, citizen_vision or cop_vision
+    columns with use_vision) are read straight from the memory the
+    neighbors write, with no copies.
+
+    A tick runs ArrayEngine's phases in the same order, each split into
+    sub-phases separated by a barrier: the engine sends a sub-phase to
+    every worker and waits for all of them to finish it before sending the
+    next. Within a sub-phase every tile reads the state as it was at the
+    barrier and writes only to its own cells, except where noted in Tile.
+    Interactions that cross a tile boundary are claims: the tile of the
+    acting agent (mover, cop, corruptor or honest citizen) posts the cell
+    it acts on, and after the barrier the tile owning that cell picks the
+    winning claim, the one with the highest priority draw, and applies
+    it. A move copies the mover's state into its new cell; its old tile
+    empties the old cell after the next barrier. Saturation caps are
+    global: the engine gathers the priorities of the successful claims
+    from all tiles and admits the highest ones.
+
+    Random numbers are drawn per cell from the same CellStream as the
+    numpy engine, and the update semantics are ArrayEngine's, so a run
+    gives the same results as engine="numpy" with the same seed, whatever
+    the number of workers (except for exact ties between priority draws,
+    which are vanishingly unlikely). Model-level counts are summed from
+    the tiles at the end of every tick.
+
+    The workers are forked on the first step and stopped by close(); a
+    later step starts them again. Forking makes this engine Linux-only;
+    with workers=1 the tick runs in the model's own process instead.
+
+    Attributes:
+        workers: number of tiles
+        tiles: the Tile of every worker
+        state: shared per-cell arrays (CELL_FIELDS and CLAIM_FIELDS)
+        neighbors: (cells, 4) table of von Neumann neighbor cells
+        stream: CellStream all random numbers are drawn from
+        tick: number of completed steps
+        cell, cell_agent, breed, ...: per-agent views of the state, as the
+            ArrayEngine attributes of the same names
+    """
+
+    def __init__(self, model, workers=None):
+        # draw the population exactly as the numpy engine does
+        population = ArrayEngine(model)
+        self.model = model
+        self.index = population.index
+        self.ncells = population.ncells
+        self.neighbors = population.neighbors
+        self.stream = population.stream
+        self.tick = population.tick
+        self.state = shared_arrays(dict(CELL_FIELDS, **CLAIM_FIELDS),
+                                   self.ncells)
+        self.cell = population.cell
+        for name in AGENT_ARRAYS:
+            setattr(self, name, getattr(population, name))
+        if workers is None:
+            workers = os.cpu_count() or 1
+        self.workers = max(1, min(workers, self.index.width))
+        bounds = np.linspace(0, self.index.width,
+                             self.workers + 1).astype(int)
+        self.tiles = [Tile(self, x0, x1)
+                      for x0, x1 in zip(bounds[:-1], bounds[1:])]
+        self._processes = None
+        self._finalizer = None
+        self.sync_counts()
+
+    x = ArrayEngine.x
+    y = ArrayEngine.y
+    agent_columns = ArrayEngine.agent_columns
+
+    @property
+    def cell(self):
+        occupied = np.flatnonzero(self.state.agent >= 0)
+        cells = np.empty(len(occupied), dtype=np.int64)
+        cells[self.state.agent[occupied]] = occupied
+        return cells
+
+    @cell.setter
+    def cell(self, cells):
+        for name, (_, fill) in CELL_FIELDS.items():
+            getattr(self.state, name)[:] = fill
+        self.state.agent[cells] = np.arange(len(cells))
+
+    @property
+    def cell_agent(self):
+        return self.state.agent.copy()
+
+    @cell_agent.setter
+    def cell_agent(self, agents):
+        self.state.agent[:] = agents
+
+    breed = _agent_view("breed")
+    hardship = _agent_view("hardship")
+    risk_aversion = _agent_view("risk_aversion")
+    threshold = _agent_view("threshold")
+    grievance = _agent_view("grievance")
+    regime_legitimacy = _agent_view("regime_legitimacy")
+    arrest_probability = _agent_view("arrest_probability")
+    jail_sentence = _agent_view("jail_sentence")
+    is_employed = _agent_view("is_employed")
+    moral_state = _agent_view("moral_state")
+    condition = _agent_view("condition")
+
+    def _start(self):
+        context = multiprocessing.get_context("fork")
+        self._processes = []
+        for tile in self.tiles:
+            connection, child = context.Pipe()
+            process = context.Process(target=_serve, args=(tile, child),
+                                      daemon=True)
+            process.start()
+            child.close()
+            self._processes.append((process, connection))
+        self._finalizer = weakref.finalize(self, _stop, self._processes)
+
+    def close(self):
+        """
+        Stop the worker processes.
+        """
+        if self._finalizer is not None:
+            self._finalizer()
+        self._processes = self._finalizer = None
+
+    def _run(self, command, *args):
+        """
+        Run one sub-phase on every tile and wait for all of them; returns
+        their results in tile order.
+        """
+        if self.workers == 1:
+            return [getattr(self.tiles[0], command)(*args)]
+        if self._processes is None:
+            self._start()
+        for _, connection in self._processes:
+            connection.send((command, args))
+        results = []
+        failure = None
+        for _, connection in self._processes:
+            ok, result = connection.recv()
+            if not ok:
+                failure = result
+            results.append(result)
+        if failure is not None:
+            raise RuntimeError("tile worker failed:\n" + failure)
+        return results
+
+    def step(self):
+        """
+        Advance all agents by one tick.
+        """
+        m = self.model
+        profiler = m.profiler
+        if profiler is not None:
+            profiler.start()
+        self.tick += 1
+        free, unemployed, corrupted = sum(self._run("begin", self.tick,
+                                                    self.stream.key))
+        if profiler is not None:
+            profiler.lap("citizen", "jail")
+        unemployment_sat = int(unemployed) / int(free)
+        corruption_sat = int(corrupted) / int(free)
+        self._run("activate", unemployment_sat, corruption_sat)
+        self._run("commit_activation")
+        if profiler is not None:
+            profiler.lap("citizen", "activation")
+        for moral, cap, phase in (
+                (CORRUPTED, m.max_corruption_saturation, "corruption"),
+                (HONEST, m.max_honest_saturation, "honesty")):
+            citizens, _, corrupted, honest = sum(
+                self._run("spread_claims", moral))
+            count = corrupted if moral == CORRUPTED else honest
+            priorities = np.concatenate(self._run("spread_resolve"))
+            threshold = _threshold(priorities,
+                                   room_below(int(count), int(citizens), cap))
+            tally = sum(self._run("spread_commit", moral, threshold))
+            if profiler is not None:
+                profiler.lap("citizen", phase)
+        citizens, unemployed, corrupted, honest = (int(n) for n in tally)
+        priorities = np.concatenate(self._run(
+            "churn_draw", corrupted / citizens, honest / citizens))
+        room = room_below(unemployed, citizens, m.max_unemployed_saturation)
+        self._run("churn_commit", _threshold(priorities, room))
+        if profiler is not None:
+            profiler.lap("citizen", "employment")
+        if m.movement:
+            self._move(CITIZEN)
+        if profiler is not None:
+            profiler.lap("citizen", "movement")
+        self._run("arrest_claims")
+        self._run("arrest_commit")
+        if profiler is not None:
+            profiler.lap("cop", "arrest")
+        if m.movement:
+            self._move(COP)
+        if profiler is not None:
+            profiler.lap("cop", "movement")
+        self._store_counts(sum(self._run("count")))
+        if profiler is not None:
+            profiler.lap("model", "counts")
+
+    def _move(self, breed):
+        self._run("move_claims", breed)
+        self._run("move_resolve")
+        self._run("move_clear")
+
+    def _store_counts(self, tally):
+        counts = self.model.citizen_counts
+        names = (("total", "Employed", "Unemployed") + CONDITIONS +
+                 MORAL_STATES)
+        for bucket, row in ((counts.free, tally[0]),
+                            (counts.jailed, tally[1])):
+            bucket.clear()
+            bucket.update({name: int(n) for name, n in zip(names, row)})
+
+    def sync_counts(self):
+        """
+        Refresh model.citizen_counts from the shared state, in the model's
+        own process.
+        """
+        self._store_counts(Tile(self, 0, self.index.width).count())
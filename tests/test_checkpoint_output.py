@@ -0,0 +1,44 @@
+import pandas as pd
+import pytest
+
+from epstein_civil_violence.model import EpsteinCivilViolence
+from epstein_civil_violence.output import RunOutput, open_table
+
+pytest.importorskip("pyarrow")
+
+PARAMETERS = dict(height=20, width=20, max_iters=30, seed=5)
+
+
+def agent_table(output):
+    return open_table(output.path("agents")).to_pandas().sort_values(
+        ["Step", "AgentID"], ignore_index=True)
+
+
+@pytest.mark.parametrize("format", ["parquet", "arrow"])
+def test_resume_into_output(tmp_path, format):
+    reference = RunOutput(tmp_path / "reference", format, flush_every=4,
+                          agents=True)
+    EpsteinCivilViolence(output=reference, **PARAMETERS).run_model()
+
+    directory = tmp_path / "resumed"
+    output = RunOutput(directory, format, flush_every=4, agents=True)
+    model = EpsteinCivilViolence(output=output, **PARAMETERS)
+    for _ in range(12):
+        model.step()
+    model.save_checkpoint(str(tmp_path / "step_12.npz"))
+    # the run goes on past the checkpoint and stops without closing
+    for _ in range(6):
+        model.step()
+    output.flush()
+
+    output = RunOutput(directory, format, flush_every=4, agents=True)
+    model = EpsteinCivilViolence.from_checkpoint(
+        str(tmp_path / "step_12.npz"), output=output)
+    model.run_model()
+
+    expected = open_table(reference.path("model")).to_pandas()
+    written = open_table(output.path("model")).to_pandas()
+    assert written["Step"].tolist() == list(range(len(written)))
+    pd.testing.assert_frame_equal(written, expected)
+    pd.testing.assert_frame_equal(agent_table(output),
+                                  agent_table(reference))
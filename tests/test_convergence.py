@@ -0,0 +1,55 @@
+from types import SimpleNamespace
+
+from epstein_civil_violence.convergence import ConvergenceDetector
+
+
+def run(detector, series):
+    """
+    Feed a sequence of Jailed values to a detector; the step it stops at
+    and why, or (None, None).
+    """
+    values = iter(series)
+    model = SimpleNamespace(
+        datacollector=SimpleNamespace(
+            model_reporters={"Jailed": lambda m: m.value}),
+        schedule=SimpleNamespace(steps=0), value=None)
+    for step, value in enumerate(values):
+        model.schedule.steps, model.value = step, value
+        reason = detector.update(model)
+        if reason is not None:
+            return step, reason
+    return None, None
+
+
+def test_fixed_point():
+    detector = ConvergenceDetector(series=("Jailed",), window=20)
+    step, reason = run(detector, [5] * 10 + [7] * 40)
+    assert (step, reason) == (30, "fixed point")
+
+
+def test_slow_drift_is_not_a_fixed_point():
+    detector = ConvergenceDetector(series=("Jailed",), window=20,
+                                   tolerance=1)
+    assert run(detector, range(200)) == (None, None)
+
+
+def test_noise_within_tolerance_is_a_fixed_point():
+    detector = ConvergenceDetector(series=("Jailed",), window=20,
+                                   tolerance=1)
+    step, reason = run(detector, [3, 4] * 30)
+    assert (step, reason) == (20, "fixed point")
+
+
+def test_cycle():
+    detector = ConvergenceDetector(series=("Jailed",), window=20,
+                                   max_period=3)
+    step, reason = run(detector, [0, 10, 20] * 20)
+    assert reason == "periodic" and detector.period == 3
+
+
+def test_drifting_cycle_is_not_periodic():
+    detector = ConvergenceDetector(series=("Jailed",), window=20,
+                                   tolerance=1, max_period=3)
+    series = [value + step // 3 for step, value in
+              enumerate([0, 10, 20] * 40)]
+    assert run(detector, series) == (None, None)